@@ -0,0 +1,358 @@
+"""
+Headless, iterative voltage and bowl calibration.
+
+The calibration alternates a voltage correction and a bowl correction (as voltage_corr_main and
+bowl_correction_main), but works on a stratified subsample of the ions: it starts small and grows the
+sample geometrically each time an iteration stops moving the ions of the main peak. The position and mass
+resolving power (MRP) of the peak are logged after each iteration, and nothing is plotted until the end.
+The fitted corrections are returned as a list of steps that apply_steps applies to any (e.g. the full)
+dataset.
+"""
+import time
+
+import matplotlib.pyplot as plt
+import numpy as np
+from numba import njit
+from scipy.optimize import curve_fit
+
+# Local module and scripts
+from pyccapt.calibration.calibration import calibration
+
+
+def stratified_subsample(num_ions, sample_size, rng):
+    """
+    Pick sample_size ions, one at random from each of sample_size equal strata of the ion sequence.
+
+    The sample follows the whole experiment (voltage ramp, detector ageing) and stays in ion sequence
+    order, which the 'ion_seq' voltage windows rely on.
+
+    Args:
+        num_ions (int): Number of ions.
+        sample_size (int): Number of ions to pick.
+        rng (np.random.Generator): Random generator.
+
+    Returns:
+        np.ndarray: Sorted indices of the picked ions.
+    """
+    if sample_size >= num_ions:
+        return np.arange(num_ions)
+    edges = np.linspace(0, num_ions, sample_size + 1).astype(np.int64)
+    return rng.integers(edges[:-1], np.maximum(edges[1:], edges[:-1] + 1))
+
+
+def peak_mrp(values, bin_size, window):
+    """
+    Position and mass resolving power (position / FWHM) of the highest peak in a window.
+
+    Args:
+        values (np.ndarray): t or mc of the ions.
+        bin_size (float): Size of the histogram bins.
+        window (tuple): (left, right) side of the peak window.
+
+    Returns:
+        tuple: (position, mrp) of the peak; the half maximum crossings are interpolated linearly.
+    """
+    left, right = window
+    values = values[(values > left) & (values < right)]
+    num_bins = max(int((right - left) / bin_size), 3)
+    hist = np.bincount(np.minimum(((values - left) / bin_size).astype(np.int64), num_bins - 1),
+                       minlength=num_bins).astype(np.float64)
+    peak = int(np.argmax(hist))
+    half = hist[peak] / 2
+    position = left + (peak + 0.5) * bin_size
+
+    below = np.flatnonzero(hist[:peak] < half)
+    if len(below) > 0:
+        i = below[-1]
+        low = i + (half - hist[i]) / (hist[i + 1] - hist[i])
+    else:
+        low = 0.0
+    below = np.flatnonzero(hist[peak:] < half)
+    if len(below) > 0:
+        i = peak + below[0]
+        high = i - (half - hist[i]) / (hist[i - 1] - hist[i])
+    else:
+        high = float(num_bins - 1)
+    fwhm = max(high - low, 1.0) * bin_size
+    return position, position / fwhm
+
+
+def correction_factor(step, high_voltage, x_det, y_det):
+    """
+    Correction factor of one calibration step; the calibrated value is the value divided by the factor.
+
+    Args:
+        step (dict): Calibration step from auto_calibration ('kind', 'fit_mode' and 'model').
+        high_voltage (np.ndarray): High voltage of the ions (V).
+        x_det (np.ndarray): Detector x of the ions (cm).
+        y_det (np.ndarray): Detector y of the ions (cm).
+
+    Returns:
+        np.ndarray: Correction factor of each ion.
+    """
+    model = step['model']
+    if step['kind'] == 'voltage':
+        if step['fit_mode'] == 'curve_fit':
+            f_v = calibration.voltage_corr(high_voltage, *model)
+        else:
+            f_v = model.predict(np.asarray(high_voltage).reshape(-1, 1))
+        return np.sqrt(f_v)
+    # The bowl is fitted in mm
+    x = np.asarray(x_det) * 10
+    y = np.asarray(y_det) * 10
+    if step['fit_mode'] == 'curve_fit':
+        return calibration.bowl_corr([x, y], *model)
+    return model.predict(np.column_stack((x, y)))
+
+
+@njit(cache=True)
+def _apply_polynomial_steps(values, high_voltage, x, y, voltage_coefficients, bowl_coefficients):
+    """
+    Divide the values by the voltage (sqrt of voltage_corr) and bowl (bowl_corr) factors of all steps in
+    one pass over the ions.
+    """
+    calibrated = np.empty(len(values))
+    for i in range(len(values)):
+        v = high_voltage[i]
+        f_v = 1.0
+        for k in range(voltage_coefficients.shape[0]):
+            c = voltage_coefficients[k]
+            f_v *= c[0] + c[1] * v + c[2] * v * v
+        f_bowl = 1.0
+        for k in range(bowl_coefficients.shape[0]):
+            c = bowl_coefficients[k]
+            f_bowl *= (c[0] + c[1] * x[i] + c[2] * y[i] + c[3] * x[i] * x[i] + c[4] * x[i] * y[i] +
+                       c[5] * y[i] * y[i])
+        calibrated[i] = values[i] / (np.sqrt(f_v) * f_bowl)
+    return calibrated
+
+
+def apply_steps(steps, values, high_voltage, x_det, y_det, chunk_size=1_000_000):
+    """
+    Apply calibration steps to t or mc values.
+
+    If all steps are curve_fit polynomials, all of them are applied in one compiled pass over the ions.
+    Otherwise the factors of all steps are multiplied chunk by chunk, so the ions are divided only once and
+    the intermediate arrays stay small.
+
+    Args:
+        steps (list): Calibration steps from auto_calibration.
+        values (np.ndarray): t or mc of the ions.
+        high_voltage (np.ndarray): High voltage of the ions (V).
+        x_det (np.ndarray): Detector x of the ions (cm).
+        y_det (np.ndarray): Detector y of the ions (cm).
+        chunk_size (int): Number of ions calibrated at once.
+
+    Returns:
+        np.ndarray: The calibrated values.
+    """
+    if all(step['fit_mode'] == 'curve_fit' for step in steps):
+        voltage = [step['model'] for step in steps if step['kind'] == 'voltage']
+        bowl = [step['model'] for step in steps if step['kind'] == 'bowl']
+        return _apply_polynomial_steps(np.asarray(values, dtype=np.float64),
+                                       np.asarray(high_voltage, dtype=np.float64),
+                                       np.asarray(x_det, dtype=np.float64) * 10,
+                                       np.asarray(y_det, dtype=np.float64) * 10,
+                                       np.array(voltage, dtype=np.float64).reshape(-1, 3),
+                                       np.array(bowl, dtype=np.float64).reshape(-1, 6))
+
+    calibrated = np.array(values, dtype=np.float64)
+    for start in range(0, len(calibrated), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        factor = np.ones(len(calibrated[chunk]))
+        for step in steps:
+            factor *= correction_factor(step, high_voltage[chunk], x_det[chunk], y_det[chunk])
+        calibrated[chunk] /= factor
+    return calibrated
+
+
+class _FactorProduct:
+    """
+    Product of the factors (f_v for voltage, not its sqrt) of several steps of one kind, as a model with a
+    predict method that compile_model can sample.
+    """
+
+    def __init__(self, steps):
+        self.steps = steps
+
+    def predict(self, X):
+        factor = np.ones(len(X))
+        for step in self.steps:
+            if step['fit_mode'] != 'curve_fit':
+                factor *= step['model'].predict(X)
+            elif step['kind'] == 'voltage':
+                factor *= calibration.voltage_corr(X[:, 0], *step['model'])
+            else:
+                factor *= calibration.bowl_corr([X[:, 0], X[:, 1]], *step['model'])
+        return factor
+
+
+def fold_steps(steps, voltage_range, bowl_ranges, voltage_resolution=1.0, bowl_resolution=0.25):
+    """
+    Fold the steps of each kind that has a fitted estimator into one lookup table step.
+
+    The product of the factors of all voltage (or bowl) steps is sampled on a grid with
+    calibration.compile_model, so applying the steps costs one interpolation per kind instead of one
+    estimator predict per step. Kinds whose steps are all curve_fit polynomials are kept as they are, as
+    apply_steps evaluates them in one compiled pass.
+
+    Args:
+        steps (list): Calibration steps from auto_calibration.
+        voltage_range (tuple): (min, max) high voltage (V) of the voltage table.
+        bowl_ranges (list): [(x_min, x_max), (y_min, y_max)] detector position (mm) of the bowl table.
+        voltage_resolution (float): Grid spacing of the voltage table in V.
+        bowl_resolution (float): Grid spacing of the bowl table in mm.
+
+    Returns:
+        list: The folded steps; the 'model' of a folded step is a calibration.LookupTableModel.
+    """
+    folded = []
+    for kind, ranges, resolution in (('voltage', [voltage_range], voltage_resolution),
+                                     ('bowl', bowl_ranges, bowl_resolution)):
+        kind_steps = [step for step in steps if step['kind'] == kind]
+        if all(step['fit_mode'] == 'curve_fit' for step in kind_steps):
+            folded += kind_steps
+        else:
+            model = calibration.compile_model(_FactorProduct(kind_steps), ranges, resolution)
+            folded.append({'kind': kind, 'fit_mode': 'lookup', 'model': model})
+    return folded
+
+
+def _fit_voltage(high_voltage, values, maximum_location, num_windows, bin_size, fit_mode):
+    """
+    Voltage correction step fitted on the ions of the peak window.
+    """
+    window_size = max(len(values) // num_windows, 1)
+    high_voltage_sample, t_sample = calibration.ion_sequence_samples(high_voltage, values, window_size,
+                                                                     'histogram', bin_size)
+    t_sample = t_sample / maximum_location
+    if fit_mode == 'curve_fit':
+        model, _ = curve_fit(calibration.voltage_corr, high_voltage_sample, t_sample)
+    else:
+        model = calibration.robust_voltage_fit(high_voltage_sample, t_sample)
+    return {'kind': 'voltage', 'fit_mode': fit_mode, 'model': model}
+
+
+def _fit_bowl(x_det, y_det, values, maximum_location, cell_size, bin_size, fit_mode):
+    """
+    Bowl correction step fitted on the ions close to the peak (the mean of a cell is robust there, while a
+    cell histogram is too sparse on a subsample).
+    """
+    x_sample, y_sample, t_sample = calibration.bowl_samples(x_det * 10, y_det * 10, values, cell_size,
+                                                            maximum_location, 'mean', bin_size)
+    if fit_mode == 'curve_fit':
+        model, _ = curve_fit(calibration.bowl_corr, [x_sample, y_sample], t_sample)
+    elif fit_mode == 'ml_fit':
+        model = calibration.hybrid_calibration_model(x_sample, y_sample, t_sample)
+    else:
+        model = calibration.robust_fit(x_sample, y_sample, t_sample)
+    return {'kind': 'bowl', 'fit_mode': fit_mode, 'model': model}
+
+
+def auto_calibration(values, high_voltage, x_det, y_det, window, bin_size=0.1, voltage_fit='curve_fit',
+                     bowl_fit='curve_fit', voltage_windows=100, bowl_cell_size=5, initial_sample_size=50_000,
+                     growth=4, max_sample_size=2_000_000, tolerance=2e-4, max_iterations=20, seed=0, plot=False):
+    """
+    Iterative voltage and bowl calibration on a growing stratified subsample.
+
+    Each iteration fits a voltage correction and then a bowl correction on the ions of the subsample that
+    are in the peak window, and measures how far they move the peak ions (the 99th percentile of the
+    relative shift). When the shift is below the tolerance, the sample grows by the growth factor, up to
+    max_sample_size. The calibration stops when it has converged on the largest sample or after
+    max_iterations. The position and MRP of the peak are logged after each iteration. The steps of the
+    estimator fits are folded into lookup tables (see fold_steps) before all ions are calibrated.
+
+    Args:
+        values (np.ndarray): t (ns) or mc (Da) of all ions, e.g. after initial_calibration.
+        high_voltage (np.ndarray): High voltage of the ions (V).
+        x_det (np.ndarray): Detector x of the ions (cm).
+        y_det (np.ndarray): Detector y of the ions (cm).
+        window (tuple): (left, right) side of the main peak.
+        bin_size (float): Size of the histogram bins.
+        voltage_fit (str): Voltage fit ('curve_fit' or 'robust_fit').
+        bowl_fit (str): Bowl fit ('curve_fit', 'robust_fit' or 'ml_fit').
+        voltage_windows (int): Number of ion sequence windows of the voltage correction.
+        bowl_cell_size (int): Size of the bowl correction detector cells in mm.
+        initial_sample_size (int): Number of ions of the first subsample.
+        growth (float): Factor by which the subsample grows.
+        max_sample_size (int): Largest subsample.
+        tolerance (float): Relative shift of the peak ions regarded as converged.
+        max_iterations (int): Maximum number of iterations.
+        seed (int): Seed of the subsampling.
+        plot (bool): Plot the convergence and the calibrated histogram at the end.
+
+    Returns:
+        dict: 'steps' (the fitted corrections, see apply_steps), 'calibrated' (the calibrated values of all
+              ions), 'log' (one entry per iteration: sample size, peak position, MRP and relative shift),
+              'position' and 'mrp' of the calibrated peak, 'converged' (False if max_iterations was
+              reached first) and 'time'.
+    """
+    start_time = time.time()
+    values = np.asarray(values, dtype=np.float64)
+    high_voltage = np.asarray(high_voltage, dtype=np.float64)
+    x_det = np.asarray(x_det, dtype=np.float64)
+    y_det = np.asarray(y_det, dtype=np.float64)
+    rng = np.random.default_rng(seed)
+    num_ions = len(values)
+    max_sample_size = min(max_sample_size, num_ions)
+
+    steps = []
+    log = []
+    converged = False
+    sample_size = min(initial_sample_size, max_sample_size)
+    index = stratified_subsample(num_ions, sample_size, rng)
+    sample = values[index]
+    for iteration in range(max_iterations):
+        peak = (sample > window[0]) & (sample < window[1])
+        maximum_location = peak_mrp(sample, bin_size, window)[0]
+        before = sample[peak]
+
+        new_steps = [_fit_voltage(high_voltage[index][peak], sample[peak], maximum_location, voltage_windows,
+                                  bin_size, voltage_fit)]
+        sample = apply_steps(new_steps, sample, high_voltage[index], x_det[index], y_det[index])
+        position, mrp = peak_mrp(sample, bin_size, window)
+        close = np.abs(sample - position) < 2 * position / mrp
+        new_steps.append(_fit_bowl(x_det[index][close], y_det[index][close], sample[close], maximum_location,
+                                   bowl_cell_size, bin_size, bowl_fit))
+        sample = apply_steps(new_steps[1:], sample, high_voltage[index], x_det[index], y_det[index])
+        steps += new_steps
+
+        # Shift of the peak ions by this iteration, relative to their value
+        change = float(np.percentile(np.abs(sample[peak] / before - 1), 99))
+        position, mrp = peak_mrp(sample, bin_size, window)
+        log.append({'iteration': iteration, 'sample_size': len(index), 'position': position, 'mrp': mrp,
+                    'change': change})
+
+        if change < tolerance:
+            if sample_size >= max_sample_size:
+                converged = True
+                break
+            sample_size = min(int(sample_size * growth), max_sample_size)
+            index = stratified_subsample(num_ions, sample_size, rng)
+            sample = apply_steps(steps, values[index], high_voltage[index], x_det[index], y_det[index])
+
+    steps = fold_steps(steps, (np.min(high_voltage), np.max(high_voltage)),
+                       [(np.min(x_det) * 10, np.max(x_det) * 10), (np.min(y_det) * 10, np.max(y_det) * 10)])
+    calibrated = apply_steps(steps, values, high_voltage, x_det, y_det)
+    position, mrp = peak_mrp(calibrated, bin_size, window)
+    elapsed = time.time() - start_time
+    if converged:
+        print('Calibration converged after %s iterations in %.1f s: peak at %.4f, MRP %.1f' %
+              (len(log), elapsed, position, mrp))
+    else:
+        print('Calibration did not converge after %s iterations (last relative shift %.2e, tolerance %.2e, '
+              'sample size %s) in %.1f s: peak at %.4f, MRP %.1f' %
+              (len(log), log[-1]['change'] if log else np.nan, tolerance, len(index), elapsed, position, mrp))
+
+    if plot:
+        fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(10, 4), constrained_layout=True)
+        ax1.plot([entry['mrp'] for entry in log], marker='o')
+        ax1.set_xlabel('Iteration')
+        ax1.set_ylabel('MRP (FWHM)')
+        ax2.hist(calibrated[(calibrated > window[0]) & (calibrated < window[1])],
+                 bins=max(int((window[1] - window[0]) / bin_size), 1), histtype='step', log=True)
+        ax2.set_xlabel('Calibrated t/mc')
+        plt.show()
+
+    return {'steps': steps, 'calibrated': calibrated, 'log': log, 'position': position, 'mrp': mrp,
+            'converged': converged, 'time': elapsed}
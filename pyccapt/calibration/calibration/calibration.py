@@ -1,7 +1,5 @@
 from copy import copy
-from itertools import product
 from math import ceil
-import concurrent.futures
 import multiprocessing
 import fast_histogram
 import matplotlib.pyplot as plt
@@ -17,6 +15,7 @@ from sklearn.preprocessing import PolynomialFeatures
 from sklearn.pipeline import make_pipeline
 from sklearn.ensemble import GradientBoostingRegressor
 from matplotlib.tri import Triangulation
+from numba import njit
 
 
 
@@ -59,6 +58,101 @@ def robust_voltage_fit(dld_highVoltage, dld_t):
     return model
 
 
+def window_histogram_peaks(values, sample_size, bin_size, max_cells=2 ** 24):
+    """
+    Histogram peak of each window of sample_size consecutive values.
+
+    All windows share one bin grid, so the histograms of a block of windows are one 2-D histogram
+    (window x bin) built with a single np.bincount. The peak of each window is the argmax bin, refined with
+    a parabola through the argmax bin and its neighbours.
+
+    Parameters:
+    - values (array): The values, e.g. the t of the ions in the order of the ion sequence.
+    - sample_size (int): Number of values per window; the last window may be shorter.
+    - bin_size (float): Size of the bin.
+    - max_cells (int): Maximum size of the 2-D histogram of a block of windows.
+
+    Returns:
+    - array: The peak position of each window.
+
+    """
+    values = np.asarray(values, dtype=np.float64)
+    num_windows = ceil(len(values) / sample_size)
+    peaks = np.full(num_windows, np.nan)
+    if num_windows == 0:
+        return peaks
+    low = np.min(values)
+    num_bins = int((np.max(values) - low) / bin_size) + 1
+    bin_index = np.minimum(((values - low) / bin_size).astype(np.int64), num_bins - 1)
+
+    block = max(max_cells // num_bins, 1)
+    for first in range(0, num_windows, block):
+        last = min(first + block, num_windows)
+        index = bin_index[first * sample_size:last * sample_size]
+        window = np.arange(len(index)) // sample_size
+        hist = np.bincount(window * num_bins + index, minlength=(last - first) * num_bins)
+        hist = hist.reshape(last - first, num_bins)
+
+        peak_bin = np.argmax(hist, axis=1)
+        # Parabolic refinement with the neighbouring bins (no refinement at the edges of the grid)
+        left = hist[np.arange(last - first), np.maximum(peak_bin - 1, 0)].astype(np.float64)
+        center = hist[np.arange(last - first), peak_bin].astype(np.float64)
+        right = hist[np.arange(last - first), np.minimum(peak_bin + 1, num_bins - 1)].astype(np.float64)
+        curvature = left - 2 * center + right
+        inner = (peak_bin > 0) & (peak_bin < num_bins - 1) & (curvature < 0)
+        shift = np.zeros(last - first)
+        shift[inner] = 0.5 * (left[inner] - right[inner]) / curvature[inner]
+        peaks[first:last] = low + (peak_bin + 0.5 + shift) * bin_size
+    return peaks
+
+
+def ion_sequence_samples(dld_highVoltage, dld_t, sample_size, sample_range_max, bin_size):
+    """
+    Voltage and t samples of the windows of sample_size consecutive ions ('ion_seq' mode of
+    voltage_correction).
+
+    Parameters:
+    - dld_highVoltage (array): High voltage of the ions.
+    - dld_t (array): t (or mc) of the ions.
+    - sample_size (int): Number of ions per window.
+    - sample_range_max (string): Type of peak_x mode (histogram/mean/median).
+    - bin_size (float): Size of the bin.
+
+    Returns:
+    - tuple: (high voltage, t) of each window. With 'histogram' t is the histogram peak of the window and the
+      high voltage the mean of the ions within one (or, if there are none, two or four) bins of the peak.
+
+    """
+    dld_highVoltage = np.asarray(dld_highVoltage, dtype=np.float64)
+    dld_t = np.asarray(dld_t, dtype=np.float64)
+    num_windows = ceil(len(dld_t) / sample_size)
+    window = np.arange(len(dld_t)) // sample_size
+    counts = np.bincount(window, minlength=num_windows)
+    t_mean = np.bincount(window, weights=dld_t, minlength=num_windows) / counts
+    high_voltage_mean = np.bincount(window, weights=dld_highVoltage, minlength=num_windows) / counts
+
+    if sample_range_max == 'histogram':
+        t_sample = window_histogram_peaks(dld_t, sample_size, bin_size)
+        high_voltage_sample = np.full(num_windows, np.nan)
+        distance = np.abs(dld_t - t_sample[window])
+        for width in (bin_size, 2 * bin_size, 4 * bin_size):
+            near = distance <= width
+            near_counts = np.bincount(window[near], minlength=num_windows)
+            near_sum = np.bincount(window[near], weights=dld_highVoltage[near], minlength=num_windows)
+            update = np.isnan(high_voltage_sample) & (near_counts > 0)
+            high_voltage_sample[update] = near_sum[update] / near_counts[update]
+        # Windows without ions near the peak
+        missing = np.isnan(high_voltage_sample)
+        high_voltage_sample[missing] = high_voltage_mean[missing]
+        return high_voltage_sample, t_sample
+    elif sample_range_max == 'median':
+        high_voltage_sample = np.array([np.median(dld_highVoltage[i * sample_size:(i + 1) * sample_size])
+                                        for i in range(num_windows)])
+        t_sample = np.array([np.median(dld_t[i * sample_size:(i + 1) * sample_size]) for i in range(num_windows)])
+        return high_voltage_sample, t_sample
+    return high_voltage_mean, t_mean
+
+
 def voltage_correction(dld_highVoltage_peak, dld_t_peak, variables, maximum_location, index_fig, figname, sample_size,
                        mode, calibration_mode, sample_range_max, bin_size, plot=True, save=False,
                        fig_size=(5, 5), model='poly'):
@@ -89,51 +183,9 @@ def voltage_correction(dld_highVoltage_peak, dld_t_peak, variables, maximum_loca
     dld_t_peak_list = []
     high_voltage_mean_list = []
     if mode == 'ion_seq':
-        for i in range(int(len(dld_highVoltage_peak) / sample_size) + 1):
-            dld_highVoltage_peak_selected = dld_highVoltage_peak[i * sample_size:(i + 1) * sample_size]
-            dld_t_peak_selected = dld_t_peak[i * sample_size:(i + 1) * sample_size]
-            if sample_range_max == 'histogram':
-                try:
-                    bins = np.linspace(np.min(dld_t_peak_selected), np.max(dld_t_peak_selected),
-                                       round(np.max(dld_t_peak_selected) / bin_size))
-                    y, x = np.histogram(dld_t_peak_selected, bins=bins)
-                    peaks, properties = find_peaks(y, height=0)
-                    index_peak_max_ini = np.argmax(properties['peak_heights'])
-                    max_peak = peaks[index_peak_max_ini]
-                    dld_t_peak_list.append(x[max_peak] / maximum_location)
-                    # dld_t_peak_list.append(maximum_location / x[max_peak])
-                    mask_v = np.logical_and((dld_t_peak_selected >= x[max_peak] - bin_size)
-                                            , (dld_t_peak_selected <= x[max_peak] + bin_size))
-                    if len(dld_highVoltage_peak_selected[mask_v]) == 0:
-                        mask_v = np.logical_and((dld_t_peak_selected >= x[max_peak] - 2 * bin_size)
-                                                , (dld_t_peak_selected <= x[max_peak] + 2 * bin_size))
-                        if len(dld_highVoltage_peak_selected[mask_v]) == 0:
-                            print('length of mask voltage', len(dld_highVoltage_peak_selected[mask_v]))
-                            mask_v = np.logical_and((dld_t_peak_selected >= x[max_peak] - 4 * bin_size)
-                                                    , (dld_t_peak_selected <= x[max_peak] + 4 * bin_size))
-                            print('length of mask voltage after increase the window',
-                                  len(dld_highVoltage_peak_selected[mask_v]))
-                    high_voltage_mean_list.append(np.mean(dld_highVoltage_peak_selected[mask_v]))
-                except ValueError:
-                    # print('cannot find the maximum')
-                    dld_t_mean = np.mean(dld_t_peak_selected)
-                    dld_t_peak_list.append(dld_t_mean / maximum_location)
-                    # dld_t_peak_list.append(maximum_location / dld_t_mean)
-                    high_voltage_mean = np.mean(dld_highVoltage_peak_selected)
-                    high_voltage_mean_list.append(high_voltage_mean)
-            elif sample_range_max == 'mean':
-                dld_t_mean = np.mean(dld_t_peak_selected)
-                dld_t_peak_list.append(dld_t_mean / maximum_location)
-                # dld_t_peak_list.append(maximum_location / dld_t_mean)
-                high_voltage_mean = np.mean(dld_highVoltage_peak_selected)
-                high_voltage_mean_list.append(high_voltage_mean)
-            elif sample_range_max == 'median':
-                # dld_t_mean = np.median(dld_t_peak_selected)
-                dld_t_peak_list.append(dld_t_mean / maximum_location)
-                dld_t_peak_list.append(maximum_location / dld_t_mean)
-                high_voltage_mean = np.median(dld_highVoltage_peak_selected)
-                high_voltage_mean_list.append(high_voltage_mean)
-
+        high_voltage_mean_list, dld_t_peak_list = ion_sequence_samples(dld_highVoltage_peak, dld_t_peak, sample_size,
+                                                                      sample_range_max, bin_size)
+        dld_t_peak_list = dld_t_peak_list / maximum_location
     elif mode == 'voltage':
         for i in range(int((np.max(dld_highVoltage_peak) - np.min(dld_highVoltage_peak)) / sample_size) + 1):
             mask = np.logical_and((dld_highVoltage_peak >= (np.min(dld_highVoltage_peak) + (i) * sample_size)),
@@ -224,7 +276,8 @@ def voltage_correction(dld_highVoltage_peak, dld_t_peak, variables, maximum_loca
 
 def voltage_corr_main(dld_highVoltage, variables, sample_size, mode, calibration_mode, index_fig, plot, save,
                       maximum_cal_method='mean', maximum_sample_method='mean', fig_size=(5, 5), fast_calibration=False,
-                      bin_size=0.01, model='poly', peak_maximum=0, calibration_apply=True):
+                      bin_size=0.01, model='poly', peak_maximum=0, calibration_apply=True, calibration_model=None,
+                      lookup_resolution=None):
     """
     Perform voltage correction on the given data.
 
@@ -242,6 +295,10 @@ def voltage_corr_main(dld_highVoltage, variables, sample_size, mode, calibration
         fig_size (tuple, optional): Size of the figure. Defaults to (5, 5).
         fast_calibration (bool, optional): Whether to perform fast calibration. Defaults to False.
         bin_size (float, optional): Size of the bin. Defaults to 0.01.
+        calibration_model (CalibrationModel, optional): If given, the fitted correction is added to it when it
+                                                        is applied.
+        lookup_resolution (float, optional): If given, a robust_fit model is compiled into a lookup table with
+                                             this voltage resolution (V) before it is applied to all ions.
     """
     print('The left and right side of the main peak is:', variables.selected_x1, variables.selected_x2)
     if calibration_mode == 'tof':
@@ -309,6 +366,9 @@ def voltage_corr_main(dld_highVoltage, variables, sample_size, mode, calibration
 
     calibration_mc_tof = np.copy(variables.dld_t_calib) if calibration_mode == 'tof' else np.copy(variables.mc_calib)
     print('The fit result is:', fitresult)
+    if lookup_resolution is not None and model != 'curve_fit':
+        fitresult = compile_model(fitresult, [(np.min(dld_highVoltage), np.max(dld_highVoltage))], lookup_resolution)
+        print('The error of the lookup table is:', fitresult.error)
     mask_fv = np.ones_like(dld_highVoltage, dtype=bool)
 
     if model == 'curve_fit':
@@ -394,6 +454,8 @@ def voltage_corr_main(dld_highVoltage, variables, sample_size, mode, calibration
             variables.dld_t_calib = calibration_mc_tof
         elif calibration_mode == 'mc':
             variables.mc_calib = calibration_mc_tof
+        if calibration_model is not None:
+            calibration_model.add_step('voltage', model, fitresult)
     return f_v
 
 
@@ -463,6 +525,100 @@ def robust_fit(dld_x, dld_y, dld_t, degree=2):
 
     return model
 
+
+@njit(cache=True)
+def _bilinear_lookup(table, x_start, y_start, x_step, y_step, x, y):
+    """
+    Bilinear interpolation of a regular grid; points outside the grid take the value at its border.
+    """
+    num_x, num_y = table.shape
+    result = np.empty(len(x))
+    for i in range(len(x)):
+        fx = min(max((x[i] - x_start) / x_step, 0.0), num_x - 1.0)
+        fy = min(max((y[i] - y_start) / y_step, 0.0), num_y - 1.0)
+        ix = min(int(fx), num_x - 2)
+        iy = min(int(fy), num_y - 2)
+        wx = fx - ix
+        wy = fy - iy
+        result[i] = ((1 - wx) * ((1 - wy) * table[ix, iy] + wy * table[ix, iy + 1]) +
+                     wx * ((1 - wy) * table[ix + 1, iy] + wy * table[ix + 1, iy + 1]))
+    return result
+
+
+class LookupTableModel:
+    """
+    A fitted model sampled on a regular grid of its 1 (V) or 2 (x_det, y_det) inputs.
+
+    predict interpolates the grid (linearly in 1-D, bilinearly in 2-D), so it replaces the predict of the
+    sampled estimator at the cost of a memory-bound pass over the points.
+
+    Attributes:
+        axes (list): Grid coordinates of each input.
+        table (numpy.ndarray): Model values on the grid.
+        resolution (float): Grid spacing.
+        error (dict): Error of the lookup against the exact model on random points (see compile_model).
+    """
+
+    def __init__(self, axes, table, resolution, error=None):
+        self.axes = axes
+        self.table = table
+        self.resolution = resolution
+        self.error = error
+
+    def predict(self, X):
+        """
+        Interpolated model values.
+
+        Args:
+            X (numpy.ndarray): Points of shape (n, 1) or (n, 2).
+
+        Returns:
+            numpy.ndarray: Model value of each point.
+        """
+        X = np.asarray(X, dtype=np.float64)
+        if len(self.axes) == 1:
+            return np.interp(X[:, 0], self.axes[0], self.table)
+        x_axis, y_axis = self.axes
+        return _bilinear_lookup(self.table, x_axis[0], y_axis[0], x_axis[1] - x_axis[0], y_axis[1] - y_axis[0],
+                                np.ascontiguousarray(X[:, 0]), np.ascontiguousarray(X[:, 1]))
+
+
+def compile_model(model, ranges, resolution, num_test=100_000, seed=0):
+    """
+    Sample a fitted model (e.g. of robust_voltage_fit, hybrid_calibration_model or robust_fit) on a grid.
+
+    The model is evaluated once per grid point instead of once per ion. The error of the lookup is measured
+    against the exact model on num_test random points within the ranges.
+
+    Args:
+        model: Fitted model with a predict method.
+        ranges (list): (min, max) of each input, e.g. [(v_min, v_max)] or [(x_min, x_max), (y_min, y_max)].
+        resolution (float): Grid spacing in units of the inputs (V or mm).
+        num_test (int): Number of random points of the error statistics.
+        seed (int): Seed of the random points.
+
+    Returns:
+        LookupTableModel: The compiled model. Its error attribute holds the maximum and mean absolute error
+        and the maximum relative error of the lookup (over the points where the model is not zero, NaN if
+        there are none).
+    """
+    axes = [np.linspace(low, high, max(int(np.ceil((high - low) / resolution)) + 1, 2)) for low, high in ranges]
+    grid = np.meshgrid(*axes, indexing='ij')
+    table = model.predict(np.column_stack([g.ravel() for g in grid])).reshape(grid[0].shape)
+    lookup = LookupTableModel(axes, np.ascontiguousarray(table, dtype=np.float64), resolution)
+
+    rng = np.random.default_rng(seed)
+    test = np.column_stack([rng.uniform(low, high, num_test) for low, high in ranges])
+    exact = model.predict(test)
+    difference = np.abs(lookup.predict(test) - exact)
+    # The relative error is only defined where the exact model is not zero
+    nonzero = exact != 0
+    max_rel = float(np.max(difference[nonzero] / np.abs(exact[nonzero]))) if np.any(nonzero) else np.nan
+    lookup.error = {'max_abs': float(np.max(difference)), 'mean_abs': float(np.mean(difference)),
+                    'max_rel': max_rel}
+    return lookup
+
+
 def compute_sample(i, j, d, dld_x_bowl, dld_y_bowl, dld_t_bowl, maximum_location, sample_range_max, bin_size):
     """
     Compute the sample for the given data.
@@ -526,6 +682,118 @@ def compute_sample(i, j, d, dld_x_bowl, dld_y_bowl, dld_t_bowl, maximum_location
     return None, None, None  # Return None if no samples found
 
 
+@njit(cache=True)
+def _histogram_peak(values, bin_size):
+    """
+    Position of the highest local maximum of the histogram of values, as in compute_sample ('histogram'
+    mode): the left edge of the peak bin, or nan if the histogram cannot be built or has no local maximum.
+    """
+    low = values.min()
+    high = values.max()
+    num_bins = round(high / bin_size) - 1
+    if num_bins < 1 or high <= low:
+        return np.nan
+    hist = np.zeros(num_bins, dtype=np.int64)
+    scale = num_bins / (high - low)
+    for value in values:
+        index = int((value - low) * scale)
+        if index < num_bins:
+            hist[index] += 1
+
+    # Local maxima as in scipy.signal.find_peaks (the middle of flat peaks), the highest one wins
+    peak = -1
+    i = 1
+    while i < num_bins - 1:
+        if hist[i - 1] < hist[i]:
+            ahead = i + 1
+            while ahead < num_bins - 1 and hist[ahead] == hist[i]:
+                ahead += 1
+            if hist[ahead] < hist[i]:
+                middle = (i + ahead - 1) // 2
+                if peak < 0 or hist[middle] > hist[peak]:
+                    peak = middle
+                i = ahead
+                continue
+        i += 1
+    if peak < 0:
+        return np.nan
+    return low + peak * (high - low) / num_bins
+
+
+@njit(cache=True)
+def _cell_statistics(offsets, x, y, t, histogram, bin_size):
+    """
+    Median x and y and the mean or histogram peak of t of the ions of each cell; the ions of cell k are
+    x[offsets[k]:offsets[k + 1]].
+    """
+    num_cells = len(offsets) - 1
+    x_sample = np.empty(num_cells)
+    y_sample = np.empty(num_cells)
+    t_sample = np.empty(num_cells)
+    for k in range(num_cells):
+        start = offsets[k]
+        stop = offsets[k + 1]
+        x_sample[k] = np.median(x[start:stop])
+        y_sample[k] = np.median(y[start:stop])
+        t_sample[k] = np.nan
+        if histogram:
+            t_sample[k] = _histogram_peak(t[start:stop], bin_size)
+        if np.isnan(t_sample[k]):
+            t_sample[k] = np.mean(t[start:stop])
+    return x_sample, y_sample, t_sample
+
+
+def bowl_samples(dld_x_bowl, dld_y_bowl, dld_t_bowl, sample_size, maximum_location, sample_range_max,
+                 bin_size=0.01):
+    """
+    Sample the detector on a grid of square cells for the bowl correction.
+
+    The ions are binned into the cells of compute_sample in one pass: each ion gets a cell id, the ions are
+    sorted once by cell, and the statistics of each cell are computed over its contiguous slice.
+
+    Args:
+        dld_x_bowl (numpy.ndarray): X coordinates of the data points.
+        dld_y_bowl (numpy.ndarray): Y coordinates of the data points.
+        dld_t_bowl (numpy.ndarray): Time values of the data points.
+        sample_size (int): Size of each cell in mm.
+        maximum_location (float): Maximum location for normalization.
+        sample_range_max (str): Sample range maximum ('mean' or 'histogram').
+        bin_size (float): Size of the bin.
+
+    Returns:
+        x_sample (numpy.ndarray): Median x of the ions of each non-empty cell.
+        y_sample (numpy.ndarray): Median y of the ions of each non-empty cell.
+        dld_t_peak (numpy.ndarray): Mean or histogram peak of t of each non-empty cell, over maximum_location.
+    """
+    x = np.asarray(dld_x_bowl, dtype=np.float64)
+    y = np.asarray(dld_y_bowl, dtype=np.float64)
+    t = np.asarray(dld_t_bowl, dtype=np.float64)
+    d = sample_size
+    w1 = int(np.floor(np.min(x)))
+    w2 = int(np.ceil(np.max(x)))
+    h1 = int(np.floor(np.min(y)))
+    h2 = int(np.ceil(np.max(y)))
+    num_x = len(range(w1, w2 - w2 % d, d))
+    num_y = len(range(h1, h2 - h2 % d, d))
+
+    # Cell of each ion; ions on a cell border belong to no cell
+    cell_x = np.floor((x - w1) / d)
+    cell_y = np.floor((y - h1) / d)
+    edge_x = w1 + cell_x * d
+    edge_y = h1 + cell_y * d
+    inside = ((cell_x >= 0) & (cell_x < num_x) & (cell_y >= 0) & (cell_y < num_y) &
+              (x > edge_x) & (x < edge_x + d) & (y > edge_y) & (y < edge_y + d))
+    # A small integer type lets the stable argsort use a radix sort
+    cell = (cell_y * num_x + cell_x)[inside].astype(np.min_scalar_type(max(num_x * num_y - 1, 0)))
+
+    order = np.argsort(cell, kind='stable')
+    counts = np.bincount(cell, minlength=num_x * num_y)
+    offsets = np.concatenate(([0], np.cumsum(counts[counts > 0])))
+    x_sample, y_sample, t_sample = _cell_statistics(offsets, x[inside][order], y[inside][order],
+                                                    t[inside][order], sample_range_max == 'histogram', bin_size)
+    return x_sample, y_sample, t_sample / maximum_location
+
+
 def bowl_correction(dld_x_bowl, dld_y_bowl, dld_t_bowl, variables, det_diam, maximum_location, sample_range_max,
                     sample_size, calibration_mode, fit_mode, index_fig, plot, save, fig_size=(7, 5), bin_size=0.01):
     """
@@ -550,32 +818,9 @@ def bowl_correction(dld_x_bowl, dld_y_bowl, dld_t_bowl, variables, det_diam, max
     Returns:
         parameters (numpy.ndarray): Optimized parameters of the bowl correction.
     """
-    x_sample_list = []
-    y_sample_list = []
-    dld_t_peak_list = []
-
-    w1 = int(np.floor(np.min(dld_x_bowl)))
-    w2 = int(np.ceil(np.max(dld_x_bowl)))
-    h1 = int(np.floor(np.min(dld_y_bowl)))
-    h2 = int(np.ceil(np.max(dld_y_bowl)))
-
-    d = sample_size  # sample size is in mm
-    grid = product(range(h1, h2 - h2 % d, d), range(w1, w2 - w2 % d, d))
+    x_sample_list, y_sample_list, dld_t_peak_list = bowl_samples(dld_x_bowl, dld_y_bowl, dld_t_bowl, sample_size,
+                                                                 maximum_location, sample_range_max, bin_size)
 
-    # Use ThreadPoolExecutor or ProcessPoolExecutor
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = [executor.submit(compute_sample, i, j, d, dld_x_bowl, dld_y_bowl, dld_t_bowl, maximum_location,
-                                   sample_range_max, bin_size)
-                   for i, j in grid]
-
-        for future in concurrent.futures.as_completed(futures):
-            x_sample, y_sample, dld_t_peak = future.result()
-            if x_sample is not None:
-                x_sample_list.append(x_sample)
-                y_sample_list.append(y_sample)
-                dld_t_peak_list.append(dld_t_peak)
-
-    # The rest of your function remains unchanged
     print('x_sample_list max and min:', np.max(x_sample_list), np.min(x_sample_list))
     print('y_sample_list max and min:', np.max(y_sample_list), np.min(y_sample_list))
     print('dld_t_peak_list max and min:', np.max(dld_t_peak_list), np.min(dld_t_peak_list))
@@ -643,13 +888,16 @@ def bowl_correction(dld_x_bowl, dld_y_bowl, dld_t_bowl, variables, det_diam, max
 
 def bowl_correction_main(dld_x, dld_y, dld_highVoltage, variables, det_diam, sample_size, fit_mode, calibration_mode,
                          index_fig, plot, save, maximum_cal_method='mean', maximum_sample_method='mean',
-                         fig_size=(5, 5), fast_calibration=False, bin_size=0.01, peak_maximum=0, calibration_apply=True):
+                         fig_size=(5, 5), fast_calibration=False, bin_size=0.01, peak_maximum=0, calibration_apply=True,
+                         calibration_model=None, lookup_resolution=None):
     """
     Perform bowl correction on the input data and plot the results.
 
+    The positions are converted to mm, so the bowl is fitted (and added to calibration_model) in mm.
+
     Args:
-        dld_x (numpy.ndarray): X positions.
-        dld_y (numpy.ndarray): Y positions.
+        dld_x (numpy.ndarray): X positions (cm).
+        dld_y (numpy.ndarray): Y positions (cm).
         dld_highVoltage (numpy.ndarray): High voltage values.
         det_diam (float): Detector diameter.
         sample_size (int): Sample size.
@@ -663,6 +911,11 @@ def bowl_correction_main(dld_x, dld_y, dld_highVoltage, variables, det_diam, sam
         fig_size (tuple, optional): Figure size.
         fast_calibration (bool, optional): Flag indicating whether to perform fast calibration.
         bin_size (float, optional): Size of the bin.
+        calibration_model (CalibrationModel, optional): If given, the fitted correction is added to it when it
+                                                        is applied.
+        lookup_resolution (float, optional): If given, an ml_fit or robust_fit model is compiled into a lookup
+                                             table over the range of dld_x and dld_y converted to mm, with
+                                             this resolution (mm), before it is applied to all ions.
 
     Returns:
         None
@@ -722,6 +975,11 @@ def bowl_correction_main(dld_x, dld_y, dld_highVoltage, variables, det_diam, sam
                                  fit_mode=fit_mode, index_fig=index_fig, plot=plot, save=save, fig_size=fig_size,
                                  bin_size=bin_size)
     print('The fit result is:', parameters)
+    if lookup_resolution is not None and fit_mode != 'curve_fit':
+        # dld_x and dld_y are in mm here, as the fit and CalibrationModel.compile
+        parameters = compile_model(parameters, [(np.min(dld_x), np.max(dld_x)), (np.min(dld_y), np.max(dld_y))],
+                                   lookup_resolution)
+        print('The error of the lookup table is:', parameters.error)
 
     mask_fv = np.ones_like(dld_x, dtype=bool)
 
@@ -877,6 +1135,8 @@ def bowl_correction_main(dld_x, dld_y, dld_highVoltage, variables, det_diam, sam
             variables.dld_t_calib = calibration_mc_tof
         elif calibration_mode == 'mc':
             variables.mc_calib = calibration_mc_tof
+        if calibration_model is not None:
+            calibration_model.add_step('bowl', fit_mode, parameters)
     return f_bowl
 
 def plot_fdm(x, y, variables, save, bins_s, index_fig, figure_size=(5, 4)):
@@ -0,0 +1,287 @@
+"""
+Serializable calibration model.
+
+A CalibrationModel keeps everything needed to recalibrate a dataset without fitting again: the voltage and
+bowl correction steps (in the format of auto_calibration: 'kind', 'fit_mode' and the fitted coefficients or
+estimator), the optional initial calibration, the optional peak fit from t or mc to mc, t0, the flight path
+length and the detector geometry. It is saved to and loaded from a group of an HDF5 file, e.g. next to the
+processed data, and applied chunk by chunk to new or streamed data.
+"""
+import pickle
+
+import h5py
+import numpy as np
+
+# Local module and scripts
+from pyccapt.calibration.calibration import auto_calibration, calibration
+from pyccapt.calibration.mc import mc_tools
+
+# Factor of the pulse voltage in the voltage seen by the ions in voltage pulse mode (as in the tutorials)
+PULSE_FACTOR = 0.7
+
+
+class CalibrationModel:
+    """
+    Fitted calibration of a dataset.
+
+    Attributes:
+        calibration_mode (str): 'tof' (the corrections apply to t) or 'mc' (they apply to mc_uc).
+        flight_path_length (float): Flight path length in mm.
+        t0 (float): Time of flight offset in ns.
+        pulse_mode (str): 'voltage' or 'laser'.
+        det_diam (float): Detector diameter in mm.
+        steps (list): Correction steps, applied in order (see auto_calibration.apply_steps).
+        mean_distance (float): Mean squared flight distance (mm^2) of the initial calibration, or None.
+        mean_voltage (float): Mean voltage (V) of the initial calibration, or None.
+        mc_fit (np.ndarray): Coefficients of the peak fit to mc, or None. In tof mode (t0, c, d) of
+                             mc = c * (t - t0) ** 2 + d * t, in mc mode (a, b) of mc ** a + b or (a, b, c) of
+                             mc ** a + b * mc + c.
+    """
+
+    def __init__(self, calibration_mode, flight_path_length, t0=0.0, pulse_mode='voltage', det_diam=80.0,
+                 steps=None, mean_distance=None, mean_voltage=None, mc_fit=None):
+        """
+        Create a calibration model.
+
+        Args:
+            calibration_mode (str): 'tof' or 'mc'.
+            flight_path_length (float): Flight path length in mm.
+            t0 (float): Time of flight offset in ns.
+            pulse_mode (str): 'voltage' or 'laser'.
+            det_diam (float): Detector diameter in mm.
+            steps (list): Optional. Correction steps, e.g. the 'steps' of auto_calibration.
+            mean_distance (float): Optional. Mean squared flight distance (mm^2) of the initial calibration.
+            mean_voltage (float): Optional. Mean voltage (V) of the initial calibration.
+            mc_fit (np.ndarray): Optional. Coefficients of the peak fit to mc.
+        """
+        self.calibration_mode = calibration_mode
+        self.flight_path_length = float(flight_path_length)
+        self.t0 = float(t0)
+        self.pulse_mode = pulse_mode
+        self.det_diam = float(det_diam)
+        self.steps = list(steps) if steps is not None else []
+        self.mean_distance = mean_distance
+        self.mean_voltage = mean_voltage
+        self.mc_fit = None if mc_fit is None else np.asarray(mc_fit, dtype=np.float64)
+
+    def add_step(self, kind, fit_mode, model):
+        """
+        Add a correction step.
+
+        Args:
+            kind (str): 'voltage' (a function of the voltage in V) or 'bowl' (a function of the detector
+                        position in mm, as fitted by bowl_correction_main).
+            fit_mode (str): 'curve_fit' (model holds the coefficients of voltage_corr or bowl_corr),
+                            'robust_fit', 'ml_fit' or 'lookup' (model is a fitted estimator or a
+                            calibration.LookupTableModel, e.g. from auto_calibration.fold_steps).
+            model: The fitted coefficients or estimator.
+        """
+        if fit_mode == 'curve_fit':
+            model = np.asarray(model, dtype=np.float64)
+        self.steps.append({'kind': kind, 'fit_mode': fit_mode, 'model': model})
+
+    def compile(self, voltage_range, voltage_resolution=1.0, bowl_resolution=0.25):
+        """
+        Replace the fitted estimators of the steps with lookup tables (see calibration.compile_model).
+
+        The bowl tables cover the detector, -det_diam / 2 to det_diam / 2 in mm (the unit the bowl steps are
+        fitted in, see add_step), the voltage tables voltage_range.
+
+        Args:
+            voltage_range (tuple): (min, max) voltage (V) of the voltage tables.
+            voltage_resolution (float): Grid spacing of the voltage tables in V.
+            bowl_resolution (float): Grid spacing of the bowl tables in mm.
+
+        Returns:
+            list: Error statistics of each compiled step.
+        """
+        errors = []
+        radius = self.det_diam / 2
+        for step in self.steps:
+            if step['fit_mode'] == 'curve_fit' or isinstance(step['model'], calibration.LookupTableModel):
+                continue
+            if step['kind'] == 'voltage':
+                step['model'] = calibration.compile_model(step['model'], [voltage_range], voltage_resolution)
+            else:
+                step['model'] = calibration.compile_model(step['model'], [(-radius, radius), (-radius, radius)],
+                                                          bowl_resolution)
+            errors.append(step['model'].error)
+        return errors
+
+    def set_initial_calibration(self, data):
+        """
+        Keep the means of the initial calibration (see calibration.initial_calibration) of a dataset.
+
+        Args:
+            data (pd.DataFrame): Dataset with the columns 'high_voltage (V)', 'x_det (cm)' and 'y_det (cm)'.
+        """
+        x = data['x_det (cm)'].to_numpy() * 10
+        y = data['y_det (cm)'].to_numpy() * 10
+        self.mean_distance = float(np.mean(x ** 2 + y ** 2 + self.flight_path_length ** 2))
+        self.mean_voltage = float(np.mean(data['high_voltage (V)'].to_numpy()))
+
+    def voltage(self, high_voltage, pulse=None):
+        """
+        Voltage used by the voltage correction: the high voltage plus PULSE_FACTOR times the pulse voltage in
+        voltage pulse mode.
+
+        Args:
+            high_voltage (np.ndarray): High voltage (V).
+            pulse (np.ndarray): Optional. Pulse voltage (V).
+
+        Returns:
+            np.ndarray: The voltage.
+        """
+        if self.pulse_mode == 'voltage' and pulse is not None:
+            return high_voltage + PULSE_FACTOR * pulse
+        return high_voltage
+
+    def apply(self, values, voltage, x_det, y_det, high_voltage=None, chunk_size=5_000_000):
+        """
+        Apply the initial calibration (if any) and the correction steps to t or mc values.
+
+        Args:
+            values (np.ndarray): t (ns) in tof mode, mc_uc (Da) in mc mode.
+            voltage (np.ndarray): Voltage of the voltage correction (see voltage).
+            x_det (np.ndarray): Detector x (cm).
+            y_det (np.ndarray): Detector y (cm).
+            high_voltage (np.ndarray): Optional. High voltage (V) of the initial calibration. Defaults to
+                                       voltage.
+            chunk_size (int): Number of ions calibrated at once.
+
+        Returns:
+            np.ndarray: The calibrated t (ns) or mc (Da).
+        """
+        values = np.asarray(values, dtype=np.float64)
+        voltage = np.asarray(voltage, dtype=np.float64)
+        x_det = np.asarray(x_det, dtype=np.float64)
+        y_det = np.asarray(y_det, dtype=np.float64)
+        high_voltage = voltage if high_voltage is None else np.asarray(high_voltage, dtype=np.float64)
+        calibrated = np.empty(len(values))
+        for start in range(0, len(values), chunk_size):
+            chunk = slice(start, start + chunk_size)
+            values_chunk = values[chunk]
+            if self.mean_distance is not None:
+                distance = (x_det[chunk] * 10) ** 2 + (y_det[chunk] * 10) ** 2 + self.flight_path_length ** 2
+                values_chunk = values_chunk * (self.mean_distance / distance *
+                                               np.sqrt(high_voltage[chunk] / self.mean_voltage))
+            calibrated[chunk] = auto_calibration.apply_steps(self.steps, values_chunk, voltage[chunk],
+                                                             x_det[chunk], y_det[chunk])
+        return calibrated
+
+    def to_mc(self, values, high_voltage, x_det, y_det, pulse):
+        """
+        Mass-to-charge ratio of calibrated values.
+
+        In tof mode, mc is the peak fit of the calibrated t, or tof2mc of the calibrated t if there is no peak
+        fit. In mc mode, mc is the peak fit of the calibrated mc, or the calibrated mc itself.
+
+        Args:
+            values (np.ndarray): Calibrated t (ns) or mc (Da).
+            high_voltage (np.ndarray): High voltage (V).
+            x_det (np.ndarray): Detector x (cm).
+            y_det (np.ndarray): Detector y (cm).
+            pulse (np.ndarray): Pulse voltage (V).
+
+        Returns:
+            np.ndarray: mc (Da).
+        """
+        if self.calibration_mode == 'tof':
+            if self.mc_fit is None:
+                return mc_tools.tof2mc(values, self.t0, high_voltage, x_det, y_det, self.flight_path_length, pulse,
+                                       mode=self.pulse_mode)
+            t0, c, d = self.mc_fit
+            return c * ((values - t0) ** 2) + d * values
+        if self.mc_fit is None:
+            return values
+        if len(self.mc_fit) == 2:
+            return values ** self.mc_fit[0] + self.mc_fit[1]
+        return values ** self.mc_fit[0] + self.mc_fit[1] * values + self.mc_fit[2]
+
+    def __call__(self, data):
+        """
+        Calibrate a processed chunk, e.g. as the calibration of stream_processing.raw_to_processed_streaming.
+
+        Args:
+            data (pd.DataFrame): Processed data with the columns 't (ns)', 'high_voltage (V)', 'pulse',
+                                 'x_det (cm)', 'y_det (cm)' and, in mc mode, 'mc_uc (Da)'.
+
+        Returns:
+            tuple: (mc, t_c) of the chunk. t_c is t in mc mode.
+        """
+        t = data['t (ns)'].to_numpy()
+        high_voltage = data['high_voltage (V)'].to_numpy()
+        pulse = data['pulse'].to_numpy()
+        x_det = data['x_det (cm)'].to_numpy()
+        y_det = data['y_det (cm)'].to_numpy()
+        voltage = self.voltage(high_voltage, pulse)
+        if self.calibration_mode == 'tof':
+            t_c = self.apply(t, voltage, x_det, y_det, high_voltage)
+            return self.to_mc(t_c, high_voltage, x_det, y_det, pulse), t_c
+        mc = self.apply(data['mc_uc (Da)'].to_numpy(), voltage, x_det, y_det, high_voltage)
+        return self.to_mc(mc, high_voltage, x_det, y_det, pulse), t
+
+    def save(self, filename, group_name='calibration'):
+        """
+        Save the model to a group of an HDF5 file, replacing the group if it exists.
+
+        The coefficients are stored as datasets, fitted estimators (robust_fit, ml_fit) as pickled bytes.
+
+        Args:
+            filename (str): Path of the HDF5 file, e.g. the processed data file.
+            group_name (str): Name of the group.
+        """
+        with h5py.File(filename, 'a') as f:
+            if group_name in f:
+                del f[group_name]
+            group = f.create_group(group_name)
+            group.attrs['calibration_mode'] = self.calibration_mode
+            group.attrs['flight_path_length'] = self.flight_path_length
+            group.attrs['t0'] = self.t0
+            group.attrs['pulse_mode'] = self.pulse_mode
+            group.attrs['det_diam'] = self.det_diam
+            group.attrs['num_steps'] = len(self.steps)
+            if self.mean_distance is not None:
+                group.attrs['mean_distance'] = self.mean_distance
+                group.attrs['mean_voltage'] = self.mean_voltage
+            if self.mc_fit is not None:
+                group.create_dataset('mc_fit', data=self.mc_fit)
+            for i, step in enumerate(self.steps):
+                step_group = group.create_group('step_%03d' % i)
+                step_group.attrs['kind'] = step['kind']
+                step_group.attrs['fit_mode'] = step['fit_mode']
+                if step['fit_mode'] == 'curve_fit':
+                    step_group.create_dataset('coefficients', data=np.asarray(step['model'], dtype=np.float64))
+                else:
+                    step_group.create_dataset('estimator', data=np.void(pickle.dumps(step['model'])))
+
+    @classmethod
+    def load(cls, filename, group_name='calibration'):
+        """
+        Load a model saved with save.
+
+        Fitted estimators are unpickled, so only load files from a trusted source.
+
+        Args:
+            filename (str): Path of the HDF5 file.
+            group_name (str): Name of the group.
+
+        Returns:
+            CalibrationModel: The model.
+        """
+        with h5py.File(filename, 'r') as f:
+            group = f[group_name]
+            attrs = group.attrs
+            model = cls(str(attrs['calibration_mode']), float(attrs['flight_path_length']), float(attrs['t0']),
+                        str(attrs['pulse_mode']), float(attrs['det_diam']),
+                        mean_distance=float(attrs['mean_distance']) if 'mean_distance' in attrs else None,
+                        mean_voltage=float(attrs['mean_voltage']) if 'mean_voltage' in attrs else None,
+                        mc_fit=group['mc_fit'][()] if 'mc_fit' in group else None)
+            for i in range(int(attrs['num_steps'])):
+                step_group = group['step_%03d' % i]
+                if 'coefficients' in step_group:
+                    step_model = step_group['coefficients'][()]
+                else:
+                    step_model = pickle.loads(step_group['estimator'][()].tobytes())
+                model.add_step(str(step_group.attrs['kind']), str(step_group.attrs['fit_mode']), step_model)
+        return model
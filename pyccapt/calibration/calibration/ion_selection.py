@@ -1,10 +1,10 @@
-import itertools
 import re
 import matplotlib
 import numpy as np
 import pandas as pd
 from faker import Factory
 
+from pyccapt.calibration.calibration import isotope_database
 from pyccapt.calibration.data_tools import data_tools
 
 
@@ -102,98 +102,58 @@ def chunks(lst, n):
         yield lst[i:i + n]
 
 
-def find_closest_elements(target_elem, num_elements, abundance_threshold=0.0, charge=4, variables=None):
+def _isotope_dataframe(rows, charges, variables=None, peaks=None):
     """
-    Find the closest elements to a target element.
+    Create the dataframe of single isotope ions.
 
     Args:
-        target_elem (float): Target element.
-        num_elements (int): Number of closest elements to find.
-        abundance_threshold (float): Abundance threshold for filtering elements (as a percentage).
-        charge (int): Charge value.
+        rows (np.ndarray): Rows of the isotope database.
+        charges (np.ndarray): Charge state of each ion.
         variables (object): Object containing the variables.
+        peaks (np.ndarray): Optional. Peak position each ion was found for, added as the last column 'peak'
+                            (but not to variables.range_data_backup, whose rows ranging_dataset_create
+                            reads by position).
 
     Returns:
-        pd.DataFrame: DataFrame containing closest elements and their properties.
+        pd.DataFrame: DataFrame containing the ions and their properties.
     """
-    try:
-        data_table = '../../../files/isotopeTable.h5'
-        dataframe = pd.read_hdf(data_table)
-    except Exception as e:
-        try:
-            data_table = './pyccapt/files/isotopeTable.h5'
-            dataframe = pd.read_hdf(data_table)
-        except:
-            print("Error loading the file", e)
-
-    # Expand elements based on charge
-    elements = dataframe['element'].to_numpy()
-    isotope_number = dataframe['isotope'].to_numpy()
-    weight = dataframe['weight'].to_numpy()
-    abundance = dataframe['abundance'].to_numpy()
-
-    elements = np.repeat(elements, charge)
-    isotope_number = np.repeat(isotope_number, charge)
-    weights = np.repeat(weight, charge)
-    abundance = np.repeat(abundance, charge)
-    charge_list = np.array([i % charge + 1 for i in range(len(weights))])
-
-    weights = weights / charge_list
-
-    # Filter elements by abundance threshold
-    abundance_threshold *= 100
-    mask_abundanc = (abundance > abundance_threshold)
-    elements = elements[mask_abundanc]
-    isotope_number = isotope_number[mask_abundanc]
-    weights = weights[mask_abundanc]
-    abundance = abundance[mask_abundanc]
-
-    # Find closest elements
-    idxs = np.argsort(np.abs(weights - target_elem))[:num_elements]
-
-    selected_elements = elements[idxs]
-    selected_isotope_number = isotope_number[idxs]
-    selected_weights = weights[idxs]
-    selected_abundance = abundance[idxs]
-    selected_charge_list = charge_list[idxs]
+    database = isotope_database.get_isotope_database()
+    selected_elements = database.element[rows]
+    selected_isotope_number = database.isotope[rows]
+    selected_weights = database.weight[rows] / charges
+    selected_abundance = database.abundance[rows]
+
     # Create LaTeX formatted element symbols
     element_symbols = []
-    for i in range(len(idxs)):
+    for i in range(len(rows)):
         formula = ''
         formula += '{}^'
         formula += '{%s}' % selected_isotope_number[i]
         formula += '%s' % selected_elements[i]
 
-        if selected_charge_list[i] > 1:
-            formula = r'$' + formula + '^{%s+}$' % selected_charge_list[i]
+        if charges[i] > 1:
+            formula = r'$' + formula + '^{%s+}$' % charges[i]
         else:
             formula = r'$' + formula + '^{+}$'
         element_symbols.append(formula)
 
-
-    selected_elements = [[item] for item in selected_elements]
-    complex = np.ones(len(idxs), dtype=int)
-    complex = [[item] for item in complex]
-    selected_isotope_number = [[item] for item in selected_isotope_number]
-
-
-    selected_isotope_number = [[np.uint32(float(value[0]))] for value in selected_isotope_number]
-    complex = [[np.uint32(float(value[0]))] for value in complex]
-    selected_charge_list = [np.uint32(value) for value in selected_charge_list]
-
     # Create DataFrame
     df = pd.DataFrame({
         'ion': element_symbols,
         'mass': selected_weights,
-        'element': selected_elements,
-        'complex': complex,
-        'isotope': selected_isotope_number,
-        'charge': selected_charge_list,
+        'element': [[item] for item in selected_elements],
+        'complex': [[np.uint32(1)] for _ in range(len(rows))],
+        'isotope': [[np.uint32(item)] for item in selected_isotope_number],
+        'charge': [np.uint32(value) for value in charges],
         'abundance': selected_abundance,
     })
 
     # Sort DataFrame
-    df = df.sort_values(by=['mass'], ascending=[True])
+    if peaks is not None:
+        df['peak'] = peaks
+        df = df.sort_values(by=['peak', 'mass'], ascending=[True, True], kind='stable')
+    else:
+        df = df.sort_values(by=['mass'], ascending=[True])
     df.reset_index(drop=True, inplace=True)
     # Round the abundance column to 4 decimal places
     df['abundance'] = df['abundance'].round(4)
@@ -202,118 +162,73 @@ def find_closest_elements(target_elem, num_elements, abundance_threshold=0.0, ch
     df['mass'] = df['mass'].round(4)
     # Backup data if variables provided
     if variables is not None:
-        variables.range_data_backup = df.copy()
+        variables.range_data_backup = df.drop(columns='peak') if peaks is not None else df.copy()
 
     return df
 
-def load_elements(target_elements, abundance_threshold=0.0, charge=4, variables=None):
+
+def find_closest_elements(target_elem, num_elements, abundance_threshold=0.0, charge=4, variables=None):
     """
-    create a dataframe from the given list of ions.
+    Find the closest elements to a target element.
 
     Args:
-        target_elements (str): Target elements.
+        target_elem (float): Target element.
+        num_elements (int): Number of closest elements to find.
         abundance_threshold (float): Abundance threshold for filtering elements (as a percentage).
         charge (int): Charge value.
-        data_table (str): Path to the data table (HDF5 file).
         variables (object): Object containing the variables.
 
     Returns:
         pd.DataFrame: DataFrame containing closest elements and their properties.
     """
-    try:
-        data_table = '../../../files/isotopeTable.h5'
-        dataframe = pd.read_hdf(data_table)
-    except:
-        try:
-            data_table = './pyccapt/files/isotopeTable.h5'
-            dataframe = pd.read_hdf(data_table)
-        except Exception as e:
-            print("Error loading the file", e)
-
-    # Expand elements based on charge
-    elements = dataframe['element'].to_numpy()
-    isotope_number = dataframe['isotope'].to_numpy()
-    weight = dataframe['weight'].to_numpy()
-    abundance = dataframe['abundance'].to_numpy()
-
-
-    elements = np.repeat(elements, charge)
-    isotope_number = np.repeat(isotope_number, charge)
-    weights = np.repeat(weight, charge)
-    abundance = np.repeat(abundance, charge)
-    charge_list = np.array([i % charge + 1 for i in range(len(weights))])
-
-    weights = weights / charge_list
-
-    # Filter elements by abundance threshold
-    abundance_threshold *= 100
-    mask_abundanc = (abundance > abundance_threshold)
-    elements = elements[mask_abundanc]
-    isotope_number = isotope_number[mask_abundanc]
-    weights = weights[mask_abundanc]
-    abundance = abundance[mask_abundanc]
+    database = isotope_database.get_isotope_database()
+    rows, charges = database.closest(target_elem, num_elements, charge, abundance_threshold)
+    return _isotope_dataframe(rows, charges, variables)
 
-    target_elements = target_elements.split(',')
-    target_elements = [s.replace(' ', '') for s in target_elements]
 
-    index_elements = []
-    for i in range(len(target_elements)):
-        index_elements.append([index for index, element in enumerate(elements) if element == target_elements[i]])
-    idxs = [item for sublist in index_elements for item in sublist]
+def find_closest_elements_batch(peaks, num_elements, abundance_threshold=0.0, charge=4, variables=None):
+    """
+    Find the closest elements to each of several peaks at once.
 
-    selected_elements = elements[idxs]
-    selected_isotope_number = isotope_number[idxs]
-    selected_weights = weights[idxs]
-    selected_abundance = abundance[idxs]
-    selected_charge_list = charge_list[idxs]
-    # Create LaTeX formatted element symbols
-    element_symbols = []
-    for i in range(len(idxs)):
-        formula = ''
-        formula += '{}^'
-        formula += '{%s}' % selected_isotope_number[i]
-        formula += '%s' % selected_elements[i]
+    Args:
+        peaks (np.ndarray): Peak positions in Da, e.g. variables.peak_x from find_peaks_and_widths.
+        num_elements (int): Number of closest elements to find per peak.
+        abundance_threshold (float): Abundance threshold for filtering elements (as a percentage).
+        charge (int): Charge value.
+        variables (object): Object containing the variables.
 
-        if selected_charge_list[i] > 1:
-            formula = r'$' + formula + '^{%s+}$' % selected_charge_list[i]
-        else:
-            formula = r'$' + formula + '^{+}$'
-        element_symbols.append(formula)
+    Returns:
+        pd.DataFrame: DataFrame containing the closest elements of all peaks and their properties, with the
+        peak position of each candidate in the 'peak' column.
+    """
+    database = isotope_database.get_isotope_database()
+    peaks = np.atleast_1d(np.asarray(peaks, dtype=np.float64))
+    rows, charges, distance = database.closest_batch(peaks, num_elements, charge, abundance_threshold)
+    found = np.isfinite(distance)
+    peak_of = np.broadcast_to(peaks[:, None], rows.shape)[found]
+    return _isotope_dataframe(rows[found], charges[found], variables, peaks=peak_of)
 
-    selected_elements = [[item] for item in selected_elements]
-    complex = np.ones(len(idxs), dtype=int)
-    complex = [[item] for item in complex]
-    selected_isotope_number = [[item] for item in selected_isotope_number]
 
-    complex = [[np.uint32(float(value[0]))] for value in complex]
-    selected_isotope_number = [[np.uint32(float(value[0]))] for value in selected_isotope_number]
-    selected_charge_list = [np.uint32(value) for value in selected_charge_list]
+def load_elements(target_elements, abundance_threshold=0.0, charge=4, variables=None):
+    """
+    create a dataframe from the given list of ions.
 
-    # Create DataFrame
-    df = pd.DataFrame({
-        'ion': element_symbols,
-        'mass': selected_weights,
-        'element': selected_elements,
-        'complex': complex,
-        'isotope': selected_isotope_number,
-        'charge': selected_charge_list,
-        'abundance': selected_abundance,
-    })
+    Args:
+        target_elements (str): Target elements.
+        abundance_threshold (float): Abundance threshold for filtering elements (as a percentage).
+        charge (int): Charge value.
+        variables (object): Object containing the variables.
 
-    # Sort DataFrame
-    df = df.sort_values(by=['mass'], ascending=[True])
-    df.reset_index(drop=True, inplace=True)
+    Returns:
+        pd.DataFrame: DataFrame containing closest elements and their properties.
+    """
+    database = isotope_database.get_isotope_database()
+    target_elements = target_elements.split(',')
+    target_elements = [s.replace(' ', '') for s in target_elements]
+    rows, charges = database.charge_states(database.rows(target_elements), charge, abundance_threshold)
+    return _isotope_dataframe(rows, charges, variables)
 
-    # Round the abundance column to 4 decimal places
-    df['abundance'] = df['abundance'].round(4)
-    # Divide all elements in abundance by 100
-    df['abundance'] = df['abundance'] / 100
-    df['mass'] = df['mass'].round(4)
-    # Backup data if variables provided
-    if variables is not None:
-        variables.range_data_backup = df.copy()
 
-    return df
 def molecule_manual(target_element, charge, latex=True, variables=None):
     """
     Generate a list of isotopes for a given target element.
@@ -328,21 +243,9 @@ def molecule_manual(target_element, charge, latex=True, variables=None):
         pd.DataFrame: A DataFrame containing the list of isotopes with their weights and abundances.
 
     """
-    try:
-        isotopeTableFile = '../../../files/isotopeTable.h5'
-        dataframe = pd.read_hdf(isotopeTableFile, mode='r')
-    except:
-        try:
-            isotopeTableFile = './pyccapt/files/isotopeTable.h5'
-            dataframe = pd.read_hdf(isotopeTableFile, mode='r')
-        except Exception as e:
-            print("Error loading the file", e)
+    database = isotope_database.get_isotope_database()
     target_element = fix_parentheses(target_element)
 
-    elements = dataframe['element'].to_numpy()
-    isotope_number = dataframe['isotope'].to_numpy()
-    abundance = dataframe['abundance'].to_numpy()
-    weight = dataframe['weight'].to_numpy()
     # Extract numbers enclosed in curly braces and store them in a list
     isotope_list = [int(match.group(1)) for match in re.finditer(r'{(\d+)}', target_element)]
     # Extract uppercase letters and store them in a list
@@ -354,9 +257,9 @@ def molecule_manual(target_element, charge, latex=True, variables=None):
     total_weight = 0
     abundance_c = 1
     for i, isotop in enumerate(isotope_list):
-        index = np.where(isotope_number == isotop)
-        total_weight += weight[index] * complexity_list[i]
-        abundance_c *= (abundance[index] / 100) ** complexity_list[i]
+        index = database.isotope_row(element_list[i], isotop)
+        total_weight += database.weight[index] * complexity_list[i]
+        abundance_c *= (database.abundance[index] / 100) ** complexity_list[i]
 
     total_weight = total_weight / charge
     if latex:
@@ -434,7 +337,76 @@ def transform_combination_and_isotopes(combination, isotopes):
     return new_combination, new_isotopes, complexity
 
 
-def molecule_create(element_list, max_complexity, charge, abundance_threshold, variables=None, latex=True):
+def molecule_candidates(element_list, max_complexity, charge, abundance_threshold=0.0, mc_range=None):
+    """
+    Enumerate the molecular ions made of the isotopes of the given elements.
+
+    The molecules are unordered isotope multisets (combinations with replacement), built one isotope at a
+    time for all molecules at once. Adding an isotope can only lower the abundance and raise the mass, so a
+    molecule whose abundance is not above the threshold, or whose mass is above the highest mass-to-charge
+    ratio of mc_range for the highest charge state, is not extended any further.
+
+    Args:
+        element_list (list): Element symbols.
+        max_complexity (int): The maximum number of atoms of the molecule.
+        charge (int): The highest charge state.
+        abundance_threshold (float): Only molecules with a higher abundance (product of the isotope
+                                     abundances, as a fraction) are returned.
+        mc_range (tuple): Optional. (low, high) mass-to-charge window in Da of the returned ions.
+
+    Returns:
+        tuple: (isotope_rows, charges, mc, abundance) where isotope_rows is a list with the rows of the
+               isotope database of each ion (sorted) and the other entries are arrays.
+    """
+    database = isotope_database.get_isotope_database()
+    rows = database.rows(element_list)
+    weight = database.weight[rows]
+    abundance = database.abundance[rows] / 100
+    max_mass = mc_range[1] * charge if mc_range is not None else np.inf
+
+    isotope_rows = []
+    charges = []
+    mc = []
+    abundances = []
+    # Molecules of one atom; combos holds the (ascending) positions in rows of the isotopes of each molecule
+    keep = (abundance > abundance_threshold) & (weight <= max_mass)
+    combos = np.flatnonzero(keep)[:, None]
+    mass = weight[keep]
+    combo_abundance = abundance[keep]
+    for complexity in range(1, max_complexity + 1):
+        if complexity > 1:
+            # Extend each molecule by every isotope at or after its last one
+            last = combos[:, -1]
+            counts = len(rows) - last
+            parent = np.repeat(np.arange(len(combos)), counts)
+            first = np.cumsum(counts) - counts
+            new = np.repeat(last - first, counts) + np.arange(counts.sum())
+            new_mass = mass[parent] + weight[new]
+            new_abundance = combo_abundance[parent] * abundance[new]
+            keep = (new_abundance > abundance_threshold) & (new_mass <= max_mass)
+            combos = np.column_stack([combos[parent[keep]], new[keep]])
+            mass = new_mass[keep]
+            combo_abundance = new_abundance[keep]
+        if len(combos) == 0:
+            break
+        for ion_charge in range(1, charge + 1):
+            ion_mc = mass / ion_charge
+            if mc_range is not None:
+                in_range = (ion_mc >= mc_range[0]) & (ion_mc <= mc_range[1])
+            else:
+                in_range = np.ones(len(ion_mc), dtype=bool)
+            isotope_rows.extend(rows[combos[in_range]])
+            charges.append(np.full(np.count_nonzero(in_range), ion_charge))
+            mc.append(ion_mc[in_range])
+            abundances.append(combo_abundance[in_range])
+
+    if not charges:
+        return [], np.empty(0, dtype=int), np.empty(0), np.empty(0)
+    return isotope_rows, np.concatenate(charges), np.concatenate(mc), np.concatenate(abundances)
+
+
+def molecule_create(element_list, max_complexity, charge, abundance_threshold, variables=None, latex=True,
+                    mc_range=None):
     """
     Generate a list of isotopes for a given target element.
 
@@ -445,103 +417,48 @@ def molecule_create(element_list, max_complexity, charge, abundance_threshold, v
         abundance_threshold (float): The abundance threshold for filtering isotopes.
         variables (object, optional): The variables object. Defaults to None.
         latex (bool, optional): Whether to generate LaTeX representation of formulas. Defaults to True.
+        mc_range (tuple, optional): (low, high) mass-to-charge window in Da of the returned ions.
 
     Returns:
         pd.DataFrame: A DataFrame containing the list of isotopes with their weights and abundances.
     """
-    try:
-        isotopeTableFile = '../../../files/isotopeTable.h5'
-        dataframe = data_tools.read_range(isotopeTableFile)
-    except:
-        try:
-            isotopeTableFile = './pyccapt/files/isotopeTable.h5'
-            dataframe = data_tools.read_range(isotopeTableFile)
-        except Exception as e:
-            print("Error loading the file", e)
-    elements = dataframe['element'].to_numpy()
-    isotope_number = dataframe['isotope'].to_numpy()
-    abundance = dataframe['abundance'].to_numpy()
-    weight = dataframe['weight'].to_numpy()
+    database = isotope_database.get_isotope_database()
     element_list = element_list.split(',')
     element_list = [s.replace(' ', '') for s in element_list]
-    indices_elements = np.where(np.isin(elements, [element_list]))
-    selected_elements = elements[indices_elements[0]]
-    selected_isotope_number = isotope_number[indices_elements[0]]
-    selected_weights = weight[indices_elements[0]]
-    selected_abundance = abundance[indices_elements[0]]
-
-    # Create a list of elements with their respective isotope numbers, weights, and abundances
-    element_data = [{'element': elem, 'isotope': iso, 'weight': w, 'abundance': ab}
-                    for elem, iso, w, ab in zip(selected_elements, selected_isotope_number, selected_weights,
-                                                selected_abundance)]
-    # Initialize lists to store results
+    isotope_rows, combination_charge, combination_weights, combination_abundances = molecule_candidates(
+        element_list, max_complexity, charge, abundance_threshold, mc_range=mc_range)
+
     combinations = []
-    combinations_list = []
-    combination_weights = []
     combination_isotopes = []
-    combination_abundances = []
-    combination_charge = []
     combination_complexity = []
     combination_formula = []
-    # Generate all possible combinations with complexity 3
-    for comploex in range(1, max_complexity + 1):
-        for combo in itertools.product(element_data, repeat=comploex):
-            combo_elements = [elem['element'] for elem in combo]
-            combo_weights = [elem['weight'] for elem in combo]
-            combo_abundances = [elem['abundance'] for elem in combo]
-
-            combo_weight = sum(combo_weights)
-            combo_abundance = 1.0
-
-            for ab in combo_abundances:
-                combo_abundance *= ab / 100
-            for i in range(charge):
-                combinations.append(combo_elements)
-                combinations_list.append(combo_elements)
-                combination_weights.append(combo_weight / (i + 1))
-                combination_isotopes.append([elem['isotope'] for elem in combo])
-                combination_abundances.append(combo_abundance)
-                combination_charge.append(i + 1)
-
-    for i in range(len(combinations)):
-        new_combination, new_isotopes, complexity = transform_combination_and_isotopes(combinations[i],
-                                                                                       combination_isotopes[i])
-        combinations[i] = new_combination
-        combination_isotopes[i] = new_isotopes
+    for i in range(len(isotope_rows)):
+        new_combination, new_isotopes, complexity = transform_combination_and_isotopes(
+            list(database.element[isotope_rows[i]]), list(database.isotope[isotope_rows[i]]))
+        combinations.append(new_combination)
+        combination_isotopes.append(new_isotopes)
         combination_complexity.append(complexity)
-        charge = combination_charge[i]
+        ion_charge = combination_charge[i]
+        formula = ''
         if latex:
-            formula = ''
-            for i in range(len(new_isotopes)):
-                isotope = new_isotopes[i]
-                element = new_combination[i]
-                comp = complexity[i]
-
+            for isotope, element, comp in zip(new_isotopes, new_combination, complexity):
                 formula += '{}^'
                 formula += '{%s}' % isotope
                 formula += '%s' % element
                 if comp != 1:
                     formula += '_{%s}' % comp
-            if charge > 1:
-                formula = r'$' + formula + '^{%s+}$' % charge
+            if ion_charge > 1:
+                formula = r'$' + formula + '^{%s+}$' % ion_charge
             else:
                 formula = r'$' + formula + '^{+}$'
-
         else:
             element_counts = {}
-            chemical_formula = ''
-
-            for element in element_list:
-                if element in element_counts:
-                    element_counts[element] += 1
-                else:
-                    element_counts[element] = 1
-
+            for element, comp in zip(new_combination, complexity):
+                element_counts[element] = element_counts.get(element, 0) + comp
             for element, count in element_counts.items():
-                chemical_formula += element
+                formula += element
                 if count > 1:
-                    chemical_formula += str(count)
-            formula = chemical_formula
+                    formula += str(count)
         combination_formula.append(formula)
 
     combination_complexity = [[np.uint32(x) for x in sub_list] for sub_list in combination_complexity]
@@ -559,11 +476,6 @@ def molecule_create(element_list, max_complexity, charge, abundance_threshold, v
         'abundance': combination_abundances,
     })
 
-    df = df[df['abundance'] > abundance_threshold]
-
-    # Reset the index
-    df = df.reset_index(drop=True)
-
     # Sort DataFrame
     df = df.sort_values(by=['mass'], ascending=[True])
     df.reset_index(drop=True, inplace=True)
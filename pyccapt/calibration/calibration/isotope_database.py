@@ -0,0 +1,205 @@
+"""
+In-memory isotope database used by ion_selection.
+
+The isotope table (pyccapt/files/isotopeTable.h5) is read once per process and kept as columnar NumPy
+arrays, sorted by isotope weight, together with element -> isotope index maps. All lookups are pure
+in-memory queries.
+"""
+import functools
+from importlib import resources
+
+import numpy as np
+import pandas as pd
+
+
+def package_file(name):
+    """
+    Path of a file in the pyccapt/files directory of the installed package.
+
+    Args:
+        name (str): File name, e.g. 'isotopeTable.h5'.
+
+    Returns:
+        str: Path of the file.
+    """
+    return str(resources.files('pyccapt').joinpath('files', name))
+
+
+class IsotopeDatabase:
+    """
+    Columnar isotope table sorted by weight.
+
+    Because the mass-to-charge ratio of charge state q is weight / q, the rows are sorted by mass-to-charge
+    ratio for every charge state at once, so nearest-mass queries are binary searches.
+
+    Attributes:
+        table (pd.DataFrame): The isotope table as read from the file.
+        element (np.ndarray): Element symbol of each isotope.
+        isotope (np.ndarray): Mass number of each isotope.
+        weight (np.ndarray): Isotope weight in Da (ascending).
+        abundance (np.ndarray): Natural abundance in percent.
+        element_rows (dict): Maps an element symbol to the rows of its isotopes (by mass number).
+        isotope_rows (dict): Maps (element symbol, mass number) to the row of the isotope.
+    """
+
+    def __init__(self, table: pd.DataFrame):
+        """
+        Build the database from an isotope table.
+
+        Args:
+            table (pd.DataFrame): Isotope table with the columns 'element', 'isotope', 'weight' and 'abundance'.
+        """
+        self.table = table
+        order = np.argsort(table['weight'].to_numpy(), kind='stable')
+        self.element = table['element'].to_numpy().astype(str)[order]
+        self.isotope = table['isotope'].to_numpy()[order]
+        self.weight = table['weight'].to_numpy(dtype=np.float64)[order]
+        self.abundance = table['abundance'].to_numpy(dtype=np.float64)[order]
+
+        self.element_rows = {}
+        for element in pd.unique(self.element):
+            rows = np.flatnonzero(self.element == element)
+            self.element_rows[element] = rows[np.argsort(self.isotope[rows], kind='stable')]
+        self.isotope_rows = {(e, int(i)): row for row, (e, i) in enumerate(zip(self.element, self.isotope))}
+        self._mc_tables = {}
+
+    @classmethod
+    def load(cls, path=None):
+        """
+        Read the isotope table from an HDF5 file.
+
+        Args:
+            path (str): Optional. Path of the isotope table. Defaults to the table of the package.
+
+        Returns:
+            IsotopeDatabase: The database.
+        """
+        if path is None:
+            path = package_file('isotopeTable.h5')
+        return cls(pd.read_hdf(path, mode='r'))
+
+    def rows(self, elements):
+        """
+        Rows of all isotopes of the given elements, in the order of the elements.
+
+        Args:
+            elements (list): Element symbols.
+
+        Returns:
+            np.ndarray: Row indices.
+        """
+        parts = [self.element_rows.get(element, np.empty(0, dtype=np.int64)) for element in elements]
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+    def isotope_row(self, element, isotope):
+        """
+        Row of one isotope.
+
+        Args:
+            element (str): Element symbol.
+            isotope (int): Mass number.
+
+        Returns:
+            int: Row index.
+        """
+        return self.isotope_rows[(element, int(isotope))]
+
+    def charge_states(self, rows, max_charge, abundance_threshold=0.0):
+        """
+        Expand isotopes into charge states 1..max_charge, keeping the isotopes above an abundance threshold.
+
+        Args:
+            rows (np.ndarray): Row indices.
+            max_charge (int): Highest charge state.
+            abundance_threshold (float): Abundance threshold as a fraction (0.01 = 1%).
+
+        Returns:
+            tuple: (rows, charges) of the isotope charge states.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        rows = rows[self.abundance[rows] > abundance_threshold * 100]
+        charges = np.tile(np.arange(1, max_charge + 1), len(rows))
+        return np.repeat(rows, max_charge), charges
+
+    def mc_table(self, max_charge, abundance_threshold=0.0):
+        """
+        Isotope charge states above an abundance threshold, sorted by mass-to-charge ratio.
+
+        The table is built once per (max_charge, abundance_threshold) and kept.
+
+        Args:
+            max_charge (int): Highest charge state.
+            abundance_threshold (float): Abundance threshold as a fraction (0.01 = 1%).
+
+        Returns:
+            tuple: (mc, rows, charges) of the charge states in ascending mass-to-charge order.
+        """
+        key = (int(max_charge), float(abundance_threshold))
+        if key not in self._mc_tables:
+            rows, charges = self.charge_states(np.arange(len(self.weight)), max_charge, abundance_threshold)
+            mc = self.weight[rows] / charges
+            order = np.argsort(mc, kind='stable')
+            self._mc_tables[key] = (mc[order], rows[order], charges[order])
+        return self._mc_tables[key]
+
+    def closest_batch(self, targets_mc, num, max_charge, abundance_threshold=0.0):
+        """
+        Isotope charge states with the mass-to-charge ratio closest to each of several targets.
+
+        The num closest charge states of a target are within num positions of its insertion point in the
+        sorted mass-to-charge table, so all targets are answered with one searchsorted and a sort of a
+        (targets, 2 * num) window.
+
+        Args:
+            targets_mc (np.ndarray): Target mass-to-charge ratios in Da, e.g. the peak positions.
+            num (int): Number of charge states to return per target.
+            max_charge (int): Highest charge state.
+            abundance_threshold (float): Abundance threshold as a fraction (0.01 = 1%).
+
+        Returns:
+            tuple: (rows, charges, distances) arrays of shape (targets, num), each row sorted by the
+            distance to its target. If fewer than num charge states pass the filter, the missing entries
+            have row -1, charge 0 and distance inf.
+        """
+        targets_mc = np.atleast_1d(np.asarray(targets_mc, dtype=np.float64))
+        mc, rows, charges = self.mc_table(max_charge, abundance_threshold)
+        position = np.searchsorted(mc, targets_mc)
+        window = position[:, None] + np.arange(-num, num)[None, :]
+        # Positions outside the table point to a sentinel entry at infinite distance
+        window[(window < 0) | (window >= len(mc))] = len(mc)
+        mc = np.append(mc, np.inf)
+        distance = np.abs(mc[window] - targets_mc[:, None])
+        order = np.argsort(distance, axis=1, kind='stable')[:, :num]
+        window = np.take_along_axis(window, order, axis=1)
+        return np.append(rows, -1)[window], np.append(charges, 0)[window], np.take_along_axis(distance, order, axis=1)
+
+    def closest(self, target_mc, num, max_charge, abundance_threshold=0.0):
+        """
+        Isotope charge states with the mass-to-charge ratio closest to a target.
+
+        Args:
+            target_mc (float): Target mass-to-charge ratio in Da.
+            num (int): Number of charge states to return.
+            max_charge (int): Highest charge state.
+            abundance_threshold (float): Abundance threshold as a fraction (0.01 = 1%).
+
+        Returns:
+            tuple: (rows, charges) sorted by the distance to the target.
+        """
+        rows, charges, distance = self.closest_batch([target_mc], num, max_charge, abundance_threshold)
+        found = np.isfinite(distance[0])
+        return rows[0][found], charges[0][found]
+
+
+@functools.lru_cache(maxsize=None)
+def get_isotope_database(path=None):
+    """
+    Isotope database, loaded on the first call and shared afterwards.
+
+    Args:
+        path (str): Optional. Path of the isotope table. Defaults to the table of the package.
+
+    Returns:
+        IsotopeDatabase: The database.
+    """
+    return IsotopeDatabase.load(path)
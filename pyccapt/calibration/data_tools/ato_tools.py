@@ -1,7 +1,104 @@
-import struct
-
 import numpy as np
 import pandas as pd
+from numba import njit
+
+# Local module and scripts
+from pyccapt.calibration.data_tools import data_schema
+
+# Fixed part of an .ato version 6 atom record; it is followed by num_cluster uint16 cluster ids
+ATO_RECORD_DTYPE = np.dtype([('atom_id', '<u4'), ('delta_p', '<i4'), ('x', '<i2'), ('y', '<i2'), ('z', '<f4'),
+                             ('mc', '<f4'), ('tof', '<f4'), ('x_det', '<i2'), ('y_det', '<i2'),
+                             ('dc_voltage', '<u2'), ('mcp_amp', '<u2'), ('num_cluster', 'u1')])
+
+ATO_HEADER_SIZE = 12
+
+
+@njit(cache=True)
+def _ato_record_offsets(buffer, num_atoms, header_size, record_size):
+    """
+    Walk the variable-length records once and return the byte offset of each record.
+    """
+    offsets = np.empty(num_atoms, dtype=np.int64)
+    offset = header_size
+    for i in range(num_atoms):
+        if offset + record_size > len(buffer):
+            return offsets[:i]
+        offsets[i] = offset
+        offset += record_size + 2 * buffer[offset + record_size - 1]
+    return offsets
+
+
+@njit(cache=True)
+def _gather_records(buffer, offsets, record_size):
+    """
+    Copy the fixed part of each record into one contiguous byte array.
+    """
+    out = np.empty(len(offsets) * record_size, dtype=np.uint8)
+    for i in range(len(offsets)):
+        out[i * record_size:(i + 1) * record_size] = buffer[offsets[i]:offsets[i] + record_size]
+    return out
+
+
+def read_ato(file_path: str) -> dict:
+    """
+    Decode an .ato file version 6 into typed NumPy arrays.
+
+    The fixed record fields are read through a structured dtype in one pass. The cluster id tail of
+    each record is decoded in a second vectorized pass over the record offsets.
+
+    Args:
+        file_path: Path to the .ato file
+
+    Returns:
+        Dictionary of arrays in the ato column layout. cluster_id holds the first cluster id of each atom
+        and 0 for atoms without a cluster.
+
+    Raises:
+        ValueError: If the file is too small or the cluster ids of the last atom are cut off.
+    """
+    buffer = np.fromfile(file_path, dtype=np.uint8)
+    if len(buffer) < ATO_HEADER_SIZE:
+        raise ValueError('The file is too small to be an .ato file')
+    zero, version, num_atoms = buffer[:ATO_HEADER_SIZE].view('<i4')
+    if version != 6:
+        print('The .ato file version is %s, only version 6 is supported' % version)
+
+    record_size = ATO_RECORD_DTYPE.itemsize
+    offsets = _ato_record_offsets(buffer, int(num_atoms), ATO_HEADER_SIZE, record_size)
+    if len(offsets) < num_atoms:
+        print('The .ato file is truncated, %s of %s atoms are read' % (len(offsets), num_atoms))
+
+    strides = np.diff(offsets)
+    if len(offsets) > 0 and (len(strides) == 0 or np.all(strides == strides[0])):
+        # All records have the same number of cluster ids: read them in place with a strided view
+        stride = int(strides[0]) if len(strides) > 0 else record_size
+        records = np.ndarray(shape=(len(offsets),), dtype=ATO_RECORD_DTYPE, buffer=buffer,
+                             offset=int(offsets[0]), strides=(stride,))
+    else:
+        records = _gather_records(buffer, offsets, record_size).view(ATO_RECORD_DTYPE)
+
+    num_cluster = records['num_cluster'].copy()
+    cluster_id = np.zeros(len(offsets), dtype=np.uint16)
+    has_cluster = num_cluster > 0
+    tail = offsets[has_cluster] + record_size
+    if len(tail) > 0 and tail[-1] + 2 > len(buffer):
+        raise ValueError('The .ato file is truncated in the cluster ids of atom %s'
+                         % int(np.flatnonzero(has_cluster)[-1]))
+    cluster_id[has_cluster] = buffer[tail].astype(np.uint16) | (buffer[tail + 1].astype(np.uint16) << 8)
+
+    return {'atom_id': records['atom_id'].copy(),
+            'delta_p': records['delta_p'].copy(),
+            'x (nm)': records['x'].copy(),
+            'y (nm)': records['y'].copy(),
+            'z (nm)': records['z'] * np.float32(0.1),
+            'mc (Da)': records['mc'].copy(),
+            'tof (ns)': records['tof'] * np.float32(1000),
+            'x_det (mm)': records['x_det'] * np.float32(0.01),
+            'y_det (mm)': records['y_det'] * np.float32(0.01),
+            'dc_voltage (V)': records['dc_voltage'] * np.float32(0.5),
+            'mcp_amp': records['mcp_amp'].copy(),
+            'num_cluster': num_cluster,
+            'cluster_id': cluster_id}
 
 
 def ato_to_ccapt(file_path: str, mode: str) -> pd.DataFrame:
@@ -10,83 +107,22 @@ def ato_to_ccapt(file_path: str, mode: str) -> pd.DataFrame:
 
     Args:
         file_path: Path to the .ato file
-        mode: Type of mode (oxcart/ato)
+        mode: Type of mode (pyccapt/ato)
 
     Returns:
         Pandas DataFrame containing the converted data
     """
-    with open(file_path, 'rb') as f:
-        data = f.read()
-
-        zero = struct.unpack('i', data[:4])
-        version = struct.unpack('i', data[4:8])
-        num_atoms = struct.unpack('i', data[8:12])
-
-        atom_id = []
-        delta_p = []
-        x = []
-        y = []
-        z = []
-        mc = []
-        tof = []
-        x_det = []
-        y_det = []
-        dc_voltage = []
-        mcp_amp = []
-        num_cluster = []
-        cluster_id = []
-        bias = 12
-
-        for i in range(num_atoms[0]):
-            atom_id.append(struct.unpack('I', data[bias:bias+4])[0])
-            delta_p.append(struct.unpack('i', data[bias+4:bias+8])[0])
-            x.append(struct.unpack('h', data[bias+8:bias+10])[0])
-            y.append(struct.unpack('h', data[bias+10:bias+12])[0])
-            z.append(struct.unpack('f', data[bias+12:bias+16])[0] * 0.1)
-            mc.append(struct.unpack('f', data[bias+16:bias+20])[0])
-            tof.append(struct.unpack('f', data[bias+20:bias+24])[0] * 1000)
-            x_det.append(struct.unpack('h', data[bias+24:bias+26])[0] * 0.01)
-            y_det.append(struct.unpack('h', data[bias+26:bias+28])[0] * 0.01)
-            dc_voltage.append(struct.unpack('H', data[bias+28:bias+30])[0] * 0.5)
-            mcp_amp.append(struct.unpack('H', data[bias+30:bias+32])[0])
-            num_cluster_tmp = struct.unpack('B', data[bias+32:bias+33])[0]
-            num_cluster.append(num_cluster_tmp)
-
-            if num_cluster_tmp > 0:
-                cluster_id.append(struct.unpack('H' * num_cluster_tmp, data[bias+33:bias+33+num_cluster_tmp*2])[0])
-
-            bias = 12 + (35 * (i+1))
-
-        if mode == 'ato':
-            data_f = pd.DataFrame({'atom_id': atom_id,
-                                   'delta_p': delta_p,
-                                   'x (nm)': x,
-                                   'y (nm)': y,
-                                   'z (nm)': z,
-                                   'mc (Da)': mc,
-                                   'tof (ns)': tof,
-                                   'x_det (mm)': x_det,
-                                   'y_det (mm)': y_det,
-                                   'dc_voltage (V)': dc_voltage,
-                                   'mcp_amp': mcp_amp,
-                                   'num_cluster': num_cluster,
-                                   'cluster_id': cluster_id})
-        elif mode == 'pyccapt':
-            data_f = pd.DataFrame({
-                'x (nm)': np.zeros(len(dc_voltage)),
-                'y (nm)': np.zeros(len(dc_voltage)),
-                'z (nm)': np.zeros(len(dc_voltage)),
-                'mc_c (Da)': np.zeros(len(dc_voltage)),
-                'mc (Da)': np.zeros(len(dc_voltage)),
-                'high_voltage (V)': dc_voltage,
-                'pulse': np.zeros(len(dc_voltage)),
-                'start_counter': np.zeros(len(dc_voltage)),
-                't_c (ns)': np.zeros(len(dc_voltage)),
-                't (ns)': tof,
-                'mc (Da)': mc,
-                'x_det (mm)': x_det,
-                'y_det (mm)': y_det,
-                'delta_p': delta_p,
-                'multi': np.zeros(len(dc_voltage))})
+    ato = read_ato(file_path)
+    if mode == 'ato':
+        data_f = pd.DataFrame(ato)
+    elif mode == 'pyccapt':
+        data_f = data_schema.ccapt_dataframe({
+            'mc (Da)': ato['mc (Da)'],
+            'high_voltage (V)': ato['dc_voltage (V)'],
+            't (ns)': ato['tof (ns)'],
+            'x_det (cm)': ato['x_det (mm)'] / np.float32(10),
+            'y_det (cm)': ato['y_det (mm)'] / np.float32(10),
+            'delta_p': ato['delta_p']})
+    else:
+        raise ValueError('mode should be pyccapt or ato')
     return data_f
-
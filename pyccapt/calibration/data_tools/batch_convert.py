@@ -0,0 +1,294 @@
+"""
+Command line tool to convert directories of APT datasets with a pool of worker processes.
+
+pyccapt HDF5, EPOS, POS, APT and ATO files are read; pyccapt HDF5, EPOS, POS and CSV files are written. APT and
+ATO are input formats only, as pyccapt has no writer for them. Raw pyccapt files (with a dld group) have no
+mass-to-charge or reconstruction and are not filtered for invalid events; they are converted to pyccapt HDF5
+or CSV as they are, but not to EPOS or POS (process them with stream_processing.raw_to_processed_streaming
+first).
+
+Example:
+    pyccapt-convert /data/campaign --to epos --workers 8 --max-memory 8000
+"""
+import argparse
+import concurrent.futures
+import glob
+import multiprocessing
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+import h5py
+
+# Local module and scripts
+from pyccapt.calibration.data_tools import data_loadcrop, data_tools, hdf5_dataset
+from pyccapt.calibration.leap_tools import ccapt_tools, leap_tools
+
+# Input file extension -> data_type of data_tools.load_data
+INPUT_TYPES = {
+    '.h5': 'pyccapt',
+    '.epos': 'leap_epos',
+    '.pos': 'leap_pos',
+    '.apt': 'leap_apt',
+    '.ato': 'ato_v6',
+}
+
+# Output format -> file extension
+OUTPUT_EXTENSIONS = {
+    'pyccapt': '.h5',
+    'epos': '.epos',
+    'pos': '.pos',
+    'csv': '.csv',
+}
+
+
+def find_input_files(inputs):
+    """
+    Expand directories and glob patterns into a sorted list of convertible files.
+
+    Args:
+        inputs (list): Directories, glob patterns or file paths.
+
+    Returns:
+        list: Paths of the files with a known input extension.
+    """
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            candidates = [os.path.join(item, name) for name in os.listdir(item)]
+        else:
+            candidates = glob.glob(item, recursive=True)
+        files.extend(path for path in candidates
+                     if os.path.isfile(path) and os.path.splitext(path)[1].lower() in INPUT_TYPES)
+    return sorted(set(files))
+
+
+def output_path(input_file, target, output_dir=None):
+    """
+    Path of the converted file.
+
+    Args:
+        input_file (str): Path of the input file.
+        target (str): Output format.
+        output_dir (str): Optional. Output directory. Defaults to the directory of the input file.
+
+    Returns:
+        str: Path of the output file.
+    """
+    directory = output_dir if output_dir is not None else os.path.dirname(input_file)
+    name = os.path.splitext(os.path.basename(input_file))[0]
+    return os.path.join(directory, name + OUTPUT_EXTENSIONS[target])
+
+
+def is_up_to_date(input_file, output_file):
+    """
+    Check if the output exists and is newer than the input.
+    """
+    return os.path.exists(output_file) and os.path.getmtime(output_file) >= os.path.getmtime(input_file)
+
+
+def is_raw_pyccapt(input_file):
+    """
+    Check if a file is a raw pyccapt file (with a dld group).
+    """
+    if INPUT_TYPES[os.path.splitext(input_file)[1].lower()] != 'pyccapt':
+        return False
+    with h5py.File(input_file, 'r') as f:
+        return 'dld' in f
+
+
+def load_dataset(input_file, columns=None):
+    """
+    Load any supported dataset as a pyccapt DataFrame.
+
+    Raw pyccapt files (with a dld group) are loaded without calibration or validity filter, so mc and the
+    positions are placeholders; processed pyccapt files are loaded as they are.
+
+    Args:
+        input_file (str): Path of the input file.
+        columns (list): Optional. Columns to load.
+
+    Returns:
+        pandas.DataFrame: pyccapt data.
+
+    Raises:
+        ValueError: If the dld group of a raw pyccapt file cannot be read.
+    """
+    data_type = INPUT_TYPES[os.path.splitext(input_file)[1].lower()]
+    if data_type == 'pyccapt':
+        if is_raw_pyccapt(input_file):
+            dld_data = data_loadcrop.fetch_dataset_from_dld_grp(input_file)
+            if dld_data is None:
+                raise ValueError('Could not read the dld group of %s' % input_file)
+            data = data_tools.pyccapt_raw_to_processed(dld_data)
+            return data[columns] if columns is not None else data
+        return data_tools.load_data(input_file, data_type, mode='processed', columns=columns)
+    return data_tools.load_data(input_file, data_type, columns=columns)
+
+
+def convert_file(input_file, output_file, target, columns=None, chunk_size=1_000_000):
+    """
+    Convert one file.
+
+    The output is written to a temporary file that is renamed when it is complete, so an interrupted
+    conversion never leaves an output that looks up to date.
+
+    Args:
+        input_file (str): Path of the input file.
+        output_file (str): Path of the output file.
+        target (str): Output format ('pyccapt', 'epos', 'pos' or 'csv').
+        columns (list): Optional. Columns to convert (pyccapt and csv only).
+        chunk_size (int): Number of ions written per chunk.
+
+    Returns:
+        tuple: (number of ions, input size in bytes)
+
+    Raises:
+        ValueError: If a raw pyccapt file is converted to EPOS or POS.
+    """
+    if target in ('epos', 'pos'):
+        if is_raw_pyccapt(input_file):
+            raise ValueError('%s is a raw pyccapt file without mc and reconstruction, process it before '
+                             'converting it to %s' % (input_file, target))
+        # EPOS/POS records have a fixed layout
+        mapping = ccapt_tools.EPOS_TO_CCAPT if target == 'epos' else ccapt_tools.POS_TO_CCAPT
+        columns = list(mapping)
+    data = load_dataset(input_file, columns)
+
+    temp_file = output_file + '.part'
+    try:
+        if target == 'pyccapt':
+            hdf5_dataset.write_processed_hdf5(data, temp_file, chunk_size=chunk_size)
+        elif target == 'epos':
+            ccapt_tools.write_ccapt_records(data, temp_file, leap_tools.EPOS_DTYPE, ccapt_tools.EPOS_TO_CCAPT,
+                                            chunk_size=chunk_size)
+        elif target == 'pos':
+            ccapt_tools.write_ccapt_records(data, temp_file, leap_tools.POS_DTYPE, ccapt_tools.POS_TO_CCAPT,
+                                            chunk_size=chunk_size)
+        elif target == 'csv':
+            data_tools.store_df_to_csv(data, temp_file)
+        os.replace(temp_file, output_file)
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+    return len(data), os.path.getsize(input_file)
+
+
+def _limit_memory(max_memory):
+    """
+    Worker initializer that caps the memory the worker process allocates (MB).
+
+    RLIMIT_DATA counts the heap and the anonymous mappings that hold the arrays, unlike RLIMIT_AS it does not
+    count the reserved address space of shared libraries and thread stacks. A worker that exceeds the limit
+    fails its file with a MemoryError instead of pushing the machine into swap.
+    """
+    if max_memory is None or resource is None:
+        return
+    limit = int(max_memory * 1024 ** 2)
+    resource.setrlimit(resource.RLIMIT_DATA, (limit, limit))
+
+
+def batch_convert(inputs, target, output_dir=None, columns=None, workers=None, max_memory=None, overwrite=False,
+                  chunk_size=1_000_000):
+    """
+    Convert many datasets concurrently.
+
+    Args:
+        inputs (list): Directories, glob patterns or file paths.
+        target (str): Output format ('pyccapt', 'epos', 'pos' or 'csv').
+        output_dir (str): Optional. Output directory. Defaults to the directory of each input file.
+        columns (list): Optional. Columns to convert (pyccapt and csv only).
+        workers (int): Optional. Number of worker processes. Defaults to the number of CPUs.
+        max_memory (float): Optional. Memory limit per worker in MB (POSIX only).
+        overwrite (bool): Convert even if the output is up to date.
+        chunk_size (int): Number of ions written per chunk.
+
+    Returns:
+        dict: Lists of the converted, skipped and failed files.
+    """
+    files = find_input_files(inputs)
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+
+    jobs = []
+    skipped = []
+    for input_file in files:
+        output_file = output_path(input_file, target, output_dir)
+        if os.path.abspath(output_file) == os.path.abspath(input_file) or \
+                (not overwrite and is_up_to_date(input_file, output_file)):
+            skipped.append(input_file)
+        else:
+            jobs.append((input_file, output_file))
+    print('Found %s files: %s to convert, %s up to date' % (len(files), len(jobs), len(skipped)))
+
+    if max_memory is not None and resource is None:
+        print('The memory limit per worker is not supported on this platform and is ignored')
+
+    converted = []
+    failed = []
+    total_ions = 0
+    total_bytes = 0
+    start_time = time.time()
+    # Spawned workers do not inherit the thread pools (numba, BLAS) or locks of the parent process
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_limit_memory,
+                                                initargs=(max_memory,),
+                                                mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = {executor.submit(convert_file, input_file, output_file, target, columns, chunk_size):
+                   (input_file, output_file) for input_file, output_file in jobs}
+        for i, future in enumerate(concurrent.futures.as_completed(futures)):
+            input_file, output_file = futures[future]
+            try:
+                num_ions, num_bytes = future.result()
+            except Exception as error:
+                failed.append(input_file)
+                print('[%s/%s] Failed %s: %s: %s' % (i + 1, len(jobs), input_file, type(error).__name__, error))
+                continue
+            converted.append(input_file)
+            total_ions += num_ions
+            total_bytes += num_bytes
+            elapsed = max(time.time() - start_time, 1e-9)
+            print('[%s/%s] %s -> %s (%s ions) | %.2e ions/s, %.1f MB/s' %
+                  (i + 1, len(jobs), input_file, output_file, num_ions, total_ions / elapsed,
+                   total_bytes / 1024 ** 2 / elapsed))
+
+    print('Converted %s files (%s ions) in %.1f s, %s failed' %
+          (len(converted), total_ions, time.time() - start_time, len(failed)))
+    return {'converted': converted, 'skipped': skipped, 'failed': failed}
+
+
+def main(argv=None):
+    """
+    Entry point of the pyccapt-convert command.
+    """
+    parser = argparse.ArgumentParser(description='Convert APT datasets (pyccapt HDF5, EPOS, POS, APT, ATO) to '
+                                                 'pyccapt HDF5, EPOS, POS or CSV in parallel.')
+    parser.add_argument('inputs', nargs='+', help='Directories, glob patterns or files to convert')
+    parser.add_argument('--to', dest='target', required=True, choices=list(OUTPUT_EXTENSIONS),
+                        help='Output format. Raw pyccapt files (with a dld group) are not converted to epos or '
+                             'pos')
+    parser.add_argument('--output-dir', default=None, help='Output directory (default: next to each input)')
+    parser.add_argument('--columns', default=None,
+                        help="Comma separated pyccapt columns to convert, e.g. 'x (nm),y (nm),z (nm),mc (Da)' "
+                             "(pyccapt and csv only)")
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes')
+    parser.add_argument('--max-memory', type=float, default=None, help='Memory limit per worker in MB (POSIX only)')
+    parser.add_argument('--chunk-size', type=int, default=1_000_000, help='Number of ions written per chunk')
+    parser.add_argument('--overwrite', action='store_true', help='Convert even if the output is up to date')
+    args = parser.parse_args(argv)
+
+    columns = [column.strip() for column in args.columns.split(',')] if args.columns else None
+    result = batch_convert(args.inputs, args.target, output_dir=args.output_dir, columns=columns,
+                           workers=args.workers, max_memory=args.max_memory, overwrite=args.overwrite,
+                           chunk_size=args.chunk_size)
+    return 1 if result['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -11,89 +11,48 @@ from mpl_toolkits.axes_grid1.anchored_artists import AnchoredSizeBar
 from mpl_toolkits.axes_grid1.axes_divider import make_axes_locatable
 from numba.cpython.slicing import make_slice_from_constant
 
-from pyccapt.calibration.data_tools import data_tools, selectors_data
+from pyccapt.calibration.data_tools import data_schema, hdf5_dataset, selectors_data, validity_filter
 
 
-def fetch_dataset_from_dld_grp(filename: str, extract_mode='dld') -> pd.DataFrame:
+def fetch_dataset_from_dld_grp(filename: str, extract_mode='dld', ion_range=None) -> pd.DataFrame:
     """
     Fetches dataset from HDF5 file.
 
+    Only the datasets of the requested group are read, and only for the requested ion range.
+
     Args:
         filename: Path to the HDF5 file.
         extract_mode: Mode of extraction.
                     dld: Extracts data from dld group.
                     tdc_sc: Extracts data from tdc for Surface Consept.
                     tdc_ro: Extracts data from tdc for Roentdek detector.
+        ion_range: Optional. (start, stop) ion indices to read.
 
     Returns:
         DataFrame: Contains relevant information from the dld group.
     """
     if extract_mode == 'dld':
-        try:
-            hdf5Data = data_tools.read_hdf5(filename)
-            if hdf5Data is None:
-                raise FileNotFoundError
-            dld_highVoltage = hdf5Data['dld/high_voltage'].to_numpy()
-            if 'dld/pulse' in hdf5Data:
-                dld_voltage_pulse = hdf5Data['dld/pulse'].to_numpy()
-            elif 'dld/voltage_pulse' in hdf5Data:
-                dld_voltage_pulse = hdf5Data['dld/voltage_pulse'].to_numpy()
-            elif 'dld/pulse_voltage' in hdf5Data:
-                dld_voltage_pulse = hdf5Data['dld/pulse_voltage'].to_numpy()
-            else:
-                raise KeyError('Neither dld/pulse nor dld/voltage_pulse exists in the dataset')
-            if 'dld/laser_pulse' in hdf5Data:
-                dld_laser_pulse = hdf5Data['dld/laser_pulse'].to_numpy()
-            else:
-                dld_laser_pulse = np.expand_dims(np.zeros(len(dld_highVoltage)), axis=1)
-
-            dld_startCounter = hdf5Data['dld/start_counter'].to_numpy()
-            dld_t = hdf5Data['dld/t'].to_numpy()
-            dld_x = hdf5Data['dld/x'].to_numpy()
-            dld_y = hdf5Data['dld/y'].to_numpy()
-            dldGroupStorage = np.concatenate(
-                (dld_highVoltage, dld_voltage_pulse, dld_startCounter, dld_t, dld_x, dld_y),
-                                             axis=1)
-            dld_group_storage = create_pandas_dataframe(dldGroupStorage, mode='dld')
-            return dld_group_storage
-        except KeyError as error:
-            print(error)
-            print("[*] Keys missing in the dataset")
-        except FileNotFoundError as error:
-            print(error)
-            print("[*] HDF5 file not found")
+        column_map = hdf5_dataset.DLD_COLUMNS
     elif extract_mode == 'tdc_sc':
-        try:
-            hdf5Data = data_tools.read_hdf5(filename)
-            if hdf5Data is None:
-                raise FileNotFoundError
-            channel = hdf5Data['tdc/channel'].to_numpy()
-            start_counter = hdf5Data['tdc/start_counter'].to_numpy()
-            high_voltage = hdf5Data['tdc/high_voltage'].to_numpy()
-            if 'tdc/pulse' in hdf5Data:
-                voltage_pulse = hdf5Data['tdc/pulse'].to_numpy()
-            elif 'tdc/voltage_pulse' in hdf5Data:
-                voltage_pulse = hdf5Data['tdc/voltage_pulse'].to_numpy()
-            else:
-                raise KeyError('Neither tdc/pulse nor tdc/voltage_pulse exists in the dataset')
-            if 'tdc/laser_pulse' in hdf5Data:
-                laser_pulse = hdf5Data['tdc/laser_pulse'].to_numpy()
-            else:
-                laser_pulse = np.zeros(len(channel))
-            time_data = hdf5Data['tdc/time_data'].to_numpy()
-
-            dldGroupStorage = np.concatenate((channel, start_counter, high_voltage, voltage_pulse,
-                                              time_data), axis=1)
-            dld_group_storage = create_pandas_dataframe(dldGroupStorage, mode='tdc_sc')
-            return dld_group_storage
-        except KeyError as error:
-            print(error)
-            print("[*] Keys missing in the dataset")
-        except FileNotFoundError as error:
-            print(error)
-            print("[*] HDF5 file not found")
+        column_map = hdf5_dataset.TDC_SC_COLUMNS
     elif extract_mode == 'tdc_ro':
         print('Not implemented yet')
+        return None
+    try:
+        with hdf5_dataset.LazyHDF5Dataset(filename, column_map) as dataset:
+            dld_group_storage = dataset.to_dataframe(ion_range=ion_range)
+        # pyccapt columns follow data_schema, the tdc counters are uint32 as in create_pandas_dataframe
+        for column in ['channel', 'time_data']:
+            if column in dld_group_storage:
+                dld_group_storage[column] = dld_group_storage[column].astype('uint32')
+        return data_schema.apply_schema(dld_group_storage)
+    except KeyError as error:
+        print(error)
+        print("[*] Keys missing in the dataset")
+    except FileNotFoundError as error:
+        print(error)
+        print("[*] HDF5 file not found")
+
 
 def concatenate_dataframes_of_dld_grp(dataframeList: list) -> pd.DataFrame:
     """
@@ -133,9 +92,7 @@ def plot_crop_experiment_history(data: pd.DataFrame, variables, max_tof, frac=1.
     """
 
     if max_tof > 0:
-        mask_1 = (data['t (ns)'].to_numpy() > max_tof)
-        data.drop(np.where(mask_1)[0], inplace=True)
-        data.reset_index(inplace=True, drop=True)
+        validity_filter.drop_invalid(data, [validity_filter.tof_max_rule(max_tof)])
     if frac < 1:
         # set axis limits based on fraction of data
         dldGroupStorage = data.sample(frac=frac, random_state=42)
@@ -501,7 +458,7 @@ def create_pandas_dataframe(data_crop, mode='dld'):
                                      columns=['high_voltage (V)', 'pulse', 'start_counter', 't (ns)',
                                               'x_det (cm)', 'y_det (cm)'])
 
-        hdf_dataframe['start_counter'] = hdf_dataframe['start_counter'].astype('uint32')
+        hdf_dataframe = data_schema.apply_schema(hdf_dataframe)
     elif mode == 'tdc_sc':
         hdf_dataframe = pd.DataFrame(data=data_crop,
                                      columns=['channel', 'start_counter', 'high_voltage (V)', 'pulse',
@@ -533,9 +490,9 @@ def calculate_ppi_and_ipp(data, max_start_counter):
 
     """
 
-    counter = data['start_counter'].to_numpy()
-    delta_p = np.zeros(len(counter))
-    multi = np.zeros(len(counter))
+    counter = data['start_counter'].to_numpy().astype(np.int64)
+    delta_p = data_schema.placeholder_column('delta_p', len(counter))
+    multi = data_schema.placeholder_column('multi', len(counter))
 
     multi_hit_count = 1
 
@@ -0,0 +1,105 @@
+"""
+Column schema of the in-memory pyccapt DataFrame.
+
+Every loader (raw and processed pyccapt HDF5, EPOS, POS, APT and ATO) builds its DataFrame through this
+module so that each column has the same compact dtype whatever the source. The same dtypes are used to
+store processed datasets (see hdf5_dataset).
+"""
+import numpy as np
+import pandas as pd
+
+# Column order of the pyccapt DataFrame
+CCAPT_COLUMNS = ['x (nm)', 'y (nm)', 'z (nm)', 'mc (Da)', 'mc_uc (Da)', 'high_voltage (V)', 'pulse', 't (ns)',
+                 't_c (ns)', 'x_det (cm)', 'y_det (cm)', 'delta_p', 'multi', 'start_counter']
+
+# pyccapt column -> dtype (see DATA_STRUCTURE.md)
+CCAPT_DTYPES = {
+    'x (nm)': np.float32,
+    'y (nm)': np.float32,
+    'z (nm)': np.float32,
+    'mc (Da)': np.float32,
+    'mc_uc (Da)': np.float32,
+    'high_voltage (V)': np.float32,
+    'pulse': np.float32,
+    't (ns)': np.float32,
+    't_c (ns)': np.float32,
+    'x_det (cm)': np.float32,
+    'y_det (cm)': np.float32,
+    'delta_p': np.int32,
+    'multi': np.uint8,
+    'start_counter': np.uint64,
+}
+
+
+def placeholder_column(column: str, length: int) -> np.ndarray:
+    """
+    Zero-filled column with the schema dtype.
+
+    The array is allocated with np.zeros, so its memory pages are only committed by the operating
+    system when they are first written. A placeholder that is never filled in (e.g. x/y/z before
+    the reconstruction) costs almost no resident memory.
+
+    Args:
+        column: pyccapt column name.
+        length: Number of ions.
+
+    Returns:
+        1D array of zeros.
+    """
+    return np.zeros(length, dtype=CCAPT_DTYPES.get(column, np.float64))
+
+
+def ccapt_dataframe(data: dict, length: int = None, columns: list = None) -> pd.DataFrame:
+    """
+    Build a pyccapt DataFrame that follows the schema.
+
+    Given columns are cast to their schema dtype (without a copy if they already have it) and missing
+    columns are added as placeholders. The arrays are not copied or consolidated into one block, so
+    the placeholders stay lazily allocated.
+
+    Args:
+        data: Maps pyccapt column names to arrays.
+        length: Optional. Number of ions, needed only if data is empty.
+        columns: Optional. Columns of the DataFrame, in order. Defaults to CCAPT_COLUMNS.
+
+    Returns:
+        pandas.DataFrame: pyccapt data.
+    """
+    if columns is None:
+        columns = CCAPT_COLUMNS
+    else:
+        unknown = [c for c in columns if c not in CCAPT_COLUMNS]
+        if unknown:
+            raise KeyError(f'Unknown pyccapt columns: {unknown}')
+    if length is None:
+        length = len(next(iter(data.values()))) if data else 0
+
+    data_dict = {}
+    for column in columns:
+        if column in data:
+            data_dict[column] = np.asarray(data[column]).astype(CCAPT_DTYPES[column], copy=False)
+        else:
+            data_dict[column] = placeholder_column(column, length)
+    return pd.DataFrame(data_dict, copy=False)
+
+
+def apply_schema(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Cast the pyccapt columns of a DataFrame to their schema dtype.
+
+    Columns that are not part of the schema (e.g. ion names or tdc channels) keep their dtype and the
+    column order is preserved.
+
+    Args:
+        data: DataFrame to convert.
+
+    Returns:
+        pandas.DataFrame: DataFrame with the schema dtypes.
+    """
+    data_dict = {}
+    for column in data.columns:
+        values = data[column].to_numpy()
+        if column in CCAPT_DTYPES:
+            values = values.astype(CCAPT_DTYPES[column], copy=False)
+        data_dict[column] = values
+    return pd.DataFrame(data_dict, index=data.index, copy=False)
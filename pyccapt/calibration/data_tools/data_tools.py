@@ -4,7 +4,8 @@ import pandas as pd
 import scipy.io
 
 # Local module and scripts
-from pyccapt.calibration.data_tools import ato_tools, data_loadcrop, data_tools
+from pyccapt.calibration.data_tools import ato_tools, data_loadcrop, data_schema, data_tools, hdf5_dataset, \
+    validity_filter
 from pyccapt.calibration.leap_tools import ccapt_tools
 from pyccapt.calibration.mc import tof_tools
 from pyccapt.calibration.leap_tools import leap_tools
@@ -124,51 +125,51 @@ def store_df_to_csv(data, path):
     data.to_csv(path, encoding='utf-8', index=False, sep=';')
 
 
-def remove_invalid_data(dld_group_storage, max_tof):
+def invalid_data_mask(dld_group_storage, max_tof):
     """
-    Removes the data with time-of-flight (TOF) values greater than max_tof or lower than 0.
+    Flags the data with time-of-flight (TOF) values greater than max_tof or lower than 50 ns, negative
+    voltage or a hit at the detector origin.
 
     Args:
         dld_group_storage (pandas.DataFrame): DataFrame containing the DLD group storage data.
         max_tof (float): Maximum allowable TOF value.
 
     Returns:
-        None. The DataFrame is modified in-place.
+        numpy.ndarray: Boolean mask that is True for the invalid data.
 
     """
-    # Create a mask for data with TOF values greater than max_tof
-    mask_1 = dld_group_storage['t (ns)'].to_numpy() > max_tof
-
-    mask_2 = (dld_group_storage['t (ns)'].to_numpy() < 50)  # Remove data with TOF values less than 50 ns
-
-    mask_3 = ((dld_group_storage['x_det (cm)'].to_numpy() == 0) & (dld_group_storage['y_det (cm)'].to_numpy() == 0) &
-              (dld_group_storage['t (ns)'].to_numpy() == 0))
-
-    mask_4 = (dld_group_storage['high_voltage (V)'].to_numpy() < 0)
+    keep, _ = validity_filter.evaluate_rules(dld_group_storage, validity_filter.default_rules(max_tof))
+    return ~keep
 
-    mask_5 = (dld_group_storage['x_det (cm)'].to_numpy() == 0) & (dld_group_storage['y_det (cm)'].to_numpy() == 0)
 
-    mask_f_1 = np.logical_or(mask_1, mask_2)
-    mask_f_2 = np.logical_or(mask_3, mask_4)
-    mask_f_2 = np.logical_or(mask_f_2, mask_5)
-    mask = np.logical_or(mask_f_1, mask_f_2)
+def remove_invalid_data(dld_group_storage, max_tof, rules=None):
+    """
+    Removes the data with time-of-flight (TOF) values greater than max_tof or lower than 50 ns, negative
+    voltage or a hit at the detector origin.
 
-    # Calculate the number of data points over max_tof
-    num_over_max_tof = len(mask[mask])
+    Args:
+        dld_group_storage (pandas.DataFrame): DataFrame containing the DLD group storage data.
+        max_tof (float): Maximum allowable TOF value.
+        rules (list): Optional. Validity rules (see validity_filter) used instead of the default rules,
+                      e.g. validity_filter.default_rules(max_tof) + [validity_filter.detector_edge_rule(4)].
 
-    # Remove data points with TOF values greater than max_tof
-    dld_group_storage.drop(np.where(mask)[0], inplace=True)
+    Returns:
+        pandas.DataFrame: DataFrame without the invalid data.
 
-    # Reset the index of the DataFrame
-    dld_group_storage.reset_index(inplace=True, drop=True)
+    """
+    if rules is None:
+        rules = validity_filter.default_rules(max_tof)
+    data, counts = validity_filter.filter_valid(dld_group_storage, rules)
 
-    # Print the number of data points over max_tof
-    print('The number of data that is removed:', num_over_max_tof)
+    for name, count in counts.items():
+        print('The number of data removed by the rule %s:' % name, count)
+    print('The number of data that is removed:', sum(counts.values()))
 
-    return dld_group_storage
+    return data
 
 
-def save_data(data, variables, name=None, hdf=True, epos=False, pos=False, csv=False, temp=False):
+def save_data(data, variables, name=None, hdf=True, epos=False, pos=False, csv=False, temp=False,
+              hdf_format='pandas'):
     """
     save data in different formats
 
@@ -181,6 +182,9 @@ def save_data(data, variables, name=None, hdf=True, epos=False, pos=False, csv=F
         pos (bool): save data as pos file.
         csv (bool): save data as csv file.
         temp (bool): save data as temporary file.
+        hdf_format (string): 'pandas' (default) for the pandas fixed format that pd.read_hdf reads, or
+                             'columnar' for the chunked, compressed layout of hdf5_dataset.write_processed_hdf5
+                             (read with load_data or hdf5_dataset.read_processed_hdf5).
 
     Returns:
         None. The DataFrame is modified in-place.
@@ -197,7 +201,11 @@ def save_data(data, variables, name=None, hdf=True, epos=False, pos=False, csv=F
     if hdf:
         # save the dataset to hdf5 file
         hierarchyName = 'df'
-        store_df_to_hdf(data, hierarchyName, variables.result_data_path + '//' + data_name + '.h5')
+        if hdf_format == 'columnar':
+            hdf5_dataset.write_processed_hdf5(data, variables.result_data_path + '//' + data_name + '.h5',
+                                              key=hierarchyName)
+        else:
+            store_df_to_hdf(data, hierarchyName, variables.result_data_path + '//' + data_name + '.h5')
     if epos:
         # save data as epos file
         ccapt_tools.ccapt_to_epos(data, path=variables.result_path,
@@ -210,7 +218,7 @@ def save_data(data, variables, name=None, hdf=True, epos=False, pos=False, csv=F
         store_df_to_csv(data, variables.result_path + variables.result_data_name + '.csv')
 
 
-def load_data(dataset_path, data_type, mode='processed'):
+def load_data(dataset_path, data_type, mode='processed', columns=None, filters=None):
     """
     save data in different formats
 
@@ -218,6 +226,10 @@ def load_data(dataset_path, data_type, mode='processed'):
         dataset_path (string): path to the dataset.
         data_type (string): type of the dataset.
         mode (string): mode of the dataset.
+        columns (list): Optional. Columns to load (not used for raw pyccapt datasets).
+        filters (dict): Optional. Maps column names to (low, high) ranges, e.g. {'mc (Da)': (26, 28)}, to
+                        load only the matching ions of a processed pyccapt dataset. Chunks of the columnar
+                        layout that cannot match are not read.
 
     Returns:
         data (pandas.DataFrame): DataFrame containing the data.
@@ -225,18 +237,30 @@ def load_data(dataset_path, data_type, mode='processed'):
     """
     if data_type == 'leap_pos' or data_type == 'leap_epos':
         if data_type == 'leap_epos':
-            data = ccapt_tools.epos_to_ccapt(dataset_path)
+            data = ccapt_tools.epos_to_ccapt(dataset_path, columns=columns)
         else:
             print('The dataset should contains at least epos information to use all possible analysis')
-            data = ccapt_tools.pos_to_ccapt(dataset_path)
+            data = ccapt_tools.pos_to_ccapt(dataset_path, columns=columns)
     elif data_type == 'leap_apt':
-        data = ccapt_tools.apt_to_ccapt(dataset_path)
+        data = ccapt_tools.apt_to_ccapt(dataset_path, columns=columns)
     elif data_type == 'ato_v6':
-        data = ato_tools.ato_to_ccapt(dataset_path, moed='pyccapt')
+        data = ato_tools.ato_to_ccapt(dataset_path, mode='pyccapt')
+        if columns is not None:
+            data = data[columns]
     elif data_type == 'pyccapt' and mode == 'raw':
         data = data_loadcrop.fetch_dataset_from_dld_grp(dataset_path)
     elif data_type == 'pyccapt' and mode == 'processed':
-        data = pd.read_hdf(dataset_path, mode='r')
+        if hdf5_dataset.is_columnar_hdf5(dataset_path):
+            data = hdf5_dataset.read_processed_hdf5(dataset_path, columns=columns, filters=filters)
+        else:
+            data = data_schema.apply_schema(pd.read_hdf(dataset_path, mode='r'))
+            if filters:
+                mask = np.ones(len(data), dtype=bool)
+                for column, (low, high) in filters.items():
+                    mask &= (data[column].to_numpy() >= low) & (data[column].to_numpy() <= high)
+                data = data[mask].reset_index(drop=True)
+            if columns is not None:
+                data = data[columns]
     return data
 
 
@@ -290,22 +314,14 @@ def pyccapt_raw_to_processed(data):
         data (pandas.DataFrame): DataFrame containing the processed data.
 
     """
-    # create pandas an empty dataframe
-    data_processed = pd.DataFrame()
-    data_processed['x (nm)'] = np.zeros(len(data))
-    data_processed['y (nm)'] = np.zeros(len(data))
-    data_processed['z (nm)'] = np.zeros(len(data))
-    data_processed['mc (Da)'] = np.zeros(len(data))
-    data_processed['mc_uc (Da)'] = np.zeros(len(data))
-    data_processed['high_voltage (V)'] = data['high_voltage (V)'].to_numpy()
-    data_processed['pulse'] = data['pulse'].to_numpy()
-    data_processed['t (ns)'] = data['t (ns)'].to_numpy()
-    data_processed['t_c (ns)'] = np.zeros(len(data))
-    data_processed['x_det (cm)'] = data['x_det (cm)'].to_numpy()
-    data_processed['y_det (cm)'] = data['y_det (cm)'].to_numpy()
-    data_processed['delta_p'] = np.zeros(len(data))
-    data_processed['multi'] = np.zeros(len(data))
-    data_processed['start_counter'] = data['start_counter'].to_numpy()
+    # Placeholder columns (x, y, z, mc, mc_uc, t_c, delta_p, multi) are added by data_schema
+    data_processed = data_schema.ccapt_dataframe({
+        'high_voltage (V)': data['high_voltage (V)'].to_numpy(),
+        'pulse': data['pulse'].to_numpy(),
+        't (ns)': data['t (ns)'].to_numpy(),
+        'x_det (cm)': data['x_det (cm)'].to_numpy(),
+        'y_det (cm)': data['y_det (cm)'].to_numpy(),
+        'start_counter': data['start_counter'].to_numpy()}, length=len(data))
 
     return data_processed
 
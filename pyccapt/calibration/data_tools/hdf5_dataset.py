@@ -0,0 +1,418 @@
+import h5py
+import numpy as np
+import pandas as pd
+
+try:
+    import hdf5plugin
+except ImportError:
+    hdf5plugin = None
+
+# Local module and scripts
+from pyccapt.calibration.data_tools import data_schema
+
+# pyccapt column -> candidate dataset keys in a raw pyccapt HDF5 file, in order of preference
+DLD_COLUMNS = {
+    'high_voltage (V)': ['dld/high_voltage'],
+    'pulse': ['dld/pulse', 'dld/voltage_pulse', 'dld/pulse_voltage'],
+    'start_counter': ['dld/start_counter'],
+    't (ns)': ['dld/t'],
+    'x_det (cm)': ['dld/x'],
+    'y_det (cm)': ['dld/y'],
+}
+
+TDC_SC_COLUMNS = {
+    'channel': ['tdc/channel'],
+    'start_counter': ['tdc/start_counter'],
+    'high_voltage (V)': ['tdc/high_voltage'],
+    'pulse': ['tdc/pulse', 'tdc/voltage_pulse'],
+    'time_data': ['tdc/time_data'],
+}
+
+# Storage dtypes of the processed pyccapt columns. Columns that are not listed keep their in-memory dtype.
+PROCESSED_DTYPES = data_schema.CCAPT_DTYPES
+
+# Marker of the chunked columnar layout written by write_processed_hdf5
+COLUMNAR_LAYOUT = 'pyccapt_columnar_v1'
+
+
+class LazyHDF5Dataset:
+    """
+    Lazy, columnar view of an HDF5 file.
+
+    Nothing is read when the object is created. Columns are read from the file only when they are
+    requested, and only for the requested ion range, so the memory use is set by what the caller
+    asks for instead of by the size of the file.
+
+    Columns are addressed either by their dataset key (e.g. 'dld/t') or, if a column map such as
+    DLD_COLUMNS is given, by the pyccapt column name (e.g. 't (ns)').
+    """
+
+    def __init__(self, filename: str, columns: dict = None):
+        """
+        Open the HDF5 file.
+
+        Args:
+            filename: Path to the HDF5 file.
+            columns: Optional. Maps column names to a list of candidate dataset keys.
+        """
+        self.filename = filename
+        self.file = h5py.File(filename, 'r')
+        self.column_map = columns if columns is not None else {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Close the HDF5 file.
+        """
+        self.file.close()
+
+    def keys(self) -> list:
+        """
+        Return the keys ('group/name') of all datasets in the file.
+        """
+        keys = []
+        self.file.visititems(lambda name, obj: keys.append(name) if isinstance(obj, h5py.Dataset) else None)
+        return keys
+
+    def resolve(self, name: str) -> str:
+        """
+        Return the dataset key of a column.
+
+        Args:
+            name: Column name or dataset key.
+
+        Returns:
+            The dataset key.
+
+        Raises:
+            KeyError: If the column is not in the file.
+        """
+        if name in self.column_map:
+            for key in self.column_map[name]:
+                if key in self.file:
+                    return key
+            raise KeyError('None of %s exists in the dataset' % self.column_map[name])
+        if name in self.file:
+            return name
+        raise KeyError('%s does not exist in the dataset' % name)
+
+    def __contains__(self, name: str) -> bool:
+        try:
+            self.resolve(name)
+            return True
+        except KeyError:
+            return False
+
+    def __len__(self) -> int:
+        """
+        Number of rows of the first mapped column (or of the first dataset if no map is given).
+        """
+        names = list(self.column_map) if self.column_map else self.keys()
+        for name in names:
+            if name in self:
+                return self.file[self.resolve(name)].shape[0]
+        return 0
+
+    def column(self, name: str, ion_range: tuple = None) -> np.ndarray:
+        """
+        Read one column.
+
+        Args:
+            name: Column name or dataset key.
+            ion_range: Optional. (start, stop) row indices to read.
+
+        Returns:
+            1D array with the dtype stored in the file.
+        """
+        dataset = self.file[self.resolve(name)]
+        if ion_range is not None:
+            values = dataset[slice(*ion_range)]
+        else:
+            values = dataset[()]
+        # Raw datasets are stored either as (n,) or as (n, 1)
+        if values.ndim == 2 and values.shape[1] == 1:
+            values = values[:, 0]
+        return values
+
+    def to_dataframe(self, columns: list = None, ion_range: tuple = None) -> pd.DataFrame:
+        """
+        Build a DataFrame that contains only the requested columns.
+
+        Args:
+            columns: Optional. Columns to read. Defaults to all mapped columns.
+            ion_range: Optional. (start, stop) row indices to read.
+
+        Returns:
+            DataFrame with one column per requested column.
+        """
+        if columns is None:
+            columns = list(self.column_map) if self.column_map else self.keys()
+        return pd.DataFrame({name: self.column(name, ion_range) for name in columns})
+
+    def iter_chunks(self, columns: list = None, chunk_size: int = 10_000_000, ion_range: tuple = None):
+        """
+        Iterate over the rows in chunks.
+
+        Args:
+            columns: Optional. Columns to read. Defaults to all mapped columns.
+            chunk_size: Number of rows per chunk.
+            ion_range: Optional. (start, stop) row indices to iterate over.
+
+        Yields:
+            (start, DataFrame) for each chunk, where start is the index of the first row of the chunk.
+        """
+        start, stop, _ = slice(*ion_range).indices(len(self)) if ion_range is not None else (0, len(self), 1)
+        for chunk_start in range(start, stop, chunk_size):
+            chunk_stop = min(chunk_start + chunk_size, stop)
+            yield chunk_start, self.to_dataframe(columns, ion_range=(chunk_start, chunk_stop))
+
+
+def _compression_kwargs(compression: str, compression_opts=None) -> dict:
+    """
+    Return the h5py create_dataset keyword arguments of a compression filter.
+    """
+    if compression is None:
+        return {}
+    if compression == 'blosc':
+        if hdf5plugin is None:
+            print('hdf5plugin is not installed, lzf compression is used instead of blosc')
+            return {'compression': 'lzf', 'shuffle': True}
+        clevel = compression_opts if compression_opts is not None else 5
+        return dict(hdf5plugin.Blosc(cname='lz4', clevel=clevel, shuffle=hdf5plugin.Blosc.SHUFFLE))
+    if compression == 'gzip':
+        return {'compression': 'gzip', 'compression_opts': compression_opts if compression_opts is not None else 4,
+                'shuffle': True}
+    if compression == 'lzf':
+        return {'compression': 'lzf', 'shuffle': True}
+    raise ValueError('compression should be None, lzf, gzip or blosc')
+
+
+def is_columnar_hdf5(filename: str, key: str = 'df') -> bool:
+    """
+    Check if an HDF5 file was written by write_processed_hdf5.
+
+    Args:
+        filename: Path to the HDF5 file.
+        key: Name of the data group.
+
+    Returns:
+        True if the file has the chunked columnar layout.
+    """
+    with h5py.File(filename, 'r') as f:
+        return key in f and f[key].attrs.get('layout') == COLUMNAR_LAYOUT
+
+
+class ProcessedHDF5Writer:
+    """
+    Incremental writer of the chunked, compressed columnar layout of processed datasets.
+
+    Each column is stored as its own resizable dataset under /<key> with the dtype given in
+    PROCESSED_DTYPES. The min/max of every chunk of every numeric column is stored in
+    /<key>_stats/<column> with shape (number of chunks, 2), so that range queries can skip whole
+    chunks when reading. Rows can be appended in blocks of any size; the statistics always refer to
+    HDF5 chunks of chunk_size rows.
+    """
+
+    def __init__(self, filename: str, key: str = 'df', chunk_size: int = 1_000_000, compression: str = 'lzf',
+                 compression_opts=None):
+        """
+        Create the HDF5 file.
+
+        Args:
+            filename: Path of the HDF5 file to write.
+            key: Name of the data group.
+            chunk_size: Number of ions per HDF5 chunk.
+            compression: None, 'lzf', 'gzip' or 'blosc' (needs hdf5plugin).
+            compression_opts: Optional. Compression level for gzip/blosc.
+        """
+        self.file = h5py.File(filename, 'w')
+        self.key = key
+        self.chunk_size = chunk_size
+        self.filter_kwargs = _compression_kwargs(compression, compression_opts)
+        self.group = self.file.create_group(key)
+        self.columns = None
+        self.stats = {}
+        self.length = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # A write interrupted by an exception must not look like a complete layout
+        self.close(complete=exc_type is None)
+
+    def _create_datasets(self, data: pd.DataFrame):
+        self.columns = [str(column) for column in data.columns]
+        for column in data.columns:
+            values = data[column].to_numpy()
+            if not np.issubdtype(values.dtype, np.number) and values.dtype != np.bool_:
+                # Labels (e.g. ion names) are stored as strings without statistics
+                dtype = h5py.string_dtype()
+            else:
+                dtype = PROCESSED_DTYPES.get(column, values.dtype)
+                self.stats[str(column)] = []
+            self.group.create_dataset(str(column), shape=(0,), maxshape=(None,), dtype=dtype,
+                                      chunks=(self.chunk_size,), **self.filter_kwargs)
+
+    def append(self, data: pd.DataFrame):
+        """
+        Append rows to the file.
+
+        Args:
+            data: DataFrame with the same columns as the first appended block.
+
+        Returns:
+            None
+        """
+        if self.columns is None:
+            self._create_datasets(data)
+        length = len(data)
+        if length == 0:
+            return
+        start = self.length
+        stop = start + length
+        for column in self.columns:
+            dataset = self.group[column]
+            dataset.resize((stop,))
+            values = data[column].to_numpy()
+            if column not in self.stats:
+                dataset[start:stop] = values.astype(str).astype(object)
+                continue
+            values = values.astype(dataset.dtype, copy=False)
+            dataset[start:stop] = values
+            # Update the min/max of every HDF5 chunk touched by the new rows
+            stats = self.stats[column]
+            for block_start in range(start - start % self.chunk_size, stop, self.chunk_size):
+                block = values[max(block_start, start) - start:min(block_start + self.chunk_size, stop) - start]
+                if np.issubdtype(block.dtype, np.floating):
+                    block = block[np.isfinite(block)]
+                block_index = block_start // self.chunk_size
+                if block_index == len(stats):
+                    stats.append([np.nan, np.nan])
+                if len(block) > 0:
+                    low, high = float(block.min()), float(block.max())
+                    old_low, old_high = stats[block_index]
+                    stats[block_index] = [np.nanmin([old_low, low]), np.nanmax([old_high, high])]
+        self.length = stop
+
+    def close(self, complete: bool = True):
+        """
+        Write the layout attributes and the chunk statistics and close the file.
+
+        Args:
+            complete: If False (the write failed), the file is closed without the layout attributes, so
+                      is_columnar_hdf5 and read_processed_hdf5 do not accept it.
+
+        Returns:
+            None
+        """
+        if not self.file:
+            return
+        if not complete:
+            self.file.close()
+            return
+        stats_group = self.file.create_group(self.key + '_stats')
+        for column, stats in self.stats.items():
+            stats_group.create_dataset(column, data=np.array(stats, dtype=np.float64).reshape(-1, 2))
+        self.group.attrs['layout'] = COLUMNAR_LAYOUT
+        self.group.attrs['columns'] = self.columns if self.columns is not None else []
+        self.group.attrs['chunk_size'] = self.chunk_size
+        self.group.attrs['length'] = self.length
+        self.file.close()
+
+
+def write_processed_hdf5(data: pd.DataFrame, filename: str, key: str = 'df', chunk_size: int = 1_000_000,
+                         compression: str = 'lzf', compression_opts=None):
+    """
+    Store a processed dataset in the chunked, compressed columnar layout (see ProcessedHDF5Writer).
+
+    Args:
+        data: DataFrame containing the processed data.
+        filename: Path of the HDF5 file to write.
+        key: Name of the data group.
+        chunk_size: Number of ions per HDF5 chunk.
+        compression: None, 'lzf', 'gzip' or 'blosc' (needs hdf5plugin).
+        compression_opts: Optional. Compression level for gzip/blosc.
+
+    Returns:
+        None
+    """
+    with ProcessedHDF5Writer(filename, key=key, chunk_size=chunk_size, compression=compression,
+                             compression_opts=compression_opts) as writer:
+        if len(data) == 0:
+            writer.append(data)
+        for start in range(0, len(data), chunk_size):
+            writer.append(data.iloc[start:start + chunk_size])
+
+
+def read_processed_hdf5(filename: str, columns: list = None, filters: dict = None,
+                        key: str = 'df') -> pd.DataFrame:
+    """
+    Read a processed dataset written by write_processed_hdf5.
+
+    Chunks whose stored min/max show that no ion can pass the filters are not read from the file.
+
+    Args:
+        filename: Path to the HDF5 file.
+        columns: Optional. Columns to read. Defaults to all columns.
+        filters: Optional. Maps column names to (low, high) ranges, e.g. {'mc (Da)': (26, 28)}. Only ions
+                 with low <= value <= high in all filtered columns are returned.
+        key: Name of the data group.
+
+    Returns:
+        DataFrame with the requested columns in the dtypes of data_schema.
+
+    Raises:
+        ValueError: If the file is not a complete columnar layout (e.g. the write was interrupted).
+    """
+    filters = filters if filters is not None else {}
+    with h5py.File(filename, 'r') as f:
+        group = f[key]
+        if group.attrs.get('layout') != COLUMNAR_LAYOUT:
+            raise ValueError('%s is not a complete columnar processed dataset' % filename)
+        stats_group = f[key + '_stats']
+        if columns is None:
+            columns = list(group.attrs['columns'])
+        chunk_size = int(group.attrs['chunk_size'])
+        length = int(group.attrs['length'])
+        num_chunks = -(-length // chunk_size)
+
+        keep = np.ones(num_chunks, dtype=bool)
+        for column, (low, high) in filters.items():
+            stats = stats_group[column][()]
+            keep &= (stats[:, 1] >= low) & (stats[:, 0] <= high)
+
+        def read_column(column, start, stop):
+            dataset = group[column]
+            if h5py.check_string_dtype(dataset.dtype) is not None:
+                return dataset.asstr()[start:stop]
+            return dataset[start:stop]
+
+        parts = {column: [] for column in columns}
+        for i in np.flatnonzero(keep):
+            start, stop = i * chunk_size, min((i + 1) * chunk_size, length)
+            mask = None
+            # The filter columns are read once, for the mask and (if requested) the output
+            chunk = {}
+            for column, (low, high) in filters.items():
+                chunk[column] = read_column(column, start, stop)
+                column_mask = (chunk[column] >= low) & (chunk[column] <= high)
+                mask = column_mask if mask is None else mask & column_mask
+            for column in columns:
+                values = chunk[column] if column in chunk else read_column(column, start, stop)
+                parts[column].append(values[mask] if mask is not None else values)
+
+        data = {}
+        for column in columns:
+            if parts[column]:
+                data[column] = np.concatenate(parts[column])
+            else:
+                dataset = group[column]
+                data[column] = np.empty(0, dtype=object if h5py.check_string_dtype(dataset.dtype) is not None
+                                        else dataset.dtype)
+    return data_schema.apply_schema(pd.DataFrame(data, copy=False))
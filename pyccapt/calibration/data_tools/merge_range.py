@@ -1,10 +1,146 @@
 import numpy as np
 
+# Value of the range columns for the ions outside all ranges
+DEFAULT_VALUES = {
+    'name': np.nan,
+    'ion': np.nan,
+    'mass': np.nan,
+    'mc': np.nan,
+    'mc_low': np.nan,
+    'mc_up': np.nan,
+    'color': 'black',
+    'element': 'noise',
+    'complex': np.nan,
+    'isotope': np.nan,
+    'charge': np.nan
+}
+
+RANGE_COLUMNS = ['name', 'ion', 'mass', 'mc', 'mc_low', 'mc_up', 'color', 'element', 'complex', 'isotope', 'charge']
+
+
+class RangeLabeler:
+    """
+    Assign the ions to mass-to-charge ranges with a sorted interval index.
+
+    The (possibly overlapping) closed ranges [mc_low, mc_up] are split at all their bounds into sorted,
+    non-overlapping elementary intervals, and each interval is owned by one range. Labeling an ion is
+    then a binary search (np.searchsorted) over the interval bounds, so labeling N ions against R ranges
+    takes O(N log R) time and O(N) memory. The labeler only depends on the ranges, so it can be built
+    once and used chunk by chunk.
+    """
+
+    def __init__(self, range_df, overlap='first'):
+        """
+        Build the interval index.
+
+        Parameters:
+            range_df (pd.DataFrame): The dataframe containing the range values 'mc_low' and 'mc_up'.
+            overlap (str): Owner of a mass-to-charge value that is in several ranges: 'first' (the first of
+                           these ranges in range_df, as merge_by_range always did), 'narrowest' (the
+                           narrowest of these ranges) or 'error' (raise a ValueError if ranges overlap).
+        """
+        if overlap not in ('first', 'narrowest', 'error'):
+            raise ValueError("overlap should be 'first', 'narrowest' or 'error'")
+        self.range_df = range_df
+        low = range_df['mc_low'].to_numpy(dtype=np.float64)
+        # Closed ranges [low, up] as half-open intervals [low, next float after up)
+        up = np.nextafter(range_df['mc_up'].to_numpy(dtype=np.float64), np.inf)
+        num_ranges = len(low)
+        # Smallest signed integer type that holds all range ids and -1 for unranged ions
+        self.dtype = np.promote_types(np.int8, np.min_scalar_type(-num_ranges))
+
+        # Pairs of overlapping ranges
+        overlaps = np.triu((low[:, None] < up[None, :]) & (low[None, :] < up[:, None]), k=1)
+        self.overlapping = [(int(i), int(j)) for i, j in zip(*np.nonzero(overlaps))]
+        if overlap == 'error' and self.overlapping:
+            raise ValueError('The ranges overlap: %s' % self.overlapping)
+
+        self.bounds = np.unique(np.concatenate([low, up]))
+        starts = self.bounds[:-1]
+        # covers[r, k] is True if range r contains the elementary interval k
+        covers = (low[:, None] <= starts[None, :]) & (up[:, None] > starts[None, :])
+        if overlap == 'narrowest':
+            order = np.argsort(up - low, kind='stable')
+        else:
+            order = np.arange(num_ranges)
+        covered = covers.any(axis=0) if num_ranges > 0 else np.zeros(len(starts), dtype=bool)
+        owner = order[covers[order].argmax(axis=0)] if num_ranges > 0 else np.zeros(len(starts), dtype=int)
+        self.owner = np.where(covered, owner, -1).astype(self.dtype)
+
+    def label(self, mc):
+        """
+        Range id of each ion.
+
+        Parameters:
+            mc (np.ndarray): Mass-to-charge ratios of the ions (any chunk of the dataset).
+
+        Returns:
+            np.ndarray: Row position in range_df of the range of each ion, -1 for ions outside all ranges.
+        """
+        mc = np.asarray(mc)
+        interval = np.searchsorted(self.bounds, mc, side='right') - 1
+        inside = (interval >= 0) & (interval < len(self.owner))
+        range_id = np.full(len(mc), -1, dtype=self.dtype)
+        range_id[inside] = self.owner[interval[inside]]
+        return range_id
+
+    def attach(self, data_df, range_id, columns=('name', 'ion')):
+        """
+        Add range columns to the ions.
+
+        Parameters:
+            data_df (pd.DataFrame): The ions, modified in place.
+            range_id (np.ndarray): Range ids from label.
+            columns (list): Columns of range_df to add.
+
+        Returns:
+            pd.DataFrame: data_df with the range columns added.
+        """
+        for col in columns:
+            values = self.range_df[col].to_numpy()
+            default = DEFAULT_VALUES.get(col, np.nan)
+            if values.dtype.kind in 'OUS' or isinstance(default, str):
+                values = values.astype(object)
+                default = np.array([default], dtype=object)
+            # range_id -1 picks the last element, the value of the ions outside all ranges
+            lookup = np.concatenate([values, np.asarray(default).reshape(1)])
+            data_df[col] = lookup[range_id]
+        return data_df
+
+
+def label_by_range(data_df, range_df, columns=None, overlap='first', chunk_size=None):
+    """
+    Label the ions by the mass-to-charge range they fall in.
+
+    Parameters:
+        data_df (pd.DataFrame): The dataframe containing the data with the 'mc (Da)' column.
+        range_df (pd.DataFrame): The dataframe containing the range values 'mc_low' and 'mc_up'.
+        columns (list): Optional. Columns of range_df (e.g. ['name', 'ion', 'element']) to add to a copy of
+                        data_df. By default only the range ids are returned.
+        overlap (str): Owner of overlapping ranges, see RangeLabeler.
+        chunk_size (int): Optional. Number of ions labeled at once.
+
+    Returns:
+        np.ndarray or pd.DataFrame: The range id of each ion (-1 outside all ranges) if no columns are
+        requested, otherwise a copy of data_df with the requested columns.
+    """
+    labeler = RangeLabeler(range_df, overlap=overlap)
+    mc = data_df['mc (Da)'].to_numpy()
+    if chunk_size is None:
+        range_id = labeler.label(mc)
+    else:
+        range_id = np.empty(len(mc), dtype=labeler.dtype)
+        for start in range(0, len(mc), chunk_size):
+            range_id[start:start + chunk_size] = labeler.label(mc[start:start + chunk_size])
+    if columns is None:
+        return range_id
+    return labeler.attach(data_df.copy(), range_id, columns)
+
 
 def merge_by_range(data_df, range_df, full=False):
     """
     Optimized merging function based on the 'mc' column value falling within the 'mc_low' and 'mc_up' range.
-    Uses vectorized operations for performance.
+    The ions are labeled with a RangeLabeler; an ion in several ranges gets the first of them.
 
     Parameters:
         data_df (pd.DataFrame): The dataframe containing the data to be merged.
@@ -14,43 +150,4 @@ def merge_by_range(data_df, range_df, full=False):
     Returns:
         pd.DataFrame: The merged dataframe with the range data attached.
     """
-    # Prepare the necessary columns for merging
-    data_mc = data_df['mc (Da)']
-
-    # Use broadcasting to create masks for matching conditions
-    mask = (range_df['mc_low'].values[:, None] <= data_mc.values) & (
-                range_df['mc_up'].values[:, None] >= data_mc.values)
-
-    # Find the matching range index for each data row (max mask index per row)
-    matched_idx = mask.argmax(axis=0)  # For each data point, find the index of the matching range in range_df
-
-    # Check if a valid match exists (mask is not empty for the given row)
-    valid_matches = mask[matched_idx, np.arange(len(data_mc))]
-
-    # Create merged dataframe
-    merged_df = data_df.copy()
-
-    # Default values for no matches
-    default_values = {
-        'name': np.nan,
-        'ion': np.nan,
-        'mass': np.nan,
-        'mc': np.nan,
-        'mc_low': np.nan,
-        'mc_up': np.nan,
-        'color': 'black',
-        'element': ['noise'],
-        'complex': [np.nan],
-        'isotope': [np.nan],
-        'charge': np.nan
-    }
-    if full:
-        # For valid matches, update with the corresponding values
-        for col in ['name', 'ion', 'mass', 'mc', 'mc_low', 'mc_up', 'color', 'element', 'complex', 'isotope', 'charge']:
-            merged_df[col] = np.where(valid_matches, range_df[col].values[matched_idx], default_values[col])
-    else:
-        # only add the columns name and ion
-        for col in ['name', 'ion']:
-            merged_df[col] = np.where(valid_matches, range_df[col].values[matched_idx], default_values[col])
-
-    return merged_df
\ No newline at end of file
+    return label_by_range(data_df, range_df, columns=RANGE_COLUMNS if full else ['name', 'ion'])
@@ -1,5 +1,24 @@
+import numpy as np
+from numba import njit
 from tqdm import tqdm
 
+# Per start-counter group: offset and number of its signals in the signal array, the group class
+# (number of signals, GROUP_MULTI_HIT for more than four), and the number of valid 0-1-2-3 quartets
+GROUP_DTYPE = np.dtype([('offset', np.int64), ('length', np.int64), ('start_counter', np.uint64),
+                        ('high_voltage', np.float64), ('pulse', np.float64), ('group_class', np.uint8),
+                        ('valid_events', np.int64)])
+# Per signal, in group order: position in the raw arrays, channel, time and whether the signal belongs to
+# a valid 0-1-2-3 channel quartet
+SIGNAL_DTYPE = np.dtype([('index', np.int64), ('channel', np.uint32), ('time_data', np.uint64),
+                         ('valid', np.bool_)])
+GROUP_MULTI_HIT = 5
+GROUP_CLASS_NAMES = {1: '1 channel', 2: '2 channel', 3: '3 channel', 4: '4 channel', GROUP_MULTI_HIT: 'multi hit'}
+
+# Surface Concept DLD factors: 27.432 ps per TDC bin, the tof is the mean of the four channel times; the
+# detector position is the time difference of the two ends of a delay line (80 mm over 4900 bins)
+TOF_FACTOR = 27.432 / (1000 * 4)  # ns per bin of the four channel time sum
+XY_FACTOR = 80 / 4900 * 0.1  # cm per bin of the channel time difference
+
 
 def find_consecutive_sequences_seperatly(start_counter, channel, time_data, high_voltage, pulse):
     """"
@@ -473,42 +492,325 @@ def find_consecutive_sequences(start_counter, channel, time_data, high_voltage,
     return result
 
 
-def find_nth_max_repeated_indices(nums, n):
+@njit(cache=True)
+def _quartet_order(channel, offsets, lengths):
+    """
+    Quartet order and validity of the signals of the given groups, see assemble_quartets.
     """
-    Find the start and end indices of the longest repeated sequence in the list.
+    total = 0
+    max_length = 0
+    for g in range(len(lengths)):
+        total += lengths[g]
+        max_length = max(max_length, lengths[g])
+    order = np.empty(total, dtype=np.int64)
+    valid = np.zeros(total, dtype=np.bool_)
+    positions = np.empty(max_length, dtype=np.int64)
+    counts = np.empty(5, dtype=np.int64)
+    starts = np.empty(5, dtype=np.int64)
+    out = 0
+    for g in range(len(offsets)):
+        offset = offsets[g]
+        length = lengths[g]
+        # Counting sort of the group by channel; channels above 3 go last
+        counts[:] = 0
+        for i in range(offset, offset + length):
+            c = channel[i] if channel[i] < 4 else 4
+            counts[c] += 1
+        starts[0] = 0
+        for c in range(1, 5):
+            starts[c] = starts[c - 1] + counts[c - 1]
+        fill = starts.copy()
+        for i in range(offset, offset + length):
+            c = channel[i] if channel[i] < 4 else 4
+            positions[fill[c]] = i
+            fill[c] += 1
+
+        # The n-th signal of every channel goes to the n-th quartet
+        group_start = out
+        rank = 0
+        while out - group_start < length - counts[4]:
+            for c in range(4):
+                if rank < counts[c]:
+                    order[out] = positions[starts[c] + rank]
+                    out += 1
+            rank += 1
+        for j in range(counts[4]):
+            order[out] = positions[starts[4] + j]
+            out += 1
+
+        for q in range(group_start, group_start + length - 3, 4):
+            if (channel[order[q]] == 0 and channel[order[q + 1]] == 1 and channel[order[q + 2]] == 2 and
+                    channel[order[q + 3]] == 3):
+                valid[q:q + 4] = True
+    return order, valid
+
+
+def assemble_quartets(channel, offsets, lengths):
+    """
+    Assemble the signals of multi hit groups into 0-1-2-3 channel quartets.
+
+    The n-th signal of each channel (in the original order) goes to the n-th quartet of its group, channels
+    without an n-th signal are skipped, as in find_consecutive_sequences. A quartet is valid if its
+    channels are exactly 0, 1, 2, 3; an incomplete last quartet is invalid. Signals on channels above 3
+    are put at the end of their group. The kernel runs in linear time and only reads the given groups, so
+    any slice of groups (e.g. a chunk in a worker process) can be assembled on its own.
 
     Args:
-        nums:
-        n:
-    Returns:
+        channel: array of channel values
+        offsets: array of the position of the first signal of each group in channel
+        lengths: array of the number of signals of each group
+    Return:
+        order: positions in channel of the signals of the groups, group by group in quartet order
+        valid: whether each signal of order belongs to a valid quartet
+        valid_events: number of valid quartets of each group
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    order, valid = _quartet_order(np.asarray(channel), offsets, lengths)
+    group_id = np.repeat(np.arange(len(lengths)), lengths)
+    valid_events = np.bincount(group_id, weights=valid, minlength=len(lengths)).astype(np.int64) // 4
+    return order, valid, valid_events
+
 
+def group_signals(start_counter, channel, time_data, high_voltage=None, pulse=None):
     """
-    while True:
-        max_count = 0
-        max_number = None
-        start_index = None
-        end_index = None
-
-        current_count = 0
-        current_number = None
-
-        for i, num in enumerate(nums):
-            if num != -1:
-                if num != current_number:
-                    current_number = num
-                    current_count = 1
-                else:
-                    current_count += 1
+    Columnar version of find_consecutive_sequences.
+
+    The groups of consecutive signals with the same start counter are found with np.diff. Groups of up to
+    four signals are ordered by channel with np.lexsort, longer groups are assembled into 0-1-2-3
+    quartets with assemble_quartets, the order of find_consecutive_sequences. A quartet is valid if its
+    channels are exactly 0, 1, 2, 3; a four signal group is valid only in that case as well.
+
+    Args:
+        start_counter: array of start counter values
+        channel: array of channel values
+        time_data: array of time data values
+        high_voltage: array of high voltage values (optional)
+        pulse: array of pulse values (optional)
+    Return:
+        groups: structured array of GROUP_DTYPE, one entry per group; high voltage and pulse are the
+                values of the first signal of the group
+        signals: structured array of SIGNAL_DTYPE, the signals in group order; the signals of group g are
+                 signals[groups['offset'][g]:groups['offset'][g] + groups['length'][g]]
+    """
+    start_counter = np.asarray(start_counter)
+    channel = np.asarray(channel)
+    num_signals = len(start_counter)
+    if num_signals == 0:
+        return np.empty(0, dtype=GROUP_DTYPE), np.empty(0, dtype=SIGNAL_DTYPE)
+
+    offsets = np.concatenate(([0], np.flatnonzero(np.diff(start_counter) != 0) + 1))
+    lengths = np.diff(np.append(offsets, num_signals))
+    group_id = np.repeat(np.arange(len(offsets)), lengths)
+
+    # Groups by channel (lexsort is stable), a four signal group is valid if its channels are 0, 1, 2, 3
+    order = np.lexsort((channel, group_id))
+    position_in_group = np.arange(num_signals) - offsets[group_id]
+    expected = np.bincount(group_id, weights=channel[order] == position_in_group, minlength=len(offsets))
+    valid = np.repeat((lengths == 4) & (expected == 4), lengths)
+
+    # Groups of more than four signals are assembled into quartets
+    long_group = lengths > 4
+    if np.any(long_group):
+        long_signals = np.repeat(long_group, lengths)
+        order[long_signals], valid[long_signals], _ = assemble_quartets(channel, offsets[long_group],
+                                                                        lengths[long_group])
+    channel_ordered = channel[order]
+
+    groups = np.empty(len(offsets), dtype=GROUP_DTYPE)
+    groups['offset'] = offsets
+    groups['length'] = lengths
+    groups['start_counter'] = start_counter[offsets]
+    groups['high_voltage'] = np.asarray(high_voltage)[offsets] if high_voltage is not None else np.nan
+    groups['pulse'] = np.asarray(pulse)[offsets] if pulse is not None else np.nan
+    groups['group_class'] = np.minimum(lengths, GROUP_MULTI_HIT)
+    groups['valid_events'] = np.bincount(group_id, weights=valid, minlength=len(offsets)).astype(np.int64) // 4
+
+    signals = np.empty(num_signals, dtype=SIGNAL_DTYPE)
+    signals['index'] = order
+    signals['channel'] = channel_ordered
+    signals['time_data'] = np.asarray(time_data)[order]
+    signals['valid'] = valid
+    return groups, signals
+
+
+def reconstruct_events(groups, signals, tof_factor=TOF_FACTOR, xy_factor=XY_FACTOR):
+    """
+    Reconstruct the detector events of the valid 0-1-2-3 quartets.
+
+    Args:
+        groups: structured array of GROUP_DTYPE from group_signals
+        signals: structured array of SIGNAL_DTYPE from group_signals
+        tof_factor: ns per bin of the time sum of the four channels
+        xy_factor: cm per bin of the time difference of channels 1 and 0 (x) and 3 and 2 (y)
+    Return:
+        events: dictionary of arrays 'x', 'y' (cm), 't' (ns), 'high_voltage', 'pulse' and 'start_counter',
+                one entry per valid quartet
+    """
+    # A valid quartet starts with its channel 0 signal
+    first = np.flatnonzero(signals['valid'] & (signals['channel'] == 0))
+    time = signals['time_data'].astype(np.int64)
+    group = np.searchsorted(groups['offset'], first, side='right') - 1
+    return {
+        'x': (time[first + 1] - time[first]) * xy_factor,
+        'y': (time[first + 3] - time[first + 2]) * xy_factor,
+        't': (time[first] + time[first + 1] + time[first + 2] + time[first + 3]) * tof_factor,
+        'high_voltage': groups['high_voltage'][group],
+        'pulse': groups['pulse'][group],
+        'start_counter': groups['start_counter'][group],
+    }
+
+
+def group_statistics(groups, print_stats=False):
+    """
+    Count the groups and their signals per group class.
+
+    Args:
+        groups: structured array of GROUP_DTYPE from group_signals
+        print_stats: bool, print the statistics of the groups
+    Return:
+        stats: dictionary with the number of groups and signals per group class and the number of valid
+               four channel groups and valid multi hit events
+    """
+    num_classes = GROUP_MULTI_HIT + 1
+    group_class = groups['group_class']
+    num_groups = np.bincount(group_class, minlength=num_classes)
+    num_signals = np.bincount(group_class, weights=groups['length'], minlength=num_classes).astype(np.int64)
+    total_signals = int(num_signals.sum())
+    four = group_class == 4
+    multi_hit = group_class == GROUP_MULTI_HIT
+    stats = {
+        'groups': {name: int(num_groups[c]) for c, name in GROUP_CLASS_NAMES.items()},
+        'signals': {name: int(num_signals[c]) for c, name in GROUP_CLASS_NAMES.items()},
+        'valid_4_channel': int(np.count_nonzero(groups['valid_events'][four])),
+        'valid_multi_hit_events': int(groups['valid_events'][multi_hit].sum()),
+        'total_signals': total_signals,
+    }
+
+    if print_stats:
+        for c, name in GROUP_CLASS_NAMES.items():
+            percent = num_signals[c] / total_signals * 100 if total_signals else 0
+            print(f"Length of {name}: {num_groups[c]} groups, {num_signals[c]} signals, {percent} %")
+        print(f"Valid 4 channel groups: {stats['valid_4_channel']}")
+        print(f"Valid events in multi hit groups: {stats['valid_multi_hit_events']}")
+        print(f"Total length: {total_signals}")
 
-                if current_count > max_count:
-                    max_count = current_count
-                    max_number = current_number
-                    start_index = i - current_count + 1
-                    end_index = i
-        n = n - 1
-        if n < 0:
-            break
-        nums[start_index:end_index + 1] = [-1] * max_count
+    return stats
 
-    return start_index, end_index, max_count, max_number
 
+def run_lengths(values):
+    """
+    Run-length encode an array.
+
+    Args:
+        values: 1D array
+    Return:
+        starts: index of the first element of each run
+        lengths: number of elements of each run
+        run_values: value of each run
+    """
+    values = np.asarray(values)
+    if len(values) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), values[:0]
+    starts = np.concatenate(([0], np.flatnonzero(values[1:] != values[:-1]) + 1))
+    lengths = np.diff(np.append(starts, len(values)))
+    return starts, lengths, values[starts]
+
+
+def _top_runs(starts, lengths, run_values, k):
+    """
+    The k longest runs, longest first; runs of equal length by start.
+    """
+    if len(lengths) > k > 0:
+        # Length of the k-th longest run; of the runs that long only the first ones are kept
+        kth = lengths[np.argpartition(lengths, len(lengths) - k)[len(lengths) - k]]
+        longer = np.flatnonzero(lengths > kth)
+        equal = np.flatnonzero(lengths == kth)[:k - len(longer)]
+        selected = np.concatenate((longer, equal))
+    else:
+        selected = np.arange(len(lengths) if k > 0 else 0)
+    selected = selected[np.lexsort((starts[selected], -lengths[selected]))]
+    return starts[selected], lengths[selected], run_values[selected]
+
+
+def top_repeated_runs(values, k):
+    """
+    Find the k longest runs of repeated values, e.g. the longest start counter bursts.
+
+    Args:
+        values: 1D array
+        k: number of runs to return
+    Return:
+        starts: start index of each run, longest run first (runs of equal length by start index)
+        ends: end index (inclusive) of each run
+        lengths: number of elements of each run
+        run_values: value of each run
+    """
+    starts, lengths, run_values = _top_runs(*run_lengths(values), k)
+    return starts, starts + lengths - 1, lengths, run_values
+
+
+def top_repeated_runs_chunked(chunks, k):
+    """
+    Streaming version of top_repeated_runs for an array given in consecutive chunks.
+
+    Only the k best runs so far and the run open at the end of the current chunk are kept between chunks,
+    so the chunks can come from a file that does not fit in memory. A run that continues across chunk
+    boundaries is counted as one run.
+
+    Args:
+        chunks: iterable of consecutive 1D arrays
+        k: number of runs to return
+    Return:
+        starts, ends, lengths, run_values: as in top_repeated_runs, with indices into the whole array
+    """
+    best = None
+    open_run = None
+    offset = 0
+    for chunk in chunks:
+        starts, lengths, run_values = run_lengths(chunk)
+        if len(starts) == 0:
+            continue
+        starts = starts + offset
+        offset += len(chunk)
+        if open_run is not None:
+            if run_values[0] == open_run[2][0]:
+                # The open run continues in this chunk
+                starts[0] = open_run[0][0]
+                lengths[0] += open_run[1][0]
+            else:
+                starts = np.concatenate((open_run[0], starts))
+                lengths = np.concatenate((open_run[1], lengths))
+                run_values = np.concatenate((open_run[2], run_values))
+        # The last run may continue in the next chunk
+        open_run = (starts[-1:], lengths[-1:], run_values[-1:])
+        closed = (starts[:-1], lengths[:-1], run_values[:-1])
+        if best is not None:
+            closed = tuple(np.concatenate(pair) for pair in zip(best, closed))
+        best = _top_runs(*closed, k)
+
+    if open_run is None:
+        return top_repeated_runs(np.empty(0), k)
+    if best is not None:
+        open_run = tuple(np.concatenate(pair) for pair in zip(best, open_run))
+    starts, lengths, run_values = _top_runs(*open_run, k)
+    return starts, starts + lengths - 1, lengths, run_values
+
+
+def find_nth_max_repeated_indices(nums, n):
+    """
+    Find the start and end indices of the n-th longest repeated sequence in the list (n = 0 for the longest).
+
+    Args:
+        nums: list or array of values
+        n: rank of the sequence, 0 for the longest
+    Returns:
+        start_index: index of the first element of the sequence (None if there are not n + 1 sequences)
+        end_index: index of the last element of the sequence
+        max_count: length of the sequence
+        max_number: repeated value
+    """
+    starts, ends, lengths, run_values = top_repeated_runs(np.asarray(nums), n + 1)
+    if len(starts) <= n:
+        return None, None, 0, None
+    return int(starts[n]), int(ends[n]), int(lengths[n]), run_values[n]
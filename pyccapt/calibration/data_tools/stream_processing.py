@@ -0,0 +1,122 @@
+import time
+
+import numpy as np
+
+# Local module and scripts
+from pyccapt.calibration.data_tools import data_tools, hdf5_dataset, validity_filter
+from pyccapt.calibration.mc import mc_tools
+from pyccapt.calibration.reconstructions import reconstruction
+
+# Unit scale of the detector radius used for the detector area in the reconstruction methods
+DET_AREA_SCALE = {'Gault': 1E-2, 'Bas': 1E-3}
+
+
+def _max_detector_radius(dataset, max_tof, chunk_size):
+    """
+    First pass over the valid ions to find the largest detector hit radius (cm).
+    """
+    max_radius = 0.0
+    columns = ['t (ns)', 'high_voltage (V)', 'x_det (cm)', 'y_det (cm)']
+    for _, chunk in dataset.iter_chunks(columns, chunk_size=chunk_size):
+        chunk, _ = validity_filter.filter_valid(chunk, validity_filter.default_rules(max_tof))
+        if len(chunk) > 0:
+            radius = np.hypot(chunk['x_det (cm)'].to_numpy(), chunk['y_det (cm)'].to_numpy())
+            max_radius = max(max_radius, float(np.max(radius)))
+    return max_radius
+
+
+def raw_to_processed_streaming(raw_path, processed_path, max_tof, flight_path_length, t0=0, pulse_mode='voltage',
+                               calibration=None, reconstruction_params=None, chunk_size=5_000_000,
+                               compression='lzf', verbose=True):
+    """
+    Convert a raw pyccapt dataset into a processed dataset chunk by chunk.
+
+    The dld group of the raw file is read in chunks of chunk_size ions. Each chunk goes through the
+    validity filter, the tof to mc conversion, the optional calibration and the optional reconstruction
+    and is then appended to the processed file (columnar layout of hdf5_dataset). Only one chunk is in
+    memory at a time. The reconstructed depth is accumulated across chunk boundaries, so the result
+    is the same as reconstructing the whole dataset at once.
+
+    Args:
+        raw_path (str): Path to the raw pyccapt HDF5 file.
+        processed_path (str): Path of the processed HDF5 file to write.
+        max_tof (float): Maximum allowable TOF value.
+        flight_path_length (float): Flight path length in mm.
+        t0 (float): Time of flight offset in ns.
+        pulse_mode (str): 'voltage' or 'laser'.
+        calibration (callable): Optional. Called with each processed chunk (a DataFrame with mc_uc (Da)
+                                filled in); returns the calibrated (mc, t_c) arrays of the chunk, e.g. a
+                                calibration_model.CalibrationModel.
+        reconstruction_params (dict): Optional. Reconstruction parameters: 'mode' ('Gault' or 'Bas'), 'kf',
+                                      'det_eff', 'icf', 'field_evap' and 'avg_dens'.
+        chunk_size (int): Number of raw ions per chunk.
+        compression (str): Compression of the processed file (see hdf5_dataset.ProcessedHDF5Writer).
+        verbose (bool): Print the progress.
+
+    Returns:
+        dict: Number of ions read, removed (in total and by each validity rule) and written, and the
+              processing time in seconds.
+    """
+    start_time = time.time()
+    num_read = 0
+    rules = validity_filter.default_rules(max_tof)
+    removed_by_rule = {name: 0 for name, _ in rules}
+    with hdf5_dataset.LazyHDF5Dataset(raw_path, hdf5_dataset.DLD_COLUMNS) as dataset:
+        length = len(dataset)
+        det_area = None
+        if reconstruction_params is not None:
+            max_radius = _max_detector_radius(dataset, max_tof, chunk_size)
+            det_area = ((max_radius * DET_AREA_SCALE[reconstruction_params['mode']]) ** 2) * np.pi
+        z_offset = 0.0
+
+        with hdf5_dataset.ProcessedHDF5Writer(processed_path, chunk_size=min(chunk_size, 1_000_000),
+                                              compression=compression) as writer:
+            for _, chunk in dataset.iter_chunks(chunk_size=chunk_size):
+                num_read += len(chunk)
+                chunk, counts = validity_filter.filter_valid(chunk, rules)
+                for name, count in counts.items():
+                    removed_by_rule[name] += count
+                data = data_tools.pyccapt_raw_to_processed(chunk)
+
+                t = data['t (ns)'].to_numpy()
+                high_voltage = data['high_voltage (V)'].to_numpy()
+                pulse = data['pulse'].to_numpy()
+                x_det = data['x_det (cm)'].to_numpy()
+                y_det = data['y_det (cm)'].to_numpy()
+                data['mc_uc (Da)'] = mc_tools.tof2mc(t, t0, high_voltage, x_det, y_det, flight_path_length, pulse,
+                                                     mode=pulse_mode, dtype=np.float32)
+                if calibration is not None:
+                    mc, t_c = calibration(data)
+                    data['mc (Da)'] = mc
+                    data['t_c (ns)'] = t_c
+
+                if reconstruction_params is not None and len(data) > 0:
+                    params = dict(hv=high_voltage, flight_path_length=flight_path_length,
+                                  kf=reconstruction_params['kf'], det_eff=reconstruction_params['det_eff'],
+                                  icf=reconstruction_params['icf'], field_evap=reconstruction_params['field_evap'],
+                                  avg_dens=reconstruction_params['avg_dens'])
+                    if reconstruction_params['mode'] == 'Gault':
+                        px, py, pz = reconstruction.atom_probe_recons_from_detector_Gault_et_al(
+                            x_det, y_det, det_area=det_area, z_offset=z_offset, **params)
+                    elif reconstruction_params['mode'] == 'Bas':
+                        px, py, pz = reconstruction.atom_probe_recons_Bas_et_al(
+                            x_det, y_det, det_area=det_area, z_offset=z_offset, **params)
+                    z_offset += float(np.sum(reconstruction.z_increment(det_area=det_area, **params)))
+                    data['x (nm)'] = px
+                    data['y (nm)'] = py
+                    data['z (nm)'] = pz
+
+                writer.append(data)
+                if verbose:
+                    elapsed = time.time() - start_time
+                    print('Processed %s of %s ions (%.1f%%), %.2e ions/s' %
+                          (num_read, length, 100 * num_read / max(length, 1), num_read / max(elapsed, 1e-9)))
+
+    num_removed = sum(removed_by_rule.values())
+    summary = {'ions_read': num_read, 'ions_removed': num_removed, 'ions_written': num_read - num_removed,
+               'removed_by_rule': removed_by_rule, 'time (s)': time.time() - start_time}
+    if verbose:
+        for name, count in removed_by_rule.items():
+            print('The number of data removed by the rule %s:' % name, count)
+        print('The number of data that is removed:', num_removed)
+    return summary
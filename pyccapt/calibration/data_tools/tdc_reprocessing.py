@@ -0,0 +1,187 @@
+"""
+Re-derive the detector events of a raw pyccapt file from the raw Surface Concept TDC signals.
+
+The tdc/channel, tdc/time_data and tdc/start_counter datasets are split into chunks that end on a start
+counter change, so no group of signals is split. The chunks are decoded (raw_data_surface_concept) by a pool
+of worker processes that each read only their own chunk, and the reconstructed events are written in chunk
+order into the dld_reprocessed group. At most two chunks per worker are in flight, so the decoded events
+waiting to be written stay bounded however large the file is.
+"""
+import collections
+import concurrent.futures
+import multiprocessing
+import os
+import time
+
+import h5py
+import numpy as np
+
+# Local module and scripts
+from pyccapt.calibration.data_tools import hdf5_dataset, raw_data_surface_concept
+
+# Reprocessed column -> storage dtype, as in the dld group of the raw file
+EVENT_DTYPES = {
+    'x': np.float64,
+    'y': np.float64,
+    't': np.float64,
+    'high_voltage': np.float64,
+    'pulse': np.float64,
+    'start_counter': np.uint64,
+}
+
+
+def chunk_boundaries(start_counter, chunk_size, window=4096):
+    """
+    Split the raw signals into chunks that end on a start counter change.
+
+    Only a small window of start_counter around each nominal boundary is read, so start_counter can be an
+    h5py dataset that does not fit in memory.
+
+    Args:
+        start_counter: array or h5py dataset of the start counter of each raw signal
+        chunk_size: nominal number of signals per chunk
+        window: number of start counter values read at a time when searching a boundary
+    Return:
+        boundaries: list of (start, stop) signal ranges
+    """
+    length = len(start_counter)
+    boundaries = []
+    start = 0
+    while start < length:
+        stop = start + chunk_size
+        if stop >= length:
+            boundaries.append((start, length))
+            break
+        # Move the boundary forward to the first signal of the next group
+        previous = start_counter[stop - 1]
+        while stop < length:
+            values = np.asarray(start_counter[stop:min(stop + window, length)]).reshape(-1)
+            change = np.flatnonzero(values != previous)
+            if len(change) > 0:
+                stop += int(change[0])
+                break
+            stop += len(values)
+        boundaries.append((start, stop))
+        start = stop
+    return boundaries
+
+
+def reprocess_chunk(raw_path, ion_range, tof_factor=raw_data_surface_concept.TOF_FACTOR,
+                    xy_factor=raw_data_surface_concept.XY_FACTOR):
+    """
+    Decode one chunk of raw TDC signals into detector events.
+
+    Args:
+        raw_path: path of the raw pyccapt HDF5 file
+        ion_range: (start, stop) range of the raw signals, aligned to start counter groups
+        tof_factor: ns per bin of the time sum of the four channels
+        xy_factor: cm per bin of the time difference of the two ends of a delay line
+    Return:
+        events: dictionary of event arrays (see raw_data_surface_concept.reconstruct_events)
+        class_counts: number of groups of each group class (index = class)
+    """
+    with hdf5_dataset.LazyHDF5Dataset(raw_path, hdf5_dataset.TDC_SC_COLUMNS) as dataset:
+        start_counter = dataset.column('start_counter', ion_range)
+        channel = dataset.column('channel', ion_range)
+        time_data = dataset.column('time_data', ion_range)
+        high_voltage = dataset.column('high_voltage (V)', ion_range) if 'high_voltage (V)' in dataset else None
+        pulse = dataset.column('pulse', ion_range) if 'pulse' in dataset else None
+    groups, signals = raw_data_surface_concept.group_signals(start_counter, channel, time_data, high_voltage,
+                                                              pulse)
+    events = raw_data_surface_concept.reconstruct_events(groups, signals, tof_factor, xy_factor)
+    class_counts = np.bincount(groups['group_class'], minlength=raw_data_surface_concept.GROUP_MULTI_HIT + 1)
+    return events, class_counts
+
+
+def _append(group, events):
+    """
+    Append events to the resizable datasets of the output group.
+    """
+    for name, dtype in EVENT_DTYPES.items():
+        values = np.asarray(events[name], dtype=dtype)
+        dataset = group[name]
+        size = dataset.shape[0]
+        dataset.resize(size + len(values), axis=0)
+        dataset[size:] = values
+
+
+def reprocess_tdc(raw_path, output_path=None, group_name='dld_reprocessed', chunk_size=10_000_000, workers=None,
+                  tof_factor=raw_data_surface_concept.TOF_FACTOR, xy_factor=raw_data_surface_concept.XY_FACTOR,
+                  verbose=True):
+    """
+    Reconstruct the events of the raw TDC signals of a pyccapt file in parallel.
+
+    Args:
+        raw_path: path of the raw pyccapt HDF5 file
+        output_path: optional path of the HDF5 file to write the events to. Defaults to raw_path; the events
+                     are then written to a temporary file while the workers read raw_path and copied into
+                     raw_path at the end.
+        group_name: name of the output group, replaced if it exists
+        chunk_size: nominal number of raw signals per chunk
+        workers: optional number of worker processes. Defaults to the number of CPUs.
+        tof_factor: ns per bin of the time sum of the four channels
+        xy_factor: cm per bin of the time difference of the two ends of a delay line
+        verbose: print the progress and the group class distribution
+    Return:
+        summary: number of signals, groups per class, events, the processing time and events/s
+    """
+    start_time = time.time()
+    with hdf5_dataset.LazyHDF5Dataset(raw_path, hdf5_dataset.TDC_SC_COLUMNS) as dataset:
+        start_counter = dataset.file[dataset.resolve('start_counter')]
+        num_signals = len(start_counter)
+        boundaries = chunk_boundaries(start_counter, chunk_size)
+
+    in_place = output_path is None or os.path.abspath(output_path) == os.path.abspath(raw_path)
+    write_path = raw_path + '.%s.part' % group_name if in_place else output_path
+    class_counts = np.zeros(raw_data_surface_concept.GROUP_MULTI_HIT + 1, dtype=np.int64)
+    num_events = 0
+    with h5py.File(write_path, 'w' if in_place else 'a') as output_file:
+        if group_name in output_file:
+            del output_file[group_name]
+        group = output_file.create_group(group_name)
+        for name, dtype in EVENT_DTYPES.items():
+            group.create_dataset(name, shape=(0,), maxshape=(None,), dtype=dtype,
+                                 chunks=(min(chunk_size, 1_000_000),))
+        workers = workers if workers is not None else os.cpu_count() or 1
+        # Spawned workers do not inherit the thread pools (numba, BLAS) or locks of the parent process
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                    mp_context=multiprocessing.get_context('spawn')) as executor:
+            chunks = iter(boundaries)
+            pending = collections.deque()
+            for i in range(len(boundaries)):
+                # Keep up to two chunks per worker submitted and write the results in chunk order
+                for ion_range in chunks:
+                    pending.append(executor.submit(reprocess_chunk, raw_path, ion_range, tof_factor, xy_factor))
+                    if len(pending) >= 2 * workers:
+                        break
+                events, counts = pending.popleft().result()
+                _append(group, events)
+                class_counts += counts
+                num_events += len(events['t'])
+                if verbose:
+                    elapsed = max(time.time() - start_time, 1e-9)
+                    print('[%s/%s] %s events | %.2e events/s' % (i + 1, len(boundaries), num_events,
+                                                                 num_events / elapsed))
+
+    if in_place:
+        with h5py.File(write_path, 'r') as source, h5py.File(raw_path, 'a') as target:
+            if group_name in target:
+                del target[group_name]
+            source.copy(source[group_name], target, name=group_name)
+        os.remove(write_path)
+
+    elapsed = time.time() - start_time
+    summary = {
+        'signals': num_signals,
+        'groups': {name: int(class_counts[c]) for c, name in raw_data_surface_concept.GROUP_CLASS_NAMES.items()},
+        'events': num_events,
+        'time': elapsed,
+        'events_per_second': num_events / max(elapsed, 1e-9),
+    }
+    if verbose:
+        total_groups = max(int(class_counts.sum()), 1)
+        for name, count in summary['groups'].items():
+            print('%s groups: %s (%.2f %%)' % (name, count, count / total_groups * 100))
+        print('Reprocessed %s signals into %s events in %.1f s (%.2e events/s)' %
+              (num_signals, num_events, elapsed, summary['events_per_second']))
+    return summary
@@ -0,0 +1,177 @@
+"""
+Validity filter of the raw detector data.
+
+A rule is a (name, function) tuple. The function is called as function(columns, start, stop), where
+columns maps the column names to 1D arrays, and returns a boolean array that is True for the invalid
+ions in rows start:stop. A rule may look outside start:stop (e.g. at the neighbouring ions), so rules
+that need context across block boundaries are possible.
+
+All rules are evaluated block by block in a single pass over the columns, so the intermediate masks
+stay small, and every removed ion is accounted to the first rule that flags it.
+"""
+import numpy as np
+import pandas as pd
+
+
+def tof_max_rule(max_tof):
+    """
+    Rule that removes the ions with a time of flight above max_tof.
+    """
+    def function(columns, start, stop):
+        return columns['t (ns)'][start:stop] > max_tof
+    return 'tof > max_tof', function
+
+
+def tof_min_rule(min_tof=50):
+    """
+    Rule that removes the ions with a time of flight below min_tof (ns).
+    """
+    def function(columns, start, stop):
+        return columns['t (ns)'][start:stop] < min_tof
+    return 'tof < min_tof', function
+
+
+def negative_voltage_rule():
+    """
+    Rule that removes the ions with a negative DC voltage.
+    """
+    def function(columns, start, stop):
+        return columns['high_voltage (V)'][start:stop] < 0
+    return 'negative voltage', function
+
+
+def detector_origin_rule():
+    """
+    Rule that removes the hits exactly at the detector origin, which are not real detector events.
+    """
+    def function(columns, start, stop):
+        return (columns['x_det (cm)'][start:stop] == 0) & (columns['y_det (cm)'][start:stop] == 0)
+    return 'detector origin', function
+
+
+def detector_edge_rule(max_radius):
+    """
+    Rule that removes the hits outside a radius of max_radius (cm) around the detector center.
+    """
+    def function(columns, start, stop):
+        x_det = columns['x_det (cm)'][start:stop]
+        y_det = columns['y_det (cm)'][start:stop]
+        return x_det * x_det + y_det * y_det > max_radius ** 2
+    return 'detector edge', function
+
+
+def voltage_glitch_rule(max_jump):
+    """
+    Rule that removes the ions whose DC voltage differs by more than max_jump (V) from both the previous
+    and the next ion, i.e. single-ion spikes of the voltage record.
+    """
+    def function(columns, start, stop):
+        high_voltage = columns['high_voltage (V)']
+        n = stop - start
+        # Extend the block by one ion on both sides for the neighbours
+        lo = max(start - 1, 0)
+        hi = min(stop + 1, len(high_voltage))
+        # jumps[k] is True if the voltage jumps between the ions lo + k and lo + k + 1
+        jumps = np.abs(np.diff(high_voltage[lo:hi].astype(np.float64))) > max_jump
+        prev_jump = np.zeros(n, dtype=bool)
+        next_jump = np.zeros(n, dtype=bool)
+        first = 1 if start == 0 else 0
+        prev_jump[first:] = jumps[start + first - 1 - lo:stop - 1 - lo]
+        last = n - 1 if stop == len(high_voltage) else n
+        next_jump[:last] = jumps[start - lo:start - lo + last]
+        return prev_jump & next_jump
+    return 'voltage glitch', function
+
+
+def default_rules(max_tof, min_tof=50):
+    """
+    Rules of data_tools.remove_invalid_data.
+
+    Args:
+        max_tof (float): Maximum allowable TOF value.
+        min_tof (float): Minimum allowable TOF value.
+
+    Returns:
+        list: Validity rules.
+    """
+    return [tof_max_rule(max_tof), tof_min_rule(min_tof), negative_voltage_rule(), detector_origin_rule()]
+
+
+def _column_arrays(data):
+    """
+    Map column names to 1D arrays without copying.
+    """
+    if isinstance(data, pd.DataFrame):
+        return {column: data[column].to_numpy() for column in data.columns}
+    return data
+
+
+def evaluate_rules(data, rules, block_size=1_000_000):
+    """
+    Evaluate all rules in one pass over the data.
+
+    Args:
+        data (pandas.DataFrame or dict): Data to check; a dict maps column names to 1D arrays.
+        rules (list): Validity rules, e.g. from default_rules.
+        block_size (int): Number of ions evaluated at once.
+
+    Returns:
+        tuple: (keep, counts) where keep is a boolean array that is True for the valid ions and counts maps
+               each rule name to the number of ions it removed.
+    """
+    columns = _column_arrays(data)
+    length = len(next(iter(columns.values()))) if columns else 0
+    keep = np.empty(length, dtype=bool)
+    counts = {name: 0 for name, _ in rules}
+    for start in range(0, length, block_size):
+        stop = min(start + block_size, length)
+        invalid = np.zeros(stop - start, dtype=bool)
+        for name, function in rules:
+            mask = function(columns, start, stop)
+            counts[name] += int(np.count_nonzero(mask & ~invalid))
+            invalid |= mask
+        np.logical_not(invalid, out=keep[start:stop])
+    return keep, counts
+
+
+def filter_valid(data, rules, block_size=1_000_000):
+    """
+    Remove the invalid ions.
+
+    Each column is compacted with a single copy into a new DataFrame; the input is not modified.
+
+    Args:
+        data (pandas.DataFrame or dict): Data to filter; a dict maps column names to 1D arrays.
+        rules (list): Validity rules, e.g. from default_rules.
+        block_size (int): Number of ions evaluated at once.
+
+    Returns:
+        tuple: (data, counts) with the valid ions (a DataFrame with a new index, or the input itself if
+               nothing is removed) and the number of ions removed by each rule.
+    """
+    keep, counts = evaluate_rules(data, rules, block_size=block_size)
+    if sum(counts.values()) == 0:
+        return data, counts
+    columns = _column_arrays(data)
+    data_valid = pd.DataFrame({column: values[keep] for column, values in columns.items()}, copy=False)
+    return data_valid, counts
+
+
+def drop_invalid(data, rules, block_size=1_000_000):
+    """
+    Remove the invalid ions from a DataFrame in place.
+
+    Args:
+        data (pandas.DataFrame): DataFrame with a default (0..n-1) index.
+        rules (list): Validity rules, e.g. from default_rules.
+        block_size (int): Number of ions evaluated at once.
+
+    Returns:
+        dict: Number of ions removed by each rule.
+    """
+    keep, counts = evaluate_rules(data, rules, block_size=block_size)
+    if sum(counts.values()) > 0:
+        data.drop(np.flatnonzero(~keep), inplace=True)
+        # Setting the index does not copy the columns again, unlike reset_index
+        data.index = pd.RangeIndex(len(data))
+    return counts
@@ -1,14 +1,97 @@
-import struct
-from itertools import chain
+import io
+import os
 
 import numpy as np
-import pandas as pd
 
 # Local module and scripts
+from pyccapt.calibration.data_tools import data_schema
 from pyccapt.calibration.leap_tools import leap_tools
 
 
-def ccapt_to_pos(data, path=None, name=None):
+# Column order of the pyccapt DataFrame
+CCAPT_COLUMNS = data_schema.CCAPT_COLUMNS
+
+# pyccapt column -> (pos field, scale)
+POS_TO_CCAPT = {
+    'x (nm)': ('x (nm)', 1),
+    'y (nm)': ('y (nm)', 1),
+    'z (nm)': ('z (nm)', 1),
+    'mc (Da)': ('m/n (Da)', 1),
+}
+
+# pyccapt column -> (epos field, scale)
+EPOS_TO_CCAPT = {
+    'x (nm)': ('x (nm)', 1),
+    'y (nm)': ('y (nm)', 1),
+    'z (nm)': ('z (nm)', 1),
+    'mc (Da)': ('m/n (Da)', 1),
+    'high_voltage (V)': ('HV_DC (V)', 1),
+    'pulse': ('pulse (V)', 1),
+    't (ns)': ('TOF (ns)', 1),
+    'x_det (cm)': ('det_x (mm)', 0.1),
+    'y_det (cm)': ('det_y (mm)', 0.1),
+    'delta_p': ('pslep', 1),
+    'multi': ('ipp', 1),
+}
+
+# pyccapt column -> (apt column, scale)
+APT_TO_CCAPT = {
+    'x (nm)': ('x', 1),
+    'y (nm)': ('y', 1),
+    'z (nm)': ('z', 1),
+    'mc (Da)': ('Mass', 1),
+    'high_voltage (V)': ('Voltage', 1),
+    'pulse': ('Vap', 1),
+    't (ns)': ('Epos ToF', 1),
+    'x_det (cm)': ('det_x', 0.1),
+    'y_det (cm)': ('det_y', 0.1),
+    'delta_p': ('Delta Pulse', 1),
+    'multi': ('Multiplicity', 1),
+}
+
+
+def write_ccapt_records(data, file, dtype, mapping, chunk_size=1_000_000):
+    """
+    Write CCAPT data as fixed-size big-endian records in chunks.
+
+    Only one chunk of records is held in memory at a time, so memory use does not grow with the
+    size of the dataset.
+
+    Args:
+        data (pandas.DataFrame): CCAPT data.
+        file: Path of the file to write or a writable binary file-like object.
+        dtype (numpy.dtype): Structured dtype of one record, e.g. leap_tools.EPOS_DTYPE.
+        mapping (dict): Maps PyCCAPT column names to (field name, scale) of the records.
+        chunk_size (int): Number of ions written per chunk.
+
+    Returns:
+        None
+
+    """
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, 'wb') as f:
+            write_ccapt_records(data, f, dtype, mapping, chunk_size=chunk_size)
+        return
+
+    field_to_column = {field: (column, scale) for column, (field, scale) in mapping.items()}
+    columns = []
+    for field in dtype.names:
+        column, scale = field_to_column[field]
+        columns.append((field, data[column].to_numpy(), scale))
+
+    chunk = np.empty(min(chunk_size, len(data)), dtype=dtype)
+    for start in range(0, len(data), chunk_size):
+        stop = min(start + chunk_size, len(data))
+        records = chunk[:stop - start]
+        for field, values, scale in columns:
+            if scale != 1:
+                records[field] = values[start:stop] / scale
+            else:
+                records[field] = values[start:stop]
+        file.write(records.tobytes())
+
+
+def ccapt_to_pos(data, path=None, name=None, chunk_size=1_000_000):
     """
     Convert CCAPT data to POS format.
 
@@ -16,24 +99,21 @@ def ccapt_to_pos(data, path=None, name=None):
         data (pandas.DataFrame): CCAPT data.
         path (str): Optional. Path to save the POS file.
         name (str): Optional. Name of the POS file.
+        chunk_size (int): Number of ions written per chunk.
 
     Returns:
-        bytes: POS data.
+        bytes: POS data if no file name is given, otherwise None (the data is streamed to the file).
 
     """
-    dd = data[['x (nm)', 'y (nm)', 'z (nm)', 'mc (Da)']]
-    dd = dd.astype(np.single)
-    records = dd.to_records(index=False)
-    list_records = list(records)
-    d = tuple(chain(*list_records))
-    pos = struct.pack('>' + 'ffff' * len(dd), *d)
     if name is not None:
-        with open(path + name, 'w+b') as f:
-            f.write(pos)
-    return pos
+        write_ccapt_records(data, path + name, leap_tools.POS_DTYPE, POS_TO_CCAPT, chunk_size=chunk_size)
+        return None
+    pos = io.BytesIO()
+    write_ccapt_records(data, pos, leap_tools.POS_DTYPE, POS_TO_CCAPT, chunk_size=chunk_size)
+    return pos.getvalue()
 
 
-def ccapt_to_epos(data, path=None, name=None):
+def ccapt_to_epos(data, path=None, name=None, chunk_size=1_000_000):
     """
     Convert CCAPT data to EPOS format.
 
@@ -41,130 +121,114 @@ def ccapt_to_epos(data, path=None, name=None):
         data (pandas.DataFrame): CCAPT data.
         path (str): Optional. Path to save the EPOS file.
         name (str): Optional. Name of the EPOS file.
+        chunk_size (int): Number of ions written per chunk.
 
     Returns:
-        bytes: EPOS data.
+        bytes: EPOS data if no file name is given, otherwise None (the data is streamed to the file).
 
     """
-    dd = data[
-        ['x (nm)', 'y (nm)', 'z (nm)', 'mc (Da)', 't (ns)', 'high_voltage (V)', 'pulse', 'x_det (cm)',
-         'y_det (cm)', 'delta_p', 'multi']]
-
-    dd = dd.astype(np.single)
-    dd = dd.astype({'delta_p': np.uintc})
-    dd = dd.astype({'multi': np.uintc})
-
-    records = dd.to_records(index=False)
-    list_records = list(records)
-    d = tuple(chain(*list_records))
-    epos = struct.pack('>' + 'fffffffffII' * len(dd), *d)
     if name is not None:
-        with open(path + name, 'w+b') as f:
-            f.write(epos)
+        write_ccapt_records(data, path + name, leap_tools.EPOS_DTYPE, EPOS_TO_CCAPT, chunk_size=chunk_size)
+        return None
+    epos = io.BytesIO()
+    write_ccapt_records(data, epos, leap_tools.EPOS_DTYPE, EPOS_TO_CCAPT, chunk_size=chunk_size)
+    return epos.getvalue()
 
-    return epos
 
+def records_to_ccapt(records, mapping, columns=None, ion_range=None):
+    """
+    Build a PyCCAPT DataFrame from a (memory-mapped) structured array.
+
+    Only the requested ion range of the requested columns is read from the file.
 
-def pos_to_ccapt(file_path):
+    Args:
+        records (numpy.ndarray): Structured array, e.g. from leap_tools.memmap_epos.
+        mapping (dict): Maps PyCCAPT column names to (field name, scale) of the records.
+        columns (list): Optional. PyCCAPT columns to build. Defaults to all columns.
+        ion_range (tuple): Optional. (start, stop) ion indices to load.
+
+    Returns:
+        pandas.DataFrame: CCAPT data.
+
+    """
+    if ion_range is not None:
+        records = records[slice(*ion_range)]
+
+    data_dict = {}
+    for column in columns if columns is not None else CCAPT_COLUMNS:
+        if column in mapping:
+            field, scale = mapping[column]
+            values = np.asarray(records[field], dtype=records.dtype[field].newbyteorder('='))
+            if scale != 1:
+                values = values * np.float32(scale)
+            data_dict[column] = values
+
+    # Columns that are not stored in the file are added as placeholders
+    return data_schema.ccapt_dataframe(data_dict, length=len(records), columns=columns)
+
+
+def pos_to_ccapt(file_path, columns=None, ion_range=None):
     """
     Convert POS data to CCAPT format.
 
     Args:
         file_path: POS data file_path.
+        columns (list): Optional. PyCCAPT columns to build. Defaults to all columns.
+        ion_range (tuple): Optional. (start, stop) ion indices to load.
 
     Returns:
         pandas.DataFrame: CCAPT data.
 
     """
-    pos = leap_tools.read_pos(file_path)
-    length = len(pos['m/n (Da)'].to_numpy())
-    ccapt = pd.DataFrame({'x (nm)': pos['x (nm)'].to_numpy(),
-                          'y (nm)': pos['y (nm)'].to_numpy(),
-                          'z (nm)': pos['z (nm)'].to_numpy(),
-                          'mc (Da)': pos['m/n (Da)'].to_numpy(),
-                          'mc_uc (Da)': np.zeros(length),
-                          'high_voltage (V)': np.zeros(length),
-                          'pulse': np.zeros(length),
-                          't (ns)': np.zeros(length),
-                          't_c (ns)': np.zeros(length),
-                          'x_det (cm)': np.zeros(length),
-                          'y_det (cm)': np.zeros(length),
-                          'delta_p': np.zeros(length, dtype=int),
-                          'multi': np.zeros(length, dtype=int),
-                          'start_counter': np.zeros(length, dtype=int),
-                          })
-    return ccapt
-
-
-def epos_to_ccapt(file_path):
+    pos = leap_tools.memmap_pos(file_path)
+    return records_to_ccapt(pos, POS_TO_CCAPT, columns=columns, ion_range=ion_range)
+
+
+def epos_to_ccapt(file_path, columns=None, ion_range=None):
     """
     Convert EPOS data to PyCCAPT format.
 
     Args:
         file_path: EPOS data file path.
+        columns (list): Optional. PyCCAPT columns to build. Defaults to all columns.
+        ion_range (tuple): Optional. (start, stop) ion indices to load.
 
     Returns:
         pandas.DataFrame: CCAPT data.
 
     """
-    epos = leap_tools.read_epos(file_path)
-    length = len(epos['m/n (Da)'].to_numpy())
-    ccapt = pd.DataFrame({'x (nm)': epos['x (nm)'].to_numpy(),
-                          'y (nm)': epos['y (nm)'].to_numpy(),
-                          'z (nm)': epos['z (nm)'].to_numpy(),
-                          'mc (Da)': epos['m/n (Da)'].to_numpy(),
-                          'mc_uc (Da)': np.zeros(length),
-                          'high_voltage (V)': epos['HV_DC (V)'].to_numpy(),
-                          'pulse': epos['pulse (V)'].to_numpy(),
-                          't (ns)': epos['TOF (ns)'].to_numpy(),
-                          't_c (ns)': np.zeros(length),
-                          'x_det (cm)': epos['det_x (mm)'].to_numpy() / 10,
-                          'y_det (cm)': epos['det_y (mm)'].to_numpy() / 10,
-                          'delta_p': epos['pslep'].to_numpy(),
-                          'multi': epos['ipp'].to_numpy(),
-                          'start_counter': np.zeros(length, dtype=int),
-                          })
-    return ccapt
-
-
-def apt_to_ccapt(file_path):
+    epos = leap_tools.memmap_epos(file_path)
+    return records_to_ccapt(epos, EPOS_TO_CCAPT, columns=columns, ion_range=ion_range)
+
+
+def apt_to_ccapt(file_path, columns=None, ion_range=None):
     """
     Convert APT data to PyCCAPT format.
 
+    Only the sections needed for the requested columns are memory-mapped and read.
+
     Args:
         file_path: APT data file path.
+        columns (list): Optional. PyCCAPT columns to build. Defaults to all columns.
+        ion_range (tuple): Optional. (start, stop) ion indices to load.
 
     Returns:
         pandas.DataFrame: CCAPT data.
     """
-
-    data = leap_tools.read_apt(file_path)
-
-    length_data = len(data["Mass"])
-
-    # Define the keys and corresponding column names
-    key_mappings = {
-        'x': 'x (nm)',
-        'y': 'y (nm)',
-        'z': 'z (nm)',
-        'Mass': 'mc (Da)',
-        'Voltage': 'high_voltage (V)',
-        'Vap': 'pulse',
-        'Epos ToF': 't (ns)',
-        'det_x': 'x_det (cm)',
-        'det_y': 'y_det (cm)',
-        'Delta Pulse': 'delta_p',
-        'Multiplicity': 'multi',
-    }
-
-    # Create a dictionary with zero-filled arrays for missing keys
-    data_dict = {column_name: data.get(key, np.zeros(length_data)) for key, column_name in key_mappings.items()}
-    data_dict['start_counter'] = np.zeros(length_data, dtype=int)
-
-    df = pd.DataFrame(data_dict)
-    df.insert(loc=4, column='mc_uc (Da)', value=np.zeros(length_data))
-    df.insert(loc=8, column='t_c (ns)', value=np.zeros(length_data))
-    df['x_det (cm)'] = df['x_det (cm)'] / 10
-    df['y_det (cm)'] = df['y_det (cm)'] / 10
-
-    return df
+    apt = leap_tools.AptFile(file_path)
+    if "Mass" not in apt.sections:
+        raise AttributeError("APT file must have include a mass section")
+    length = len(apt.read_section('Mass', ion_range))
+    available = apt.keys()
+
+    data_dict = {}
+    for column in columns if columns is not None else CCAPT_COLUMNS:
+        key, scale = APT_TO_CCAPT.get(column, (None, 1))
+        if key in available:
+            values = np.array(apt.read_column(key, ion_range))
+            if scale != 1:
+                values = values * values.dtype.type(scale)
+            data_dict[column] = values
+
+    # Columns that are not stored in the file are added as placeholders
+    return data_schema.ccapt_dataframe(data_dict, length=length, columns=columns)
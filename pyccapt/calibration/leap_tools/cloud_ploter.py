@@ -20,13 +20,13 @@ def pre_data(pos_file, rrng_file, input_type):
     """
     if input_type == 'pos':
         pos = leap_tools.read_pos(pos_file)
-        ions, rrngs = leap_tools.read_rrng(rrng_file)
+        rrngs = leap_tools.read_rrng(rrng_file)
         pos_comp = leap_tools.label_ions(pos, rrngs)
         elements = leap_tools.deconvolve(pos_comp)
 
     elif input_type == 'epos':
         epos = leap_tools.read_epos(pos_file)
-        ions, rrngs = leap_tools.read_rrng(rrng_file)
+        rrngs = leap_tools.read_rrng(rrng_file)
         epos_comp = leap_tools.label_ions(epos, rrngs)
         elements = leap_tools.deconvolve(epos_comp)
 
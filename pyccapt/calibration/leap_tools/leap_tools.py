@@ -1,8 +1,7 @@
+import os
 import re
-import struct
 import sys
 from enum import Enum
-from typing import Union, Tuple, Any
 from warnings import warn
 
 import matplotlib.colors as cols
@@ -10,6 +9,83 @@ import numpy as np
 import pandas as pd
 from vispy import app, scene
 
+# Local module and scripts
+from pyccapt.calibration.data_tools import merge_range
+
+
+# Big-endian record layouts of the LEAP .pos and .epos formats
+POS_DTYPE = np.dtype([('x (nm)', '>f4'), ('y (nm)', '>f4'), ('z (nm)', '>f4'), ('m/n (Da)', '>f4')])
+
+EPOS_DTYPE = np.dtype([('x (nm)', '>f4'), ('y (nm)', '>f4'), ('z (nm)', '>f4'), ('m/n (Da)', '>f4'),
+                       ('TOF (ns)', '>f4'), ('HV_DC (V)', '>f4'), ('pulse (V)', '>f4'), ('det_x (mm)', '>f4'),
+                       ('det_y (mm)', '>f4'), ('pslep', '>u4'), ('ipp', '>u4')])
+
+
+def memmap_records(file_path, dtype):
+    """
+    Memory-maps a binary file of fixed-size records without reading it.
+
+    Args:
+        file_path (str): Path to the binary file.
+        dtype (numpy.dtype): Structured dtype of one record.
+
+    Returns:
+        numpy.ndarray: Read-only structured array (np.memmap) with one entry per record. Any trailing
+        bytes that do not form a complete record are ignored.
+    """
+    file_size = os.path.getsize(file_path)
+    n = file_size // dtype.itemsize
+    if n == 0:
+        # np.memmap cannot map an empty region
+        return np.empty(0, dtype=dtype)
+    return np.memmap(file_path, dtype=dtype, mode='r', shape=(n,))
+
+
+def memmap_pos(file_path):
+    """
+    Memory-maps an APT .pos file.
+
+    The returned structured array does not hold the data in memory; each column (e.g. arr['m/n (Da)'])
+    is a view into the file and is only read when it is accessed.
+
+    Args:
+        file_path (str): Path to the .pos file.
+
+    Returns:
+        numpy.ndarray: Structured array with the fields of POS_DTYPE.
+    """
+    return memmap_records(file_path, POS_DTYPE)
+
+
+def memmap_epos(file_path):
+    """
+    Memory-maps an APT .epos file.
+
+    The returned structured array does not hold the data in memory; each column (e.g. arr['TOF (ns)'])
+    is a view into the file and is only read when it is accessed.
+
+    Args:
+        file_path (str): Path to the .epos file.
+
+    Returns:
+        numpy.ndarray: Structured array with the fields of EPOS_DTYPE.
+    """
+    return memmap_records(file_path, EPOS_DTYPE)
+
+
+def records_to_dataframe(records):
+    """
+    Converts a (memory-mapped) structured array into a DataFrame with native byte order columns.
+
+    Args:
+        records (numpy.ndarray): Structured array, e.g. from memmap_pos or memmap_epos.
+
+    Returns:
+        pandas.DataFrame: One column per field of the structured array.
+    """
+    return pd.DataFrame({name: records[name].astype(records.dtype[name].newbyteorder('='))
+                         for name in records.dtype.names})
+
 
 def read_pos(file_path):
     """
@@ -21,17 +97,7 @@ def read_pos(file_path):
         z: Reconstructed z position
         Da: Mass/charge ratio of ion
     """
-    with open(file_path, 'rb') as file:
-        data = file.read()
-        n = len(data) // 4
-        d = struct.unpack('>' + 'f' * n, data)
-    pos = pd.DataFrame({
-        'x (nm)': d[0::4],
-        'y (nm)': d[1::4],
-        'z (nm)': d[2::4],
-        'm/n (Da)': d[3::4]
-    })
-    return pos
+    return records_to_dataframe(memmap_pos(file_path))
 
 
 def read_epos(file_path):
@@ -51,26 +117,7 @@ def read_epos(file_path):
         pslep: Pulses since last event pulse (i.e. ionisation rate)
         ipp: Ions per pulse (multihits)
     """
-    with open(file_path, 'rb') as file:
-        data = file.read()
-
-    n = len(data) // 4
-    rs = n // 11
-    d = struct.unpack('>' + 'fffffffffII' * rs, data)
-    epos = pd.DataFrame({
-        'x (nm)': d[0::11],
-        'y (nm)': d[1::11],
-        'z (nm)': d[2::11],
-        'm/n (Da)': d[3::11],
-        'TOF (ns)': d[4::11],
-        'HV_DC (V)': d[5::11],
-        'pulse (V)': d[6::11],
-        'det_x (mm)': d[7::11],
-        'det_y (mm)': d[8::11],
-        'pslep': d[9::11],
-        'ipp': d[10::11]
-    })
-    return epos
+    return records_to_dataframe(memmap_epos(file_path))
 
 
 def read_rrng(file_path):
@@ -197,32 +244,101 @@ def write_rrng(file_path, ions, rrngs):
             f.write(range_line)
 
 
+def _range_labels(rrngs):
+    """
+    Composition ('Al:1 O:2') and colour ('#RRGGBB') of each range, for the IVAS layout ('lower', 'upper',
+    'comp', 'colour') and the pyccapt layout of read_rrng ('mc_low', 'mc_up', 'element', 'complex', 'color').
+    """
+    if 'comp' in rrngs:
+        lower, upper = rrngs['lower'], rrngs['upper']
+        comp = [str(c) for c in rrngs['comp']]
+        colour = [str(c) for c in rrngs['colour']]
+    else:
+        lower, upper = rrngs['mc_low'], rrngs['mc_up']
+        comp = [' '.join(f'{e}:{n}' for e, n in zip(elements, complexities) if e != 'unranged')
+                for elements, complexities in zip(rrngs['element'], rrngs['complex'])]
+        colour = [str(c) for c in rrngs['color']]
+    colour = [c if c.startswith('#') else '#' + c for c in colour]
+    return lower, upper, comp, colour
+
+
 def label_ions(pos, rrngs):
     """
-    Labels ions in a .pos or .epos DataFrame (anything with a 'Da' column) with composition and color,
-    based on an imported .rrng file.
+    Labels ions in a .pos or .epos DataFrame (anything with a 'Da' or 'm/n (Da)' column) with composition and
+    color, based on an imported .rrng file.
+
+    All ions are labeled in one pass with a binary search over the range bounds. The labels are stored as
+    categorical columns, i.e. as one small integer code per ion. Where ranges overlap, the last one wins.
 
     Parameters:
-    - pos (DataFrame): A DataFrame containing ion positions, with a 'Da' column.
+    - pos (DataFrame): A DataFrame containing ion positions, with a 'Da' or 'm/n (Da)' column.
     - rrngs (DataFrame): A DataFrame containing range data imported from a .rrng file.
 
     Returns:
-    - pos (DataFrame): The modified DataFrame with added 'comp' and 'colour' columns.
+    - pos (DataFrame): The modified DataFrame with added categorical 'comp' and 'colour' columns.
     """
+    lower, upper, comp, colour = _range_labels(rrngs)
+    mass = pos['Da'] if 'Da' in pos else pos['m/n (Da)']
 
-    # Initialize 'comp' and 'colour' columns in the DataFrame pos
-    pos['comp'] = ''
-    pos['colour'] = '#FFFFFF'
+    # Reversed so that the first matching range of the labeler is the last range of the file
+    ranges = pd.DataFrame({'mc_low': np.asarray(lower, dtype=np.float64)[::-1],
+                           'mc_up': np.asarray(upper, dtype=np.float64)[::-1]})
+    range_id = merge_range.RangeLabeler(ranges).label(mass.to_numpy())
+    range_id = np.where(range_id >= 0, len(ranges) - 1 - range_id, -1)
 
-    # Iterate over each row in the DataFrame rrngs
-    for n, r in rrngs.iterrows():
-        # Assign composition and color values to matching ion positions in pos DataFrame
-        pos.loc[(pos['Da'] >= r.lower) & (pos['Da'] <= r.upper), ['comp', 'colour']] = [r['comp'], '#' + r['colour']]
+    # Unlabeled ions get the last entry of the lookup tables
+    comp_categories, comp_codes = np.unique(comp + [''], return_inverse=True)
+    colour_categories, colour_codes = np.unique(colour + ['#FFFFFF'], return_inverse=True)
+    pos['comp'] = pd.Categorical.from_codes(comp_codes[range_id], categories=comp_categories)
+    pos['colour'] = pd.Categorical.from_codes(colour_codes[range_id], categories=colour_categories)
 
     # Return the modified pos DataFrame with labeled ions
     return pos
 
 
+def deconvolve_index(lpos):
+    """
+    Deconvolves the complex ions of a composition-labelled pos DataFrame as an index expansion.
+
+    An ion with the composition 'Al:1 O:2' becomes two rows, one per element; unlabeled ions have no rows.
+    Nothing is copied from lpos: the rows are described by the position of their ion in lpos and their
+    element and stoichiometry.
+
+    Parameters:
+    - lpos (DataFrame): A composition-labelled pos file DataFrame (see label_ions).
+
+    Returns:
+    - ion_index (ndarray): Row position in lpos of each deconvolved row.
+    - element (Categorical): Element name of each row.
+    - n (ndarray): Stoichiometry of each row.
+    """
+    comp = pd.Categorical(lpos['comp'])
+    pattern = re.compile(r'([A-Za-z]+):([0-9]+)')
+
+    # Parse each composition once
+    num_elements = np.zeros(len(comp.categories) + 1, dtype=np.int64)
+    elements = []
+    stoichiometry = []
+    for i, category in enumerate(comp.categories):
+        parts = pattern.findall(str(category))
+        num_elements[i] = len(parts)
+        elements.extend(e for e, _ in parts)
+        stoichiometry.extend(int(n) for _, n in parts)
+    first_element = np.cumsum(num_elements) - num_elements
+
+    # Missing compositions (code -1) pick the last entry, which has no elements
+    codes = comp.codes
+    repeats = num_elements[codes]
+    ion_index = np.repeat(np.arange(len(codes)), repeats)
+    first_row = np.cumsum(repeats) - repeats
+    element_index = np.repeat(first_element[codes] - first_row, repeats) + np.arange(len(ion_index))
+
+    element_names, element_codes = np.unique(np.asarray(elements, dtype=str), return_inverse=True)
+    element = pd.Categorical.from_codes(element_codes[element_index], categories=element_names)
+    n = np.asarray(stoichiometry, dtype=np.int64)[element_index]
+    return ion_index, element, n
+
+
 def deconvolve(lpos):
     """
     Takes a composition-labelled pos file and deconvolves the complex ions.
@@ -232,36 +348,34 @@ def deconvolve(lpos):
     For complex ions, the location of the different components is not altered - i.e. xyz position will be the same
     for several elements.
 
+    The rows are gathered in one step from the index expansion of deconvolve_index; the rows of each ion
+    follow each other.
+
     Parameters:
     - lpos (DataFrame): A composition-labelled pos file DataFrame.
 
     Returns:
     - out (DataFrame): A deconvolved DataFrame with additional 'element' and 'n' columns.
     """
+    ion_index, element, n = deconvolve_index(lpos)
+    out = lpos.take(ion_index)
+    out['element'] = element
+    out['n'] = n
+    return out
 
-    # Initialize an empty list to store the deconvolved data
-    out = []
 
-    # Define the regular expression pattern to extract element and stoichiometry information
-    pattern = re.compile(r'([A-Za-z]+):([0-9]+)')
-
-    # Group the input DataFrame 'lpos' based on the 'comp' column
-    for g, d in lpos.groupby('comp'):
-        if g != '':
-            # Iterate over the elements in the 'comp' column
-            for i in range(len(g.split(' '))):
-                # Create a copy of the grouped DataFrame 'd'
-                tmp = d.copy()
-                # Extract the element and stoichiometry values using the regular expression pattern
-                cn = pattern.search(g.split(' ')[i]).groups()
-                # Add 'element' and 'n' columns to the copy of DataFrame 'tmp'
-                tmp['element'] = cn[0]
-                tmp['n'] = cn[1]
-                # Append the modified DataFrame 'tmp' to the output list
-                out.append(tmp.copy())
-
-    # Concatenate the DataFrame in the output list to create the final deconvolved DataFrame
-    return pd.concat(out)
+def _legend_entries(pos):
+    """
+    Ion label and RGB color of each colour present in a labelled pos DataFrame (see label_ions).
+    """
+    ions = []
+    cs = []
+    # The labels are categorical with every range as a category, only the observed colours have ions
+    for g, d in pos.groupby('colour', observed=True):
+        # Remove ':' and whitespaces from the 'comp' column values
+        ions.append(re.sub(r':1?|\s?', '', d['comp'].iloc[0]))
+        cs.append(cols.hex2color(g))
+    return np.array(ions), np.asarray(cs)
 
 
 def volvis(pos, size=2, alpha=1):
@@ -306,18 +420,8 @@ def volvis(pos, size=2, alpha=1):
     # Add the markers to the viewer
     view.add(p1)
 
-    # Create arrays to store ion labels and corresponding colors
-    ions = []
-    cs = []
-
-    # Group the 'pos' DataFrame by color
-    for g, d in pos.groupby('colour'):
-        # Remove ':' and whitespaces from the 'comp' column values
-        ions.append(re.sub(r':1?|\s?', '', d['comp'].iloc[0]))
-        cs.append(cols.hex2color(g))
-
-    ions = np.array(ions)
-    cs = np.asarray(cs)
+    # Ion labels and colors of the legend
+    ions, cs = _legend_entries(pos)
 
     # Create positions and text for the legend
     pts = np.array([[20] * len(ions), np.linspace(20, 20 * len(ions), len(ions))]).T
@@ -412,207 +516,225 @@ class Dtype(Enum):
     filetime = 8
 
 
-def read_apt(filepath: str, verbose: bool = False):
-    """
-    Read apt file into a pandas DataFrame
+# Layout of the APT file header (AP Suite)
+APT_FILE_HEADER_DTYPE = np.dtype([('signature', 'S4'), ('header_size', '<i4'), ('header_version', '<i4'),
+                                  ('file_name', '<u2', (256,)), ('creation_time', '<u8'), ('ion_count', '<i8')])
 
-    Args:
-        filepath (str): Path to apt file
-        verbose (bool): Print the structure of the apt file as it is read (for debug purposes)
+# Layout of an APT section header (AP Suite)
+APT_SECTION_HEADER_DTYPE = np.dtype([('signature', 'S4'), ('header_size', '<i4'), ('header_version', '<i4'),
+                                     ('type', '<u2', (32,)), ('version', '<i4'), ('rel_type', '<i4'),
+                                     ('rec_type', '<i4'), ('rec_dtype', '<i4'), ('dtype_size', '<i4'),
+                                     ('rec_size', '<i4'), ('data_unit', '<u2', (16,)), ('rec_count', '<i8'),
+                                     ('byte_count', '<i8')])
 
-    Returns:
-        pandas.DataFrame: A DataFrame containing the apt file data
 
+def _decode_wchar(chars):
     """
+    Decode a fixed-size, null padded UTF-16 field of an APT header.
+    """
+    return chars.tobytes().decode('utf-16-le').replace('\x00', '')
 
-    def record_dtype2numpy_dtype(rec_dtype: RecordDataType, size: int):
-        """
-        Map a section's record data type to its equivalent numpy dtype
-        """
-        if rec_dtype in (RecordDataType.UINT, RecordDataType.CHARSTRING):
-            raise ValueError("Cannot map to UINT or CHARSTRING")
-
-        int_map = {8: np.int8, 16: np.int16, 32: np.int32, 64: np.int64}
-
-        float_map = {32: np.float32, 64: np.float64}
-
-        if rec_dtype == RecordDataType.INT:
-            return int_map[size]
-        elif rec_dtype == RecordDataType.FLOAT:
-            return float_map[size]
-        else:
-            raise ValueError(f"Unexpected record data type {rec_dtype}")
-
-    # Maps the apt format data type to str format needed for struct.unpack
-    dtype2fmt = {Dtype.int32: "i", Dtype.int64: "q", Dtype.char: "c", Dtype.filetime: "Q", Dtype.wchar_t: "c"}
 
-    # Maps the apt format data type to python data type
-    dtype2constr = {
-        Dtype.int32: int,
-        Dtype.int64: int,
-        Dtype.char: lambda x: x.decode("utf-8"),
-        Dtype.wchar_t: lambda x: x.decode("utf-16"),
-        Dtype.filetime: int,
-    }
+def _record_dtype2numpy_dtype(rec_dtype: RecordDataType, size: int):
+    """
+    Map a section's record data type to its equivalent (little-endian) numpy dtype
+    """
+    int_map = {8: '<i1', 16: '<i2', 32: '<i4', 64: '<i8'}
+    uint_map = {8: '<u1', 16: '<u2', 32: '<u4', 64: '<u8'}
+    float_map = {32: '<f4', 64: '<f8'}
+
+    if rec_dtype == RecordDataType.INT:
+        return np.dtype(int_map[size])
+    elif rec_dtype == RecordDataType.UINT:
+        return np.dtype(uint_map[size])
+    elif rec_dtype == RecordDataType.FLOAT:
+        return np.dtype(float_map[size])
+    else:
+        raise ValueError(f"Unexpected record data type {rec_dtype}")
 
-    with open(filepath, "rb") as dat:
 
-        def read_chunk(dtype: Dtype, count: int = 1, start: Union[None, int] = None) -> Union[Tuple[Any], Any]:
-            if isinstance(start, int):
-                dat.seek(start)
+class AptFile:
+    """
+    Index of an APT (AP Suite) file.
 
-            fmt = dtype2fmt[dtype] * count
-            constructor = dtype2constr[dtype]
-            dtype_size = dtype.value
+    The section table is scanned once when the object is created; the section data is only
+    memory-mapped when a section or column is requested, and only for the requested ion range.
 
-            if dtype in (Dtype.wchar_t, Dtype.char):
-                return constructor(dat.read(dtype_size * count)).replace("\x00", "")
-            else:
-                retn = struct.unpack("<" + fmt, dat.read(dtype_size * count))
+    Columns that are stored together are split by name: 'x', 'y', 'z' come from the Position
+    section and 'det_x', 'det_y' from XDet_mm/YDet_mm or, if those are missing, the Detector
+    Coordinates section. Any other column name is the name of a section.
+    """
 
-            if len(retn) == 1:
-                return constructor(retn[0])
-            else:
-                return tuple(constructor(i) for i in retn)
+    def __init__(self, filepath: str, verbose: bool = False):
+        """
+        Read the file header and the section table.
 
-        cSignature = read_chunk(Dtype.char, 4)
+        Args:
+            filepath (str): Path to apt file
+            verbose (bool): Print the structure of the apt file as it is read (for debug purposes)
+        """
+        self.filepath = filepath
+        self.sections = {}
 
-        # Read the APT file header --------------------------------------------------------------------------------
-        iHeaderSize = read_chunk(Dtype.int32)
-        iHeaderVersion = read_chunk(Dtype.int32)
-        wcFileName = read_chunk(Dtype.wchar_t, 256)
-        ftCreationTime = read_chunk(Dtype.filetime)
-        llIonCount = read_chunk(Dtype.int64)
+        file_size = os.path.getsize(filepath)
+        header = np.fromfile(filepath, dtype=APT_FILE_HEADER_DTYPE, count=1)[0]
+        self.ion_count = int(header['ion_count'])
 
         if verbose:
             print(f"\nReading header of {filepath}")
-            print(f"\tcSignature: " + cSignature)
-            print(f"\tiHeaderSize: {iHeaderSize}")
-            print(f"\tiHeaderVersion: {iHeaderVersion}")
-            print(f"\twcFileName: {wcFileName}")
-            print(f"\tftCreationTime: {ftCreationTime}")
-            print(f"\t11IonCount: {llIonCount}")
-
-        # Read the APT sections ----------------------------------------------------------------------------
-        section_start = iHeaderSize
-        section_data = {}
-
-        while True:
-            sec_sig = read_chunk(Dtype.char, 4, section_start)
-
-            if sec_sig == "":
-                # EOF reached
+            print(f"\tcSignature: " + header['signature'].decode('utf-8'))
+            print(f"\tiHeaderSize: {header['header_size']}")
+            print(f"\tiHeaderVersion: {header['header_version']}")
+            print(f"\twcFileName: {_decode_wchar(header['file_name'])}")
+            print(f"\tftCreationTime: {header['creation_time']}")
+            print(f"\t11IonCount: {self.ion_count}")
+
+        section_start = int(header['header_size'])
+        while section_start + APT_SECTION_HEADER_DTYPE.itemsize <= file_size:
+            sec = np.fromfile(filepath, dtype=APT_SECTION_HEADER_DTYPE, count=1, offset=section_start)[0]
+            if sec['signature'] == b'':
+                # Zero padding at the end of the file
                 break
+            sec_type = _decode_wchar(sec['type'])
+            sec_rel_type = RelType(int(sec['rel_type']))
+            sec_rec_type = RecordType(int(sec['rec_type']))
+            sec_rec_dtype = RecordDataType(int(sec['rec_dtype']))
+            sec_header_size = int(sec['header_size'])
 
-            # Flag used to not include a section in the Roi when a configuration
-            # situation is not implemented or handled
-            skip_sec = False
-
-            sec_header_size = read_chunk(Dtype.int32)
-            sec_header_ver = read_chunk(Dtype.int32)
-            sec_type = read_chunk(Dtype.wchar_t, 32)
-            sec_ver = read_chunk(Dtype.int32)
+            if verbose:
+                print("\nReading new section")
+                print(f"\tSection header sig: {sec['signature'].decode('utf-8')}")
+                print(f"\tSection header size: {sec_header_size}")
+                print(f"\tSection header version: {sec['header_version']}")
+                print(f"\tSection type: {sec_type}")
+                print(f"\tSection version: {sec['version']}")
+                print(f"\tSection relative type: {sec_rel_type}")
+                print(f"\tSection record type: {sec_rec_type}")
+                print(f"\tSection record data type: {sec_rec_dtype}")
+                print(f"\tSection data type size (bits): {sec['dtype_size']}")
+                print(f"\tSection record size: {sec['rec_size']}")
+                print(f"\tSection data type unit: {_decode_wchar(sec['data_unit'])}")
+                print(f"\tSection record count: {sec['rec_count']}")
+                print(f"\tSection byte count: {sec['byte_count']}")
 
-            sec_rel_type = RelType(read_chunk(Dtype.int32))
-            is_one_to_one = sec_rel_type == RelType.ONE_TO_ONE
-            if not is_one_to_one:
+            # Flag used to not include a section when a configuration situation is not implemented or handled
+            skip_sec = False
+            if sec_rel_type != RelType.ONE_TO_ONE:
                 warn(f'APAV does not handle REL_TYPE != ONE_TO_ONE, section "{sec_type}" will be ignored')
                 skip_sec = True
-
-            sec_rec_type = RecordType(read_chunk(Dtype.int32))
-            is_fixed_size = sec_rec_type == RecordType.FIXED_SIZE
-            if not is_fixed_size:
+            if sec_rec_type != RecordType.FIXED_SIZE:
                 warn(f'APAV does not handle RECORD_TYPE != FIXED_SIZE, section "{sec_type}" will be ignored')
                 skip_sec = True
-
-            sec_rec_dtype = RecordDataType(read_chunk(Dtype.int32))
             if sec_rec_dtype in (RecordDataType.DT_UNKNOWN, RecordDataType.OTHER, RecordDataType.CHARSTRING):
                 warn(f'APAV does not handle RECORD_TYPE == {sec_rec_dtype}, section "{sec_type}" will be ignored')
                 skip_sec = True
 
-            sec_dtype_size = read_chunk(Dtype.int32)
-            sec_rec_size = read_chunk(Dtype.int32)
-            sec_data_unit = read_chunk(Dtype.wchar_t, 16)
-            sec_rec_count = read_chunk(Dtype.int64)
-            sec_byte_count = read_chunk(Dtype.int64)
+            if not skip_sec:
+                dtype = _record_dtype2numpy_dtype(sec_rec_dtype, int(sec['dtype_size']))
+                self.sections[sec_type] = {'offset': section_start + sec_header_size,
+                                           'dtype': dtype,
+                                           'columns': int(sec['rec_size']) // dtype.itemsize,
+                                           'records': int(sec['rec_count']),
+                                           'unit': _decode_wchar(sec['data_unit'])}
 
-            if verbose:
-                print("\nReading new section")
-                print(f"\tSection header sig: {sec_sig}")
-                print(f"\tSection header size: {sec_header_size}")
-                print(f"\tSection header version: {sec_header_ver}")
-                print(f"\tSection type: {sec_type}")
-                print(f"\tSection version: {sec_ver}")
-                print(f"\tSection relative type: {sec_rel_type}")
-                print(f"\tSection record type: {sec_rec_type}")
-                print(f"\tSection record data type: {sec_rec_dtype}")
-                print(f"\tSection data type size (bits): {sec_dtype_size}")
-                print(f"\tSection record size: {sec_rec_size}")
-                print(f"\tSection data type unit: {sec_data_unit}")
-                print(f"\tSection record count: {sec_rec_count}")
-                print(f"\tSection byte count: {sec_byte_count}")
+            section_start = section_start + int(sec['byte_count']) + sec_header_size
 
-            if not skip_sec:
-                columns = int(sec_rec_size / (sec_dtype_size / 8))
-                records = int(sec_rec_count)
-                count = records * columns
-                in_data = np.fromfile(
-                    filepath,
-                    record_dtype2numpy_dtype(sec_rec_dtype, sec_dtype_size),
-                    count,
-                    offset=section_start + sec_header_size,
-                )
-                if columns > 1:
-                    section_data[sec_type] = in_data.reshape(records, columns)
-                else:
-                    section_data[sec_type] = in_data
-
-            section_start = section_start + sec_byte_count + sec_header_size
-
-    has_mass_data = "Mass" in section_data.keys()
-    has_pos_data = "Position" in section_data.keys()
-
-    # Map some APT section names to those that APAV expects, otherwise the provided name is retained
-    name_map = {
-        "Multiplicity": "ipp",
-        "Time of Flight": "tof",
-        "XDet_mm": "det_x",
-        "YDet_mm": "det_y",
-        "Voltage": "dc_voltage",
-        "Pulse Voltage": "pulse_voltage",
-    }
-
-    # Require mass and position data, clean up some sections, and account for possible duplicate sections (i.e.
-    # XDet_mm + YDet_mm combined with Detector Coordinates
-    if not has_mass_data:
+    def keys(self):
+        """
+        Return the names of all available columns (see the class documentation).
+        """
+        keys = []
+        for name, section in self.sections.items():
+            if name == 'Position':
+                keys.extend(['x', 'y', 'z'])
+            elif name == 'Detector Coordinates':
+                keys.extend(['det_x', 'det_y'])
+            elif name == 'XDet_mm':
+                keys.append('det_x')
+            elif name == 'YDet_mm':
+                keys.append('det_y')
+            else:
+                keys.append(name)
+        return list(dict.fromkeys(keys))
+
+    def read_section(self, name: str, ion_range=None):
+        """
+        Memory-map the data of one section.
+
+        Args:
+            name (str): Section name, e.g. 'Mass' or 'Position'
+            ion_range (tuple): Optional. (start, stop) ion indices to map.
+
+        Returns:
+            numpy.memmap: Read-only array of shape (records,) or (records, columns).
+        """
+        if name not in self.sections:
+            raise KeyError(f'Section "{name}" is not in {self.filepath}')
+        section = self.sections[name]
+        start, stop, _ = slice(*ion_range).indices(section['records']) if ion_range is not None \
+            else (0, section['records'], 1)
+        stop = max(start, stop)
+        shape = (stop - start, section['columns']) if section['columns'] > 1 else (stop - start,)
+        if stop == start:
+            return np.empty(shape, dtype=section['dtype'])
+        rec_size = section['columns'] * section['dtype'].itemsize
+        return np.memmap(self.filepath, dtype=section['dtype'], mode='r',
+                         offset=section['offset'] + start * rec_size, shape=shape)
+
+    def read_column(self, name: str, ion_range=None):
+        """
+        Memory-map one column (see the class documentation for the column names).
+
+        Args:
+            name (str): Column name
+            ion_range (tuple): Optional. (start, stop) ion indices to map.
+
+        Returns:
+            numpy.ndarray: 1D view of the column data.
+        """
+        if name in ('x', 'y', 'z') and name not in self.sections:
+            return self.read_section('Position', ion_range)[:, 'xyz'.index(name)]
+        if name in ('det_x', 'det_y') and name not in self.sections:
+            separate = 'XDet_mm' if name == 'det_x' else 'YDet_mm'
+            if separate in self.sections:
+                return self.read_section(separate, ion_range)
+            return self.read_section('Detector Coordinates', ion_range)[:, ('det_x', 'det_y').index(name)]
+        return self.read_section(name, ion_range)
+
+    def to_dataframe(self, columns=None, ion_range=None):
+        """
+        Load columns into a pandas DataFrame.
+
+        Args:
+            columns (list): Optional. Columns to load. Defaults to all columns.
+            ion_range (tuple): Optional. (start, stop) ion indices to load.
+
+        Returns:
+            pandas.DataFrame: A DataFrame containing the apt file data
+        """
+        if columns is None:
+            columns = self.keys()
+        return pd.DataFrame({name: np.array(self.read_column(name, ion_range)) for name in columns})
+
+
+def read_apt(filepath: str, verbose: bool = False):
+    """
+    Read apt file into a pandas DataFrame
+
+    Args:
+        filepath (str): Path to apt file
+        verbose (bool): Print the structure of the apt file as it is read (for debug purposes)
+
+    Returns:
+        pandas.DataFrame: A DataFrame containing the apt file data
+
+    """
+    apt = AptFile(filepath, verbose=verbose)
+
+    # Require mass and position data
+    if "Mass" not in apt.sections:
         raise AttributeError("APT file must have include a mass section")
-    elif not has_pos_data:
+    elif "Position" not in apt.sections:
         raise AttributeError("APT file must have include a position section")
 
-    # There are 2 difference ways that detector space coordinates can be included in an apt file, as a single
-    # section containing both x/y or the x and y in separate sections. Only when the separate x/y sections are not
-    # present we will load the combined x/y data (which we separate into different x and y arrays).
-    if "Detector Coordinates" in section_data.keys():
-        temp = section_data.pop("Detector Coordinates")
-        if "XDet_mm" not in section_data.keys():
-            section_data["det_x"] = temp[:, 0]
-        if "YDet_mm" not in section_data.keys():
-            section_data["det_y"] = temp[:, 1]
-
-    if "Position" in section_data.keys():
-        temp = section_data.pop("Position")
-        if "x" not in section_data.keys():
-            section_data["x"] = temp[:, 0]
-        if "y" not in section_data.keys():
-            section_data["y"] = temp[:, 1]
-        if "z" not in section_data.keys():
-            section_data["z"] = temp[:, 2]
-
-    if "Position" in section_data.keys():
-        pos = section_data.pop("Position")
-    if "Detector Coordinates" in section_data.keys():
-        detector_coordinates = section_data.pop("Detector Coordinates")
-
-    df = pd.DataFrame(section_data)
-
-    return df
+    return apt.to_dataframe()
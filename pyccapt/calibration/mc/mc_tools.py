@@ -1,4 +1,90 @@
 import numpy as np
+from numba import njit
+
+# Constants of the tof to mc conversion
+ELECTRON_CHARGE = 1.6E-19  # coulombs per electron
+AMU = 1.66E-27  # conversion from kg to Dalton
+# The value of α is slightly greater than one, accounting for the fact that the evaporation pulse is slightly
+# amplified due to reflections and impedance mismatches along the pulse transmission line.
+ALPHA = 1.015
+# The value of β is less than one, accounting for the fact that the ions field evaporate, on average, not at the
+# peak of the evaporation pulse, but during the ascending and descending edges of the incoming evaporation pulse.
+BETA = 0.7
+
+
+@njit(cache=True)
+def _tof2mc_kernel(t, t0, V, V_pulse, xDet, yDet, flightPathLength, alpha, beta, out):
+    """
+    m/c = 2eα(V + βV_pulse)(t/L)^2 of each ion in one pass, without temporaries.
+    """
+    path = (flightPathLength * 1E-3) ** 2  # flightPathLength from mm to m
+    for i in range(len(out)):
+        tof = (t[i] - t0) * 1E-9  # t0 correction, tof from ns to s
+        x = xDet[i] * 1E-2  # xDet from cm to m
+        y = yDet[i] * 1E-2  # yDet from cm to m
+        out[i] = 2 * alpha * (V[i] + beta * V_pulse[i]) * ELECTRON_CHARGE * tof * tof / (x * x + y * y + path) / AMU
+    return out
+
+
+def _as_float_array(values, shape):
+    """
+    One dimensional view of an argument broadcast to shape, copied only if it has to be.
+    """
+    values = np.asarray(values)
+    if not np.issubdtype(values.dtype, np.number):
+        raise TypeError('Data type of the passed argument is incorrect: %s' % values.dtype)
+    if not np.issubdtype(values.dtype, np.floating):
+        values = values.astype(np.float64)
+    if values.shape != shape:
+        values = np.broadcast_to(values, shape)
+    return values.reshape(-1)
+
+
+def tof2mc_fused(t, t0, V, xDet, yDet, flightPathLength, V_pulse=None, mode='laser', dtype=None, out=None):
+    """
+    Calculate m/c = 2eα(V + βV_pulse)(t/L)^2 with a fused numba kernel.
+
+    The kernel reads each input once and writes mc directly, so no full length temporaries are allocated.
+    float32 inputs are read as they are. tof2mc and tof2mcSimple use it.
+
+    Args:
+        t: Time (unit: ns)
+        t0: Initial time (unit: ns)
+        V: Voltage (unit: volts)
+        xDet: Distance along the x-axis (unit: cm)
+        yDet: Distance along the y-axis (unit: cm)
+        flightPathLength: Length of the flight path (unit: mm)
+        V_pulse: Voltage pulse (unit: volts). Only used in voltage mode.
+        mode: Type of mode ('voltage': α = ALPHA and β = BETA, or 'laser': α = 1 and β = 0)
+        dtype: dtype of the result, e.g. np.float32. Defaults to np.float64, or to the dtype of out.
+        out: Optional. Preallocated C-contiguous array for the result, with the broadcast shape of the inputs.
+
+    Returns:
+        mc: Mass-to-charge ratio (unit: Dalton), a scalar if all inputs are scalars
+    """
+    if mode == 'voltage':
+        alpha, beta = ALPHA, BETA
+    elif mode == 'laser':
+        alpha, beta = 1.0, 0.0
+    else:
+        raise ValueError('Unknown mode: %s' % mode)
+    shape = np.broadcast_shapes(np.shape(t), np.shape(V), np.shape(xDet), np.shape(yDet),
+                                np.shape(V_pulse) if V_pulse is not None else ())
+    V = _as_float_array(V, shape)
+    V_pulse = _as_float_array(V_pulse, shape) if beta != 0 else V
+    arrays = [_as_float_array(values, shape) for values in (t, xDet, yDet)]
+    if out is None:
+        out = np.empty(shape, dtype=np.float64 if dtype is None else dtype)
+    else:
+        if not isinstance(out, np.ndarray) or out.shape != shape:
+            raise ValueError('out must be an array of shape %s' % (shape,))
+        if dtype is not None and out.dtype != np.dtype(dtype):
+            raise ValueError('out has dtype %s, expected %s' % (out.dtype, np.dtype(dtype)))
+        if not np.issubdtype(out.dtype, np.floating) or not out.flags.c_contiguous or not out.flags.writeable:
+            raise ValueError('out must be a writeable, C-contiguous floating point array')
+    _tof2mc_kernel(arrays[0], float(t0), V, V_pulse, arrays[1], arrays[2], float(flightPathLength), alpha, beta,
+                   out.reshape(-1))
+    return out[()] if out.ndim == 0 else out
 
 
 def tof2mcSimple(t: int, t0: int, V: float, xDet: int, yDet: int, flightPathLength: int) -> float:
@@ -19,28 +105,14 @@ def tof2mcSimple(t: int, t0: int, V: float, xDet: int, yDet: int, flightPathLeng
     """
 
     try:
-        t = t - t0  # t0 correction
-        t = t * 1E-9  # tof from ns to s
-        xDet = xDet * 1E-2  # xDet from cm to m
-        yDet = yDet * 1E-2  # yDet from cm to m
-        flightPathLength = flightPathLength * 1E-3  # flightPathLength from mm to m
-
-        e = 1.6E-19  # coulombs per electron
-        amu = 1.66E-27  # conversion from kg to Dalton
-
-        flightPathLength = xDet ** 2 + yDet ** 2 + flightPathLength ** 2
-
-        mc = 2 * e * V * (t ** 2) / flightPathLength
-        mc = mc / amu  # conversion from kg/C to Da (6.022E23 g/mol, 1.6E-19C/ec)
-
-        return mc
+        return tof2mc_fused(t, t0, V, xDet, yDet, flightPathLength)
     except TypeError as error:
         print(error)
         return None
 
 
 def tof2mc(t: int, t0: int, V: float, xDet: int, yDet: int,
-           flightPathLength: int, V_pulse: float, mode: str = 'voltage') -> None:
+           flightPathLength: int, V_pulse: float, mode: str = 'voltage', dtype=None, out=None) -> None:
     """
     Calculate m/c based on idealized geometry and electrostatics using the formula:
     m/c = 2eα(V + βV_pulse)(t/L)^2
@@ -54,9 +126,14 @@ def tof2mc(t: int, t0: int, V: float, xDet: int, yDet: int,
         yDet: Distance along the y-axis (unit: mm)
         flightPathLength: Length of the flight path (unit: mm)
         mode: Type of mode ('voltage' or 'laser')
+        dtype: dtype of the result, e.g. np.float32. Defaults to np.float64, or to the dtype of out.
+        out: Optional. Preallocated C-contiguous array of the shape of t for the result.
 
     Returns:
         mc: Mass-to-charge ratio (unit: Dalton)
+
+    Raises:
+        ValueError: If the mode is unknown or out does not fit the result.
     """
     # check to see that the input are arrays
     assert isinstance(t, np.ndarray), "t must be a NumPy array"
@@ -66,40 +143,7 @@ def tof2mc(t: int, t0: int, V: float, xDet: int, yDet: int,
     assert isinstance(yDet, np.ndarray), "yDet must be a NumPy array"
 
     try:
-        # The value of α is greater than one, accounting for the fact that The value of a
-        # is slightly greater than one, accounting for the fact that the
-        # evaporation pulse is slightly amplified due to reflections and
-        # impedance mismatches along the pulse transmission line.
-        alpha = 1.015
-        # cThe value of b is less
-        # than one, accounting for the fact that the ions field evaporate,
-        # on average, not at the peak_x of the evaporation pulse, but
-        # during the ascending and descending edges of the incoming
-        # evaporation pulse.
-        beta = 0.7
-
-        t = t - t0  # t0 correction
-        t = t * 1E-9  # tof from ns to s
-        xDet = xDet * 1E-2  # xDet from cm to m
-        yDet = yDet * 1E-2  # yDet from cm to m
-        flightPathLength = flightPathLength * 1E-3  # flightPathLength from mm to m
-
-        e = 1.6E-19  # coulombs per electron
-        amu = 1.66E-27  # conversion from kg to Dalton
-
-        flightPathLength = np.sqrt(xDet ** 2 + yDet ** 2 + flightPathLength ** 2)
-
-        if mode == 'laser':
-            mc = 2 * V * e * (t / flightPathLength) ** 2
-        elif mode == 'voltage':
-            mc = 2 * alpha * (V + beta * V_pulse) * e * (t / flightPathLength) ** 2
-
-        mc = mc / amu  # conversion from kg/C to Da (6.022E23 g/mol, 1.6E-19C/ec)
-
-        return mc
+        return tof2mc_fused(t, t0, V, xDet, yDet, flightPathLength, V_pulse, mode=mode, dtype=dtype, out=out)
     except TypeError as error:
         print(error)
         return None
-    except UnboundLocalError as error:
-        print(error)
-        return None
@@ -50,7 +50,30 @@ def pol2cart(rho, phi):
     return x, y
 
 
-def atom_probe_recons_from_detector_Gault_et_al(detx, dety, hv, flight_path_length, kf, det_eff, icf, field_evap, avg_dens):
+def z_increment(hv, flight_path_length, kf, det_eff, icf, field_evap, avg_dens, det_area):
+    """
+    Calculate the depth increment of each ion (dz) of the point projection reconstruction.
+
+    Args:
+        hv (float): High voltage.
+        flight_path_length (float): Distance between detector and sample.
+        kf (float): Field reduction factor.
+        det_eff (float): Efficiency of the detector.
+        icf (float): Image compression factor due to sample imperfections.
+        field_evap (float): Evaporation field in V/nm.
+        avg_dens (float): Atomic density in atoms/nm^3.
+        det_area (float): Effective detector area in m^2.
+
+    Returns:
+        float: depth increment of each ion in m.
+    """
+    omega = 1E-9 ** 3 / avg_dens
+    return (omega * ((flight_path_length * 1E-3) ** 2) * (kf ** 2) * ((field_evap / 1E-9) ** 2)) / (
+            det_area * det_eff * (icf ** 2) * (hv ** 2))
+
+
+def atom_probe_recons_from_detector_Gault_et_al(detx, dety, hv, flight_path_length, kf, det_eff, icf, field_evap,
+                                                avg_dens, det_area=None, z_offset=0):
     """
     Perform atom probe reconstruction using Gault et al.'s method.
 
@@ -64,6 +87,10 @@ def atom_probe_recons_from_detector_Gault_et_al(detx, dety, hv, flight_path_leng
         icf (float): Image compression factor due to sample imperfections.
         field_evap (float): Evaporation field in V/nm.
         avg_dens (float): Atomic density in atoms/nm^3.
+        det_area (float): Optional. Effective detector area in m^2. Calculated from the largest hit radius of
+                          the given ions if None.
+        z_offset (float): Optional. Accumulated depth (m) of the ions evaporated before the given ones, used to
+                          reconstruct a dataset chunk by chunk.
 
     Returns:
         float: x-coordinates of reconstructed atom positions in nm.
@@ -74,7 +101,8 @@ def atom_probe_recons_from_detector_Gault_et_al(detx, dety, hv, flight_path_leng
     rad, ang = cart2pol(detx * 1E-2, dety * 1E-2)
 
     # Calculate effective detector area
-    det_area = (np.max(rad) ** 2) * np.pi
+    if det_area is None:
+        det_area = (np.max(rad) ** 2) * np.pi
 
     # Calculate radius evolution
     radius_evolution = hv / (kf * (field_evap / 1E-9))
@@ -93,22 +121,21 @@ def atom_probe_recons_from_detector_Gault_et_al(detx, dety, hv, flight_path_leng
     # the z shift with respect to the top of the cap is Rspec - zP
     # z_p = radius_evolution * (1 - np.cos(theta_a))
     z_p = radius_evolution - z_p
-    omega = 1E-9 ** 3 / avg_dens
 
     # icf_2 = theta_a / theta_p
     # dz = (omega * ((flight_path_length * 1E-3) ** 2) * (kf ** 2) * ((field_evap / 1E-9) ** 2)) / (
     #         det_area * det_eff * (icf_2 ** 2) * (hv ** 2))
 
-    dz = (omega * ((flight_path_length * 1E-3) ** 2) * (kf ** 2) * ((field_evap / 1E-9) ** 2)) / (
-            det_area * det_eff * (icf ** 2) * (hv ** 2))
+    dz = z_increment(hv, flight_path_length, kf, det_eff, icf, field_evap, avg_dens, det_area)
 
-    cum_z = np.cumsum(dz)
+    cum_z = np.cumsum(dz) + z_offset
     z = cum_z + z_p
 
     return x * 1E9, y * 1E9, z * 1E9
 
 
-def atom_probe_recons_Bas_et_al(detx, dety, hv, flight_path_length, kf, det_eff, icf, field_evap, avg_dens):
+def atom_probe_recons_Bas_et_al(detx, dety, hv, flight_path_length, kf, det_eff, icf, field_evap, avg_dens,
+                                det_area=None, z_offset=0):
     """
     Perform atom probe reconstruction using Bas et al.'s method.
 
@@ -122,6 +149,10 @@ def atom_probe_recons_Bas_et_al(detx, dety, hv, flight_path_length, kf, det_eff,
         icf (float): Image compression factor due to sample imperfections.
         field_evap (float): Evaporation field in V/nm.
         avg_dens (float): Atomic density in atoms/nm^3.
+        det_area (float): Optional. Effective detector area in m^2. Calculated from the largest hit radius of
+                          the given ions if None.
+        z_offset (float): Optional. Accumulated depth (m) of the ions evaporated before the given ones, used to
+                          reconstruct a dataset chunk by chunk.
 
     Returns:
         float: x-coordinates of reconstructed atom positions in nm.
@@ -134,14 +165,13 @@ def atom_probe_recons_Bas_et_al(detx, dety, hv, flight_path_length, kf, det_eff,
     x = (detx * 1E-2) / m
     y = (dety * 1E-2) / m
 
-    rad, ang = cart2pol(detx * 1E-3, dety * 1E-3)
-    det_area = (np.max(rad) ** 2) * np.pi
+    if det_area is None:
+        rad, ang = cart2pol(detx * 1E-3, dety * 1E-3)
+        det_area = (np.max(rad) ** 2) * np.pi
 
-    omega = 1E-9 ** 3 / avg_dens
-    dz = (omega * ((flight_path_length * 1E-3) ** 2) * (kf ** 2) * ((field_evap / 1E-9) ** 2)) / (
-            det_area * det_eff * (icf ** 2) * (hv ** 2))
+    dz = z_increment(hv, flight_path_length, kf, det_eff, icf, field_evap, avg_dens, det_area)
     dz_p = radius_evolution * (1 - np.sqrt(1 - ((x ** 2 + y ** 2) / (radius_evolution ** 2))))
-    z = np.cumsum(dz) + dz_p
+    z = np.cumsum(dz) + z_offset + dz_p
 
     return x * 1E9, y * 1E9, z * 1E9
 
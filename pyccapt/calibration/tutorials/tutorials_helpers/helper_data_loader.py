@@ -3,7 +3,7 @@ import os
 import numpy as np
 
 from pyccapt.calibration.calibration import share_variables
-from pyccapt.calibration.data_tools import data_tools
+from pyccapt.calibration.data_tools import data_schema, data_tools
 from pyccapt.calibration.mc import tof_tools
 
 
@@ -114,19 +114,19 @@ def load_data(dataset_path, max_mc, flightPathLength, pulse_mode, tdc, variables
 def add_columns(variables, max_mc):
 
 	if 'x (nm)' not in variables.data:
-		variables.data.insert(0, 'x (nm)', np.zeros(len(variables.dld_t)))
+		variables.data.insert(0, 'x (nm)', data_schema.placeholder_column('x (nm)', len(variables.dld_t)))
 	if 'y (nm)' not in variables.data:
-		variables.data.insert(1, 'y (nm)', np.zeros(len(variables.dld_t)))
+		variables.data.insert(1, 'y (nm)', data_schema.placeholder_column('y (nm)', len(variables.dld_t)))
 	if 'z (nm)' not in variables.data:
-		variables.data.insert(2, 'z (nm)', np.zeros(len(variables.dld_t)))
+		variables.data.insert(2, 'z (nm)', data_schema.placeholder_column('z (nm)', len(variables.dld_t)))
 	if 'mc (Da)' not in variables.data:
-		variables.data.insert(4, 'mc (Da)', np.zeros(len(variables.dld_t)))
+		variables.data.insert(4, 'mc (Da)', data_schema.placeholder_column('mc (Da)', len(variables.dld_t)))
 	if 'mc_uc (Da)' not in variables.data:
 		variables.data.insert(5, 'mc_uc (Da)', variables.mc_uc)
 	else:
 		variables.data['mc_uc (Da)'] = variables.mc_uc
 	if 't_c (ns)' not in variables.data:
-		variables.data.insert(8, 't_c (ns)', np.zeros(len(variables.dld_t)))
+		variables.data.insert(8, 't_c (ns)', data_schema.placeholder_column('t_c (ns)', len(variables.dld_t)))
 
 	# Remove the data with mc biger than max mc
 	mask = (variables.data['mc (Da)'].to_numpy() > max_mc.value)
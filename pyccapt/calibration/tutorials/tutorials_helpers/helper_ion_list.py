@@ -6,25 +6,16 @@ from IPython.display import clear_output, display
 from ipywidgets import Output
 from scipy.optimize import curve_fit
 
-from pyccapt.calibration.calibration import mc_plot, widgets as wd
-from pyccapt.calibration.data_tools import data_tools
+from pyccapt.calibration.calibration import isotope_database, mc_plot, widgets as wd
 
 # Define a layout for labels to make them a fixed width
 label_layout = widgets.Layout(width='200px')
 
 
-def call_ion_list(variables, selector, path='../../../files/'):
-    try:
-        isotopeTableFile = path + 'isotopeTable.h5'
-        dataframe = data_tools.read_range(isotopeTableFile)
-    except Exception as e:
-        print(f"Error in loading the isotopeTable file: {e}")
-        print("Trying to load the isotopeTable file from the pyccapt package")
-        try:
-            isotopeTableFile = './pyccapt/files/isotopeTable.h5'
-            dataframe = data_tools.read_range(isotopeTableFile)
-        except Exception as e:
-            print(f"Error in loading the isotopeTable file: {e}")
+def call_ion_list(variables, selector, path=None):
+    # The isotope table of the package is loaded once and shared with ion_selection, so work on a copy
+    isotopeTableFile = path + 'isotopeTable.h5' if path is not None else None
+    dataframe = isotope_database.get_isotope_database(isotopeTableFile).table.copy()
 
     elementsList = dataframe['element']
     elementIsotopeList = dataframe['isotope']
@@ -85,9 +85,11 @@ setup(
     entry_points={
             'console_scripts': {
                 'pyccapt=pyccapt.control.__main__:main',
+                'pyccapt-convert=pyccapt.calibration.data_tools.batch_convert:main',
                 }
     },
     packages=package_list,
+    include_package_data=True,
     license="GPL v3",
     description='A package for controlling APT experiment and calibrating the APT data',
     long_description=open('README.md').read() if exists('README.md') else '',
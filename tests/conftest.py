@@ -0,0 +1,59 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# Local module and scripts
+from pyccapt.calibration.data_tools import data_loadcrop
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'data_tests')
+RAW_FILE = os.path.join(DATA_PATH, 'AL_data_b.h5')
+
+
+@pytest.fixture(scope='session')
+def raw_file():
+    """
+    Path of the raw pyccapt test file (1000 ions in the dld group).
+    """
+    return RAW_FILE
+
+
+@pytest.fixture(scope='session')
+def dld_data():
+    """
+    The dld group of the raw test file as a pyccapt DataFrame.
+    """
+    return data_loadcrop.fetch_dataset_from_dld_grp(RAW_FILE)
+
+
+@pytest.fixture()
+def raw_signals():
+    """
+    Raw Surface Concept TDC signals (the tdc group of the raw test file is empty): start_counter, channel,
+    time_data, high_voltage and pulse of groups of 1 to 11 signals, most four signal groups complete.
+    """
+    rng = np.random.default_rng(3)
+    num_groups = 400
+    lengths = rng.choice([1, 2, 3, 4, 4, 4, 5, 7, 8, 11], size=num_groups)
+    start_counter = np.repeat(np.arange(num_groups, dtype=np.uint64) * 3, lengths)
+    channel = rng.integers(0, 4, size=len(start_counter)).astype(np.uint32)
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    for offset in offsets[lengths == 4][::2]:
+        channel[offset:offset + 4] = rng.permutation(4)
+    time_data = rng.integers(0, 10 ** 6, size=len(start_counter)).astype(np.uint64)
+    high_voltage = np.repeat(rng.uniform(3000, 6000, num_groups), lengths)
+    return start_counter, channel, time_data, high_voltage, high_voltage * 0.2
+
+
+@pytest.fixture()
+def detector_data():
+    """
+    20000 ions spread over an 80 mm detector (the positions of the raw test file are not physical), with the
+    columns used by the calibration.
+    """
+    rng = np.random.default_rng(6)
+    n = 20000
+    return pd.DataFrame({'t (ns)': rng.uniform(300, 700, n), 'high_voltage (V)': rng.uniform(4000, 8000, n),
+                         'pulse': rng.uniform(500, 1000, n), 'x_det (cm)': rng.uniform(-3.5, 3.5, n),
+                         'y_det (cm)': rng.uniform(-3.5, 3.5, n), 'mc_uc (Da)': rng.uniform(1, 100, n)})
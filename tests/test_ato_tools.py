@@ -0,0 +1,52 @@
+import struct
+
+import numpy as np
+import pytest
+
+# Local module and scripts
+from pyccapt.calibration.data_tools import ato_tools
+
+
+def write_ato(file_name, num_clusters):
+    records = [struct.pack('iii', 0, 6, len(num_clusters))]
+    for i, num_cluster in enumerate(num_clusters):
+        records.append(struct.pack('IihhfffhhHHB', i, i + 1, 3, -4, 10.0, 27.0 + i, 0.5, 150, -200, 8000, 7,
+                                   num_cluster))
+        records.append(struct.pack('H' * num_cluster, *range(100 + i, 100 + i + num_cluster)))
+    file_name.write_bytes(b''.join(records))
+
+
+def test_read_ato_variable_cluster_tail(tmp_path):
+    file_name = tmp_path / 'test.ato'
+    write_ato(file_name, [1, 0, 2, 1])
+    ato = ato_tools.read_ato(file_name)
+    assert np.array_equal(ato['atom_id'], [0, 1, 2, 3])
+    assert np.array_equal(ato['mc (Da)'], [27, 28, 29, 30])
+    assert np.array_equal(ato['num_cluster'], [1, 0, 2, 1])
+    assert np.array_equal(ato['cluster_id'], [100, 0, 102, 103])
+    assert np.allclose(ato['y_det (mm)'], -2)
+    assert np.allclose(ato['dc_voltage (V)'], 4000)
+
+
+def test_read_ato_fixed_stride(tmp_path):
+    file_name = tmp_path / 'test.ato'
+    write_ato(file_name, [1, 1, 1])
+    ato = ato_tools.read_ato(file_name)
+    assert np.array_equal(ato['cluster_id'], [100, 101, 102])
+    assert np.allclose(ato['z (nm)'], 1)
+
+
+def test_ato_to_ccapt_check_layout(tmp_path):
+    file_name = tmp_path / 'test.ato'
+    write_ato(file_name, [1, 1])
+    data = ato_tools.ato_to_ccapt(file_name, mode='pyccapt')
+    assert 'x_det (cm)' in data.columns
+    assert np.allclose(data['t (ns)'].to_numpy(), 500)
+
+
+def test_read_ato_truncated_cluster_tail(tmp_path):
+    file_name = tmp_path / 'test.ato'
+    write_ato(file_name, [1, 0, 2])
+    file_name.write_bytes(file_name.read_bytes()[:-3])
+    with pytest.raises(ValueError):
+        ato_tools.read_ato(file_name)
@@ -0,0 +1,63 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+# Local module and scripts
+from pyccapt.calibration.data_tools import batch_convert, hdf5_dataset
+from pyccapt.calibration.leap_tools import ccapt_tools, leap_tools
+
+
+def test_batch_convert_processed_to_epos_to_pos_and_skip(tmp_path, raw_file, dld_data):
+    for name in ['a.h5', 'b.h5']:
+        shutil.copy(raw_file, str(tmp_path / name))
+    processed_dir = str(tmp_path / 'processed')
+    output_dir = str(tmp_path / 'out')
+
+    # Raw files have no mc or reconstruction, so they are only converted to pyccapt or csv
+    assert batch_convert.main([str(tmp_path), '--to', 'epos', '--output-dir', output_dir, '--workers', '2']) == 1
+    assert os.listdir(output_dir) == []
+    assert batch_convert.main([str(tmp_path), '--to', 'pyccapt', '--output-dir', processed_dir,
+                               '--workers', '2']) == 0
+
+    assert batch_convert.main([processed_dir, '--to', 'epos', '--output-dir', output_dir, '--workers', '2']) == 0
+    for name in ['a.epos', 'b.epos']:
+        epos = leap_tools.memmap_epos(os.path.join(output_dir, name))
+        assert len(epos) == len(dld_data)
+        assert np.allclose(epos['TOF (ns)'], dld_data['t (ns)'].to_numpy(np.float32))
+        assert np.allclose(epos['HV_DC (V)'], dld_data['high_voltage (V)'].to_numpy(np.float32))
+
+    result = batch_convert.batch_convert([os.path.join(output_dir, '*.epos')], 'pos', workers=2)
+    assert len(result['converted']) == 2
+    assert len(leap_tools.memmap_pos(os.path.join(output_dir, 'a.pos'))) == len(dld_data)
+
+    result = batch_convert.batch_convert([os.path.join(output_dir, '*.epos')], 'pos', workers=2)
+    assert result['converted'] == [] and len(result['skipped']) == 2
+
+
+def test_batch_convert_columns_to_pyccapt(tmp_path, raw_file, dld_data):
+    output_dir = str(tmp_path / 'out')
+    result = batch_convert.batch_convert([raw_file], 'pyccapt', output_dir=output_dir,
+                                         columns=['t (ns)', 'high_voltage (V)'], workers=1)
+    assert len(result['converted']) == 1
+
+    converted = hdf5_dataset.read_processed_hdf5(os.path.join(output_dir, os.path.basename(raw_file)))
+    assert list(converted.columns) == ['t (ns)', 'high_voltage (V)']
+    assert np.allclose(converted['t (ns)'], dld_data['t (ns)'].to_numpy(np.float32))
+
+
+def test_convert_file_removes_the_partial_output(tmp_path, raw_file, monkeypatch):
+    processed_file = str(tmp_path / 'processed.h5')
+    batch_convert.convert_file(raw_file, processed_file, 'pyccapt')
+
+    def failing_writer(data, file, *args, **kwargs):
+        with open(file, 'wb') as f:
+            f.write(b'partial')
+        raise OSError('disk full')
+
+    monkeypatch.setattr(ccapt_tools, 'write_ccapt_records', failing_writer)
+    output_file = str(tmp_path / 'processed.epos')
+    with pytest.raises(OSError):
+        batch_convert.convert_file(processed_file, output_file, 'epos')
+    assert not os.path.exists(output_file) and not os.path.exists(output_file + '.part')
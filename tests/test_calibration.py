@@ -0,0 +1,126 @@
+import warnings
+from itertools import product
+
+import numpy as np
+
+# Local module and scripts
+from pyccapt.calibration.calibration import auto_calibration, calibration
+
+
+def _bowl_data(n=60000, seed=11):
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(-38, 38, n)
+    y = rng.uniform(-38, 38, n)
+    t = rng.normal(500, 2, n) * (1 + 1e-4 * (x ** 2 + y ** 2))
+    # Some ions exactly on cell borders
+    x[:50] = np.round(x[:50])
+    return x, y, t
+
+
+def test_bowl_samples_match_compute_sample():
+    x, y, t = _bowl_data()
+    d = 8
+    w1, w2 = int(np.floor(x.min())), int(np.ceil(x.max()))
+    h1, h2 = int(np.floor(y.min())), int(np.ceil(y.max()))
+    for mode in ('mean', 'histogram'):
+        expected = [calibration.compute_sample(i, j, d, x, y, t, 500, mode, 0.1)
+                    for i, j in product(range(h1, h2 - h2 % d, d), range(w1, w2 - w2 % d, d))]
+        expected = np.array([sample for sample in expected if sample[0] is not None])
+        found = np.column_stack(calibration.bowl_samples(x, y, t, d, 500, mode, bin_size=0.1))
+        assert found.shape == expected.shape
+        assert np.allclose(found, expected)
+
+
+def test_window_histogram_peaks_track_the_peak():
+    rng = np.random.default_rng(3)
+    sample_size = 5000
+    num_windows = 40
+    centers = np.linspace(300, 320, num_windows)
+    t = np.concatenate([np.concatenate((rng.normal(center, 0.3, sample_size - 500), rng.uniform(250, 350, 500)))
+                        for center in centers])
+    # Split the blocks of windows into several 2-D histograms
+    peaks = calibration.window_histogram_peaks(t, sample_size, 0.1, max_cells=10 * 1001)
+    assert len(peaks) == num_windows
+    assert np.max(np.abs(peaks - centers)) < 0.1
+
+
+def test_ion_sequence_samples():
+    rng = np.random.default_rng(4)
+    high_voltage = np.linspace(4000, 6000, 10500)
+    t = rng.normal(400, 0.5, len(high_voltage))
+    hv_mean, t_mean = calibration.ion_sequence_samples(high_voltage, t, 1000, 'mean', 0.1)
+    assert len(t_mean) == 11
+    assert np.allclose(t_mean[-1], t[10000:].mean()) and np.allclose(hv_mean[0], high_voltage[:1000].mean())
+
+    hv_peak, t_peak = calibration.ion_sequence_samples(high_voltage, t, 1000, 'histogram', 0.1)
+    assert np.all(np.abs(t_peak - 400) < 0.3)
+    assert np.all(np.abs(hv_peak - hv_mean) < 100)
+
+
+class _UnitModel:
+    def predict(self, values):
+        return np.ones(len(values))
+
+
+def test_auto_calibration_recovers_distortion():
+    rng = np.random.default_rng(5)
+    n = 400_000
+    high_voltage = np.linspace(4000, 8000, n)
+    x = rng.uniform(-3.5, 3.5, n)
+    y = rng.uniform(-3.5, 3.5, n)
+    t = np.where(rng.uniform(size=n) < 0.8, rng.normal(500, 0.3, n), rng.uniform(400, 700, n))
+    t = (t * np.sqrt(1 + 1e-8 * (high_voltage - 6000) ** 2 + 2e-5 * (high_voltage - 6000)) *
+         (1 + 4e-4 * ((x * 10) ** 2 + (y * 10) ** 2) / 100))
+    uncalibrated_mrp = auto_calibration.peak_mrp(t, 0.1, (480, 530))[1]
+
+    result = auto_calibration.auto_calibration(t, high_voltage, x, y, (480, 530), initial_sample_size=20_000,
+                                               max_sample_size=100_000)
+    assert result['mrp'] > 3 * uncalibrated_mrp
+    assert result['log'][-1]['sample_size'] == 100_000
+    assert np.allclose(result['calibrated'],
+                       auto_calibration.apply_steps(result['steps'], t, high_voltage, x, y))
+    # The generic (chunked) path gives the same calibration
+    generic = auto_calibration.apply_steps(result['steps'] + [{'kind': 'voltage', 'fit_mode': 'robust_fit',
+                                                               'model': _UnitModel()}],
+                                           t, high_voltage, x, y, chunk_size=70_000)
+    assert np.allclose(generic, result['calibrated'])
+    assert result['converged']
+
+    # The estimator steps are folded into one lookup table per kind
+    steps = result['steps'] + [{'kind': 'voltage', 'fit_mode': 'robust_fit', 'model': _UnitModel()}]
+    folded = auto_calibration.fold_steps(steps, (4000, 8000), [(-35, 35), (-35, 35)])
+    assert [step['kind'] for step in folded if step['fit_mode'] == 'lookup'] == ['voltage']
+    assert len(folded) == 1 + len([step for step in steps if step['kind'] == 'bowl'])
+    assert np.allclose(auto_calibration.apply_steps(folded, t, high_voltage, x, y), generic, rtol=1e-6)
+
+
+class _BilinearModel:
+    def predict(self, X):
+        return 2 + 0.1 * X[:, 0] - 0.2 * X[:, 1] + 0.01 * X[:, 0] * X[:, 1]
+
+
+class _RampModel:
+    def predict(self, X):
+        return np.maximum(X[:, 0], 0)
+
+
+def test_compile_model_lookup():
+    rng = np.random.default_rng(8)
+    # A bilinear model is reproduced exactly; points outside the grid take the border value
+    lookup = calibration.compile_model(_BilinearModel(), [(-40, 40), (-30, 30)], 0.7, num_test=1000)
+    assert lookup.table.shape == (116, 87) and lookup.error['max_abs'] < 1e-12
+    X = np.column_stack((rng.uniform(-40, 40, 500), rng.uniform(-30, 30, 500)))
+    assert np.allclose(lookup.predict(X), _BilinearModel().predict(X))
+    assert np.allclose(lookup.predict([[50, 35]]), _BilinearModel().predict(np.array([[40, 30]])))
+
+    voltage = np.linspace(4000, 9000, 200)
+    model = calibration.robust_voltage_fit(voltage, 1 + 1e-5 * voltage + 1e-9 * voltage ** 2)
+    lookup = calibration.compile_model(model, [(4000, 9000)], 1.0)
+    assert lookup.error['max_rel'] < 1e-6
+    assert np.allclose(lookup.predict(voltage.reshape(-1, 1)), model.predict(voltage.reshape(-1, 1)))
+
+    # A model that is zero on part of the range has a finite relative error and no division warning
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        lookup = calibration.compile_model(_RampModel(), [(-1, 1)], 0.5, num_test=1000)
+    assert lookup.error['max_rel'] < 1e-12
@@ -0,0 +1,104 @@
+import types
+
+import numpy as np
+import pytest
+
+# Local module and scripts
+from pyccapt.calibration.calibration import calibration, calibration_model
+
+
+@pytest.fixture()
+def model():
+    rng = np.random.default_rng(7)
+    voltage = rng.uniform(4000, 9000, 200)
+    x = rng.uniform(-35, 35, 200)
+    y = rng.uniform(-35, 35, 200)
+    model = calibration_model.CalibrationModel('tof', 110, t0=38, det_diam=80)
+    model.add_step('voltage', 'curve_fit', [1.0, 2e-6, 1e-11])
+    model.add_step('bowl', 'curve_fit', [1.0, 1e-4, -1e-4, 1e-5, 0, 1e-5])
+    model.add_step('voltage', 'robust_fit',
+                   calibration.robust_voltage_fit(voltage, 1 + 1e-5 * voltage + rng.normal(0, 1e-4, 200)))
+    model.add_step('bowl', 'robust_fit', calibration.robust_fit(x, y, 1 + 1e-5 * (x ** 2 + y ** 2)))
+    return model
+
+
+def test_apply_matches_the_corrections(detector_data, model):
+    data = detector_data
+    model.set_initial_calibration(data)
+    t = data['t (ns)'].to_numpy()
+    voltage = model.voltage(data['high_voltage (V)'].to_numpy(), data['pulse'].to_numpy())
+    x = data['x_det (cm)'].to_numpy()
+    y = data['y_det (cm)'].to_numpy()
+
+    expected = calibration.initial_calibration(data, 110)
+    for step in model.steps:
+        if step['kind'] == 'voltage':
+            f_v = (calibration.voltage_corr(voltage, *step['model']) if step['fit_mode'] == 'curve_fit' else
+                   step['model'].predict(voltage.reshape(-1, 1)))
+            expected = expected / np.sqrt(f_v)
+        elif step['fit_mode'] == 'curve_fit':
+            expected = expected / calibration.bowl_corr([x * 10, y * 10], *step['model'])
+        else:
+            expected = expected / step['model'].predict(np.column_stack((x * 10, y * 10)))
+    calibrated = model.apply(t, voltage, x, y, data['high_voltage (V)'].to_numpy(), chunk_size=3000)
+    assert np.allclose(calibrated, expected)
+
+
+def test_save_load_round_trip(tmp_path, detector_data, model):
+    data = detector_data
+    model.set_initial_calibration(data)
+    model.mc_fit = np.array([38, 2e-4, 1e-3])
+    path = str(tmp_path / 'processed.h5')
+    model.save(path)
+    model.save(path)
+    loaded = calibration_model.CalibrationModel.load(path)
+    assert loaded.calibration_mode == 'tof' and loaded.flight_path_length == 110 and loaded.t0 == 38
+    assert [step['fit_mode'] for step in loaded.steps] == ['curve_fit', 'curve_fit', 'robust_fit', 'robust_fit']
+    mc, t_c = model(data)
+    mc_loaded, t_c_loaded = loaded(data)
+    assert np.array_equal(t_c, t_c_loaded) and np.array_equal(mc, mc_loaded)
+    assert np.allclose(mc, 2e-4 * (t_c - 38) ** 2 + 1e-3 * t_c)
+
+
+def test_mc_mode_keeps_t(detector_data):
+    data = detector_data
+    model = calibration_model.CalibrationModel('mc', 110, pulse_mode='laser', mc_fit=[1.0, 0.5])
+    model.add_step('bowl', 'curve_fit', [2.0, 0, 0, 0, 0, 0])
+    mc, t_c = model(data)
+    assert np.array_equal(t_c, data['t (ns)'].to_numpy())
+    assert np.allclose(mc, data['mc_uc (Da)'].to_numpy() / 2 + 0.5)
+
+
+def test_compile_replaces_estimators(tmp_path, detector_data, model):
+    data = detector_data
+    mc, t_c = model(data)
+    voltage = model.voltage(data['high_voltage (V)'].to_numpy(), data['pulse'].to_numpy())
+    errors = model.compile((voltage.min(), voltage.max()))
+    assert len(errors) == 2 and all(error['max_rel'] < 1e-6 for error in errors)
+    assert isinstance(model.steps[3]['model'], calibration.LookupTableModel)
+    path = str(tmp_path / 'processed.h5')
+    model.save(path)
+    _, t_c_compiled = calibration_model.CalibrationModel.load(path)(data)
+    assert np.allclose(t_c_compiled, t_c, rtol=1e-6)
+
+
+@pytest.mark.parametrize('fit_mode, lookup_resolution', [('curve_fit', None), ('robust_fit', None),
+                                                          ('robust_fit', 0.5)])
+def test_bowl_correction_main_records_the_applied_step(tmp_path, detector_data, fit_mode, lookup_resolution):
+    data = detector_data
+    x = data['x_det (cm)'].to_numpy()
+    y = data['y_det (cm)'].to_numpy()
+    high_voltage = data['high_voltage (V)'].to_numpy()
+    t = 500 * (1 + 4e-4 * ((x * 10) ** 2 + (y * 10) ** 2) / 100) + np.random.default_rng(9).normal(0, 0.3, len(x))
+    variables = types.SimpleNamespace(dld_t_calib=t.copy(), selected_x1=495, selected_x2=520,
+                                      result_path=str(tmp_path))
+    model = calibration_model.CalibrationModel('tof', 110)
+    calibration.bowl_correction_main(x, y, high_voltage, variables, 80, 5, fit_mode, 'tof', 0, plot=False,
+                                     save=False, calibration_model=model, lookup_resolution=lookup_resolution)
+    assert len(model.steps) == 1
+    if lookup_resolution is not None:
+        # The table covers the detector in mm, like CalibrationModel.compile
+        assert all(axis[0] < -34 and axis[-1] > 34 for axis in model.steps[0]['model'].axes)
+    assert np.allclose(model.apply(t, high_voltage, x, y), variables.dld_t_calib)
+    # The bowl is removed, which only holds if the step is applied in the units it was fitted in (mm)
+    assert np.std(variables.dld_t_calib[np.abs(variables.dld_t_calib - 500) < 5]) < 0.4
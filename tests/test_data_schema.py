@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+# Local module and scripts
+from pyccapt.calibration.data_tools import data_schema, data_tools
+
+
+def test_ccapt_dataframe_casts_and_adds_placeholders():
+    data = data_schema.ccapt_dataframe({'mc (Da)': np.arange(5, dtype=np.float64),
+                                        'multi': np.ones(5, dtype=np.int64)})
+    assert list(data.columns) == data_schema.CCAPT_COLUMNS
+    for column, dtype in data_schema.CCAPT_DTYPES.items():
+        assert data[column].dtype == dtype
+    assert np.array_equal(data['mc (Da)'], np.arange(5))
+    assert not data['x (nm)'].any()
+
+
+def test_ccapt_dataframe_keeps_signed_delta_p():
+    # ATO stores the pulse difference as a signed int32
+    data = data_schema.ccapt_dataframe({'delta_p': np.array([-1, 0, 7], dtype='<i4')})
+    assert list(data['delta_p']) == [-1, 0, 7]
+
+
+def test_ccapt_dataframe_rejects_unknown_columns():
+    with pytest.raises(KeyError):
+        data_schema.ccapt_dataframe({}, length=3, columns=['mass'])
+
+
+def test_raw_to_processed_follows_schema():
+    raw = pd.DataFrame({'high_voltage (V)': np.full(4, 5000.0), 'pulse': np.full(4, 500.0),
+                        'start_counter': np.arange(4), 't (ns)': np.linspace(100, 400, 4),
+                        'x_det (cm)': np.zeros(4), 'y_det (cm)': np.ones(4)})
+    processed = data_tools.pyccapt_raw_to_processed(raw)
+    assert list(processed.columns) == data_schema.CCAPT_COLUMNS
+    assert processed.dtypes.to_dict() == {c: np.dtype(d) for c, d in data_schema.CCAPT_DTYPES.items()}
+    # Roughly half of the former all-float64 layout
+    assert processed.memory_usage(index=False).sum() < 0.55 * 14 * 8 * len(raw)
@@ -0,0 +1,91 @@
+import h5py
+import numpy as np
+import pandas as pd
+import pytest
+
+# Local module and scripts
+from pyccapt.calibration.data_tools import data_loadcrop, data_tools, hdf5_dataset
+
+
+@pytest.fixture()
+def raw_file(tmp_path):
+    file_name = tmp_path / 'raw.h5'
+    with h5py.File(file_name, 'w') as f:
+        f.create_dataset('dld/high_voltage', data=np.linspace(1000, 2000, 100, dtype=np.float32))
+        f.create_dataset('dld/pulse_voltage', data=np.zeros(100, dtype=np.float32))
+        f.create_dataset('dld/start_counter', data=np.arange(100, dtype=np.int32).reshape(-1, 1))
+        f.create_dataset('dld/t', data=np.arange(100, dtype=np.int32) * 10)
+        f.create_dataset('dld/x', data=np.ones(100, dtype=np.int32))
+        f.create_dataset('dld/y', data=np.ones(100, dtype=np.int32))
+        f.create_dataset('tdc/channel', data=np.zeros(5, dtype=np.int32))
+    return file_name
+
+
+def test_lazy_dataset_column_aliases(raw_file):
+    with hdf5_dataset.LazyHDF5Dataset(raw_file, hdf5_dataset.DLD_COLUMNS) as dataset:
+        assert len(dataset) == 100
+        assert dataset.resolve('pulse') == 'dld/pulse_voltage'
+        assert np.array_equal(dataset.column('start_counter', ion_range=(3, 6)), [3, 4, 5])
+        assert 'tdc/channel' in dataset.keys()
+
+
+def test_lazy_dataset_iter_chunks(raw_file):
+    with hdf5_dataset.LazyHDF5Dataset(raw_file, hdf5_dataset.DLD_COLUMNS) as dataset:
+        chunks = list(dataset.iter_chunks(['t (ns)'], chunk_size=30, ion_range=(10, 100)))
+    assert [start for start, _ in chunks] == [10, 40, 70]
+    assert np.array_equal(np.concatenate([c['t (ns)'].to_numpy() for _, c in chunks]), np.arange(10, 100) * 10)
+
+
+def test_fetch_dataset_from_dld_grp_check_columns(raw_file):
+    data = data_loadcrop.fetch_dataset_from_dld_grp(str(raw_file), ion_range=(0, 50))
+    assert list(data.columns) == ['high_voltage (V)', 'pulse', 'start_counter', 't (ns)', 'x_det (cm)',
+                                  'y_det (cm)']
+    assert len(data) == 50
+    assert data['start_counter'].dtype == np.uint64
+    assert data['t (ns)'].dtype == np.float32
+
+
+@pytest.fixture()
+def processed_data():
+    rng = np.random.default_rng(3)
+    n = 1000
+    return pd.DataFrame({'x (nm)': rng.random(n), 'z (nm)': np.linspace(0, 100, n), 'mc (Da)': rng.random(n) * 100,
+                         'delta_p': rng.integers(0, 10, n).astype(np.float64),
+                         'start_counter': np.arange(n, dtype=np.float64), 'name': ['Al'] * n})
+
+
+@pytest.mark.parametrize('compression', [None, 'lzf', 'gzip'])
+def test_processed_hdf5_round_trip(tmp_path, processed_data, compression):
+    file_name = str(tmp_path / 'processed.h5')
+    hdf5_dataset.write_processed_hdf5(processed_data, file_name, chunk_size=128, compression=compression)
+    assert hdf5_dataset.is_columnar_hdf5(file_name)
+    data = hdf5_dataset.read_processed_hdf5(file_name)
+    assert list(data.columns) == list(processed_data.columns)
+    assert data['delta_p'].dtype == np.int32
+    assert data['mc (Da)'].dtype == np.float32
+    assert np.allclose(data['mc (Da)'].to_numpy(), processed_data['mc (Da)'].to_numpy())
+    assert list(data['name']) == list(processed_data['name'])
+
+
+def test_processed_hdf5_filters_skip_chunks(tmp_path, processed_data):
+    file_name = str(tmp_path / 'processed.h5')
+    hdf5_dataset.write_processed_hdf5(processed_data, file_name, chunk_size=100)
+    filters = {'z (nm)': (10, 20), 'mc (Da)': (0, 50)}
+    data = data_tools.load_data(file_name, 'pyccapt', mode='processed', columns=['z (nm)', 'mc (Da)'],
+                                filters=filters)
+    z = processed_data['z (nm)'].to_numpy().astype(np.float32)
+    mc = processed_data['mc (Da)'].to_numpy().astype(np.float32)
+    expected = (z >= 10) & (z <= 20) & (mc >= 0) & (mc <= 50)
+    assert len(data) == expected.sum()
+    assert np.array_equal(data['mc (Da)'].to_numpy(), mc[expected])
+
+
+def test_processed_hdf5_interrupted_write_is_incomplete(tmp_path, processed_data):
+    file_name = str(tmp_path / 'processed.h5')
+    with pytest.raises(RuntimeError):
+        with hdf5_dataset.ProcessedHDF5Writer(file_name, chunk_size=100) as writer:
+            writer.append(processed_data.iloc[:300])
+            raise RuntimeError('interrupted')
+    assert not hdf5_dataset.is_columnar_hdf5(file_name)
+    with pytest.raises(ValueError):
+        hdf5_dataset.read_processed_hdf5(file_name)
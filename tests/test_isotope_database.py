@@ -0,0 +1,97 @@
+import itertools
+
+import numpy as np
+
+# Local module and scripts
+from pyccapt.calibration.calibration import ion_selection, isotope_database, share_variables
+
+
+def test_database_is_loaded_once():
+    assert isotope_database.get_isotope_database() is isotope_database.get_isotope_database()
+
+
+def test_closest_matches_full_search():
+    database = isotope_database.get_isotope_database()
+    table = database.table
+    weights = np.repeat(table['weight'].to_numpy(), 3) / np.tile([1, 2, 3], len(table))
+    abundance = np.repeat(table['abundance'].to_numpy(), 3)
+    for target in (1.0, 13.49, 27.0, 80.3, 500.0):
+        rows, charges = database.closest(target, 10, 3, abundance_threshold=0.01)
+        expected = np.sort(np.abs(weights[abundance > 1] - target))[:10]
+        assert np.allclose(np.abs(database.weight[rows] / charges - target), expected)
+
+
+def test_load_elements_and_molecule_manual():
+    df = ion_selection.load_elements('Fe, O', charge=2)
+    table = isotope_database.get_isotope_database().table
+    assert len(df) == 2 * np.count_nonzero(table['element'].isin(['Fe', 'O']))
+    assert df['mass'].is_monotonic_increasing
+    assert isinstance(df['element'][0], list)
+
+    df = ion_selection.molecule_manual('{56}Fe1{16}O2', 1)
+    fe = table[(table['element'] == 'Fe') & (table['isotope'] == 56)]
+    o = table[(table['element'] == 'O') & (table['isotope'] == 16)]
+    assert np.isclose(df['mass'][0], round(fe['weight'].iloc[0] + 2 * o['weight'].iloc[0], 4))
+
+
+def test_molecule_candidates_match_product_enumeration():
+    database = isotope_database.get_isotope_database()
+    rows = database.rows(['Fe', 'O'])
+    expected = set()
+    for complexity in range(1, 4):
+        for combo in itertools.product(rows, repeat=complexity):
+            abundance = np.prod(database.abundance[list(combo)] / 100)
+            if abundance > 1e-4:
+                for charge in (1, 2):
+                    expected.add((tuple(sorted(combo)), charge))
+
+    isotope_rows, charges, mc, abundance = ion_selection.molecule_candidates(['Fe', 'O'], 3, 2, 1e-4)
+    found = [(tuple(sorted(r)), c) for r, c in zip(isotope_rows, charges)]
+    assert len(found) == len(set(found)) == len(expected)
+    assert set(found) == expected
+    assert np.allclose(mc, [database.weight[list(r)].sum() / c for r, c in zip(isotope_rows, charges)])
+
+    # Only the ions inside the window
+    _, _, mc_window, _ = ion_selection.molecule_candidates(['Fe', 'O'], 3, 2, 1e-4, mc_range=(30, 60))
+    assert np.array_equal(np.sort(mc_window), np.sort(mc[(mc >= 30) & (mc <= 60)]))
+
+
+def test_molecule_create_formula():
+    df = ion_selection.molecule_create('Fe, O', 2, 1, 0.01, latex=False)
+    assert 'FeO' in set(df['ion']) and 'O2' in set(df['ion'])
+    assert df['mass'].is_monotonic_increasing
+
+
+def test_closest_batch_matches_single_lookups():
+    database = isotope_database.get_isotope_database()
+    peaks = np.array([0.5, 1.0, 13.49, 27.0, 80.3, 500.0])
+    rows, charges, distance = database.closest_batch(peaks, 8, 3, abundance_threshold=0.01)
+    assert rows.shape == charges.shape == distance.shape == (len(peaks), 8)
+    for i, peak in enumerate(peaks):
+        single_rows, single_charges = database.closest(peak, 8, 3, abundance_threshold=0.01)
+        assert np.allclose(distance[i], np.abs(database.weight[single_rows] / single_charges - peak))
+
+    df = ion_selection.find_closest_elements_batch(peaks, 8, abundance_threshold=0.01, charge=3)
+    assert len(df) == 8 * len(peaks)
+    assert df.groupby('peak').size().tolist() == [8] * len(peaks)
+    assert np.allclose(df[df['peak'] == 27.0]['mass'], np.sort(database.weight[rows[3]] / charges[3]), atol=1e-4)
+
+    assert list(df.columns)[-1] == 'peak'
+
+    # Fewer charge states than requested are padded
+    rows, charges, distance = database.closest_batch([10.0, 20.0], 5, 1, abundance_threshold=1.0)
+    assert np.all(rows == -1) and np.all(charges == 0) and np.all(np.isinf(distance))
+
+
+def test_ranging_dataset_create_after_batch_lookup():
+    variables = share_variables.Variables()
+    variables.h_line_pos = [26.5, 27.5]
+    df = ion_selection.find_closest_elements_batch([13.5, 27.0], 3, abundance_threshold=0.01, charge=2,
+                                                   variables=variables)
+    row_index = int(np.flatnonzero((df['peak'] == 27.0).to_numpy())[0])
+    ion_selection.ranging_dataset_create(variables, row_index, 27.0)
+    added = variables.range_data.iloc[-1]
+    candidate = df.iloc[row_index]
+    assert added['ion'] == candidate['ion'] and added['mass'] == candidate['mass']
+    assert added['element'] == candidate['element'] and added['isotope'] == candidate['isotope']
+    assert added['charge'] == candidate['charge'] and added['mc'] == 27.0
@@ -0,0 +1,174 @@
+import struct
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# Local module and scripts
+from pyccapt.calibration.leap_tools import ccapt_tools, leap_tools
+
+
+@pytest.fixture()
+def epos_file(tmp_path):
+    rng = np.random.default_rng(0)
+    n = 100
+    floats = rng.random((n, 9)).astype(np.float32) * 100
+    ints = rng.integers(0, 5, size=(n, 2))
+    records = []
+    for i in range(n):
+        records.append(struct.pack('>fffffffffII', *floats[i], *ints[i]))
+    file_name = tmp_path / 'test.epos'
+    file_name.write_bytes(b''.join(records))
+    return file_name, floats, ints
+
+
+@pytest.fixture()
+def pos_file(tmp_path):
+    rng = np.random.default_rng(1)
+    floats = (rng.random((50, 4)) * 100).astype('>f4')
+    file_name = tmp_path / 'test.pos'
+    file_name.write_bytes(floats.tobytes())
+    return file_name, floats
+
+
+def test_read_epos_check_values(epos_file):
+    file_name, floats, ints = epos_file
+    epos = leap_tools.read_epos(file_name)
+    assert len(epos) == len(floats)
+    assert np.array_equal(epos['TOF (ns)'].to_numpy(), floats[:, 4])
+    assert np.array_equal(epos['ipp'].to_numpy(), ints[:, 1])
+
+
+def test_memmap_pos_columns_are_views(pos_file):
+    file_name, floats = pos_file
+    pos = leap_tools.memmap_pos(file_name)
+    assert isinstance(pos, np.memmap)
+    assert np.array_equal(pos['m/n (Da)'], floats[:, 3])
+
+
+def test_memmap_empty_file(tmp_path):
+    file_name = tmp_path / 'empty.pos'
+    file_name.write_bytes(b'')
+    assert len(leap_tools.read_pos(file_name)) == 0
+
+
+def test_epos_to_ccapt_columns_and_range(epos_file):
+    file_name, floats, ints = epos_file
+    data = ccapt_tools.epos_to_ccapt(file_name, columns=['mc (Da)', 'x_det (cm)', 'multi'], ion_range=(10, 20))
+    assert list(data.columns) == ['mc (Da)', 'x_det (cm)', 'multi']
+    assert len(data) == 10
+    assert np.array_equal(data['mc (Da)'].to_numpy(), floats[10:20, 3])
+    assert np.allclose(data['x_det (cm)'].to_numpy(), floats[10:20, 7] / 10)
+    assert np.array_equal(data['multi'].to_numpy(), ints[10:20, 1])
+
+
+def test_pos_to_ccapt_check_layout(pos_file):
+    file_name, floats = pos_file
+    data = ccapt_tools.pos_to_ccapt(file_name)
+    assert list(data.columns) == ccapt_tools.CCAPT_COLUMNS
+    assert np.array_equal(data['z (nm)'].to_numpy(), floats[:, 2])
+    assert not data['t (ns)'].any()
+
+
+def test_ccapt_to_epos_round_trip(epos_file, tmp_path):
+    file_name, floats, ints = epos_file
+    data = ccapt_tools.epos_to_ccapt(file_name)
+    ccapt_tools.ccapt_to_epos(data, path=str(tmp_path) + '/', name='out.epos', chunk_size=7)
+    epos = leap_tools.read_epos(tmp_path / 'out.epos')
+    assert np.array_equal(epos['m/n (Da)'].to_numpy(), floats[:, 3])
+    assert np.allclose(epos['det_y (mm)'].to_numpy(), floats[:, 8])
+    assert np.array_equal(epos['pslep'].to_numpy(), ints[:, 0])
+
+
+def test_ccapt_to_pos_check_return_bytes(pos_file):
+    file_name, floats = pos_file
+    data = ccapt_tools.pos_to_ccapt(file_name)
+    response = ccapt_tools.ccapt_to_pos(data, chunk_size=16)
+    assert response == file_name.read_bytes()
+
+
+def write_apt(file_name, sections, ion_count):
+    header = np.zeros(1, dtype=leap_tools.APT_FILE_HEADER_DTYPE)
+    header['signature'] = b'APT\x00'
+    header['header_size'] = leap_tools.APT_FILE_HEADER_DTYPE.itemsize
+    header['ion_count'] = ion_count
+    blobs = [header.tobytes()]
+    for name, values in sections.items():
+        values = np.ascontiguousarray(values, dtype='<f4')
+        sec = np.zeros(1, dtype=leap_tools.APT_SECTION_HEADER_DTYPE)
+        sec['signature'] = b'SEC\x00'
+        sec['header_size'] = leap_tools.APT_SECTION_HEADER_DTYPE.itemsize
+        type_chars = np.frombuffer(name.encode('utf-16-le'), dtype='<u2')
+        sec['type'][0, :len(type_chars)] = type_chars
+        sec['rel_type'] = leap_tools.RelType.ONE_TO_ONE.value
+        sec['rec_type'] = leap_tools.RecordType.FIXED_SIZE.value
+        sec['rec_dtype'] = leap_tools.RecordDataType.FLOAT.value
+        sec['dtype_size'] = 32
+        sec['rec_size'] = values[0].nbytes
+        sec['rec_count'] = len(values)
+        sec['byte_count'] = values.nbytes
+        blobs += [sec.tobytes(), values.tobytes()]
+    file_name.write_bytes(b''.join(blobs))
+
+
+def test_apt_file_lazy_sections(tmp_path):
+    rng = np.random.default_rng(2)
+    position = rng.random((30, 3)).astype(np.float32)
+    mass = rng.random(30).astype(np.float32)
+    detector = rng.random((30, 2)).astype(np.float32)
+    file_name = tmp_path / 'test.apt'
+    write_apt(file_name, {'Position': position, 'Mass': mass, 'Detector Coordinates': detector}, 30)
+
+    apt = leap_tools.AptFile(file_name)
+    assert apt.ion_count == 30
+    assert set(apt.keys()) == {'x', 'y', 'z', 'Mass', 'det_x', 'det_y'}
+    assert np.array_equal(apt.read_column('z', ion_range=(5, 9)), position[5:9, 2])
+    assert np.array_equal(leap_tools.read_apt(file_name)['det_y'].to_numpy(), detector[:, 1])
+
+    data = ccapt_tools.apt_to_ccapt(file_name, columns=['mc (Da)', 'x_det (cm)', 't (ns)'], ion_range=(10, 30))
+    assert np.array_equal(data['mc (Da)'].to_numpy(), mass[10:])
+    assert np.allclose(data['x_det (cm)'].to_numpy(), detector[10:, 0] / 10)
+    assert not data['t (ns)'].any()
+
+
+def test_label_ions_and_deconvolve():
+    pos = pd.DataFrame({'x (nm)': np.arange(5.0), 'Da': [27.0, 43.0, 50.0, 16.2, 16.0]})
+    rrngs = pd.DataFrame({'lower': [26.5, 42.5, 15.5, 15.9], 'upper': [27.5, 43.5, 16.5, 16.1],
+                          'comp': ['Al:1', 'Al:1 O:1', 'O:1', 'O:2'],
+                          'colour': ['FF0000', '00FF00', '0000FF', '00FFFF']})
+    lpos = leap_tools.label_ions(pos, rrngs)
+    # The last overlapping range wins
+    assert list(lpos['comp']) == ['Al:1', 'Al:1 O:1', '', 'O:1', 'O:2']
+    assert list(lpos['colour']) == ['#FF0000', '#00FF00', '#FFFFFF', '#0000FF', '#00FFFF']
+    assert isinstance(lpos['comp'].dtype, pd.CategoricalDtype)
+
+    out = leap_tools.deconvolve(lpos)
+    assert list(out['x (nm)']) == [0.0, 1.0, 1.0, 3.0, 4.0]
+    assert list(out['element']) == ['Al', 'Al', 'O', 'O', 'O']
+    assert list(out['n']) == [1, 1, 1, 1, 2]
+
+
+def test_legend_entries_skip_unused_ranges():
+    rrngs = pd.DataFrame({'lower': [26.5, 42.5], 'upper': [27.5, 43.5], 'comp': ['Al:1', 'Al:1 O:1'],
+                          'colour': ['FF0000', '00FF00']})
+    lpos = leap_tools.label_ions(pd.DataFrame({'Da': [27.0, 27.1]}), rrngs)
+    ions, cs = leap_tools._legend_entries(lpos)
+    assert list(ions) == ['Al'] and np.allclose(cs, [[1, 0, 0]])
+
+
+def test_label_ions_with_read_rrng_layout():
+    rrngs = pd.DataFrame({'mc_low': [26.5], 'mc_up': [27.5], 'element': [['Al']], 'complex': [[1]],
+                          'color': ['FF0000']})
+    lpos = leap_tools.label_ions(pd.DataFrame({'m/n (Da)': [27.0, 10.0]}), rrngs)
+    assert list(lpos['comp']) == ['Al:1', '']
+
+
+def test_apt_file_separate_detector_sections(tmp_path):
+    mass = np.arange(12, dtype=np.float32)
+    det_x = np.linspace(-30, 30, 12, dtype=np.float32)
+    file_name = tmp_path / 'test.apt'
+    write_apt(file_name, {'Position': np.zeros((12, 3)), 'Mass': mass, 'XDet_mm': det_x, 'YDet_mm': -det_x}, 12)
+    assert set(leap_tools.AptFile(file_name).keys()) == {'x', 'y', 'z', 'Mass', 'det_x', 'det_y'}
+    data = ccapt_tools.apt_to_ccapt(file_name, columns=['x_det (cm)', 'y_det (cm)'])
+    assert np.allclose(data['x_det (cm)'].to_numpy(), det_x / 10)
+    assert np.allclose(data['y_det (cm)'].to_numpy(), -det_x / 10)
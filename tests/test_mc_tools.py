@@ -1,6 +1,5 @@
-
-from unittest.mock import patch
 import numpy as np
+import pytest
 
 # Local module and scripts
 from pyccapt.calibration.mc import mc_tools
@@ -15,11 +14,10 @@ def test_tof2mcSimple_check_return_type():
     yDet = 50
     flightPathLength = 20
     response = mc_tools.tof2mcSimple(t, t0, V, xDet, yDet, flightPathLength)
-    assert isinstance(response,np.float64)
+    assert isinstance(response, np.float64)
 
 
-@patch.object(mc_tools.logger, "critical")
-def test_tof2mcSimple_check_data_type_of_args(mock):
+def test_tof2mcSimple_check_data_type_of_args(capsys):
 
     t = "200" # String passed while the function is expecting int/float
     t0 = 100
@@ -28,45 +26,92 @@ def test_tof2mcSimple_check_data_type_of_args(mock):
     yDet = 50
     flightPathLength = 20
     response = mc_tools.tof2mcSimple(t, t0, V, xDet, yDet, flightPathLength)
-    mock.assert_called_with("Data type of the passed argument is incorrect")
+    assert response is None
+    assert "Data type of the passed argument is incorrect" in capsys.readouterr().out
 
 
 def test_tof2mc_check_return_type():
-    t = 200
+    t = np.array([200.0])
     t0 = 100
-    V = 12
-    V_pulse = 12
-    xDet = 100
-    yDet = 50
+    V = np.array([12.0])
+    V_pulse = np.array([12.0])
+    xDet = np.array([100.0])
+    yDet = np.array([50.0])
     flightPathLength = 20
-    response = mc_tools.tof2mc(t, t0, V, V_pulse, xDet, yDet, flightPathLength)
-    assert isinstance(response,np.float64)
+    response = mc_tools.tof2mc(t, t0, V, xDet, yDet, flightPathLength, V_pulse)
+    assert isinstance(response, np.ndarray) and response.dtype == np.float64
 
 
-@patch.object(mc_tools.logger, "critical")
-def test_tof2mc_check_data_type_of_args(mock):
+def test_tof2mc_check_data_type_of_args(capsys):
 
-    t = "200" # String passed while the function is expecting int/float
+    t = np.array(["200"]) # String passed while the function is expecting int/float
     t0 = 100
-    V = 12
-    V_pulse = 12
-    xDet = 100
-    yDet = 50
+    V = np.array([12.0])
+    V_pulse = np.array([12.0])
+    xDet = np.array([100.0])
+    yDet = np.array([50.0])
     flightPathLength = 20
-    response = mc_tools.tof2mc(t, t0, V, V_pulse, xDet, yDet, flightPathLength)
-    mock.assert_called_with("Data type of the passed argument is incorrect")
+    response = mc_tools.tof2mc(t, t0, V, xDet, yDet, flightPathLength, V_pulse)
+    assert response is None
+    assert "Data type of the passed argument is incorrect" in capsys.readouterr().out
 
 
-@patch.object(mc_tools.logger, "critical")
-def test_tof2mc_check_mode(mock):
+def test_tof2mc_check_mode():
 
-    t = 200
+    t = np.array([200.0])
     t0 = 100
-    V = 12
-    V_pulse = 12
-    xDet = 100
-    yDet = 50
+    V = np.array([12.0])
+    V_pulse = np.array([12.0])
+    xDet = np.array([100.0])
+    yDet = np.array([50.0])
     flightPathLength = 20
     mode = "wrong_mode"
-    response = mc_tools.tof2mc(t, t0, V, V_pulse, xDet, yDet, flightPathLength, mode)
-    mock.assert_called_with("Enter correct mode type")
\ No newline at end of file
+    with pytest.raises(ValueError):
+        mc_tools.tof2mc(t, t0, V, xDet, yDet, flightPathLength, V_pulse, mode)
+
+
+def _reference(t, t0, V, xDet, yDet, flightPathLength, V_pulse, mode):
+    t = (t - t0) * 1E-9
+    distance = np.sqrt((xDet * 1E-2) ** 2 + (yDet * 1E-2) ** 2 + (flightPathLength * 1E-3) ** 2)
+    if mode == 'voltage':
+        V = 1.015 * (V + 0.7 * V_pulse)
+    return 2 * V * 1.6E-19 * (t / distance) ** 2 / 1.66E-27
+
+
+def _dld_arrays(dld_data):
+    return tuple(dld_data[column].to_numpy().astype(np.float64)
+                 for column in ['t (ns)', 'high_voltage (V)', 'x_det (cm)', 'y_det (cm)', 'pulse'])
+
+
+def test_tof2mc_matches_formula(dld_data):
+    t, V, x, y, V_pulse = _dld_arrays(dld_data)
+    for mode in ('voltage', 'laser'):
+        mc = mc_tools.tof2mc(t, 38, V, x, y, 110, V_pulse, mode=mode)
+        assert mc.dtype == np.float64
+        assert np.allclose(mc, _reference(t, 38, V, x, y, 110, V_pulse, mode), rtol=1e-12)
+    with pytest.raises(ValueError):
+        mc_tools.tof2mc(t, 38, V, x, y, 110, V_pulse, mode='other')
+
+
+def test_tof2mc_float32_and_out(dld_data):
+    t, V, x, y, V_pulse = _dld_arrays(dld_data)
+    expected = _reference(t, 38, V, x, y, 110, V_pulse, 'voltage')
+    mc = mc_tools.tof2mc(t.astype(np.float32), 38, V.astype(np.float32), x, y, 110, V_pulse, dtype=np.float32)
+    assert mc.dtype == np.float32 and np.allclose(mc, expected, rtol=1e-5)
+    out = np.zeros(len(t), dtype=np.float32)
+    assert mc_tools.tof2mc(t, 38, V, x, y, 110, V_pulse, out=out) is out
+    assert np.allclose(out, expected, rtol=1e-6)
+    # out must be a C-contiguous array of the shape of the result with the requested dtype
+    for bad_out, dtype in [(np.zeros(2 * len(t))[::2], None), (np.zeros((2, len(t) // 2)), None),
+                           (np.zeros(len(t)), np.float32)]:
+        with pytest.raises(ValueError):
+            mc_tools.tof2mc(t, 38, V, x, y, 110, V_pulse, dtype=dtype, out=bad_out)
+
+
+def test_tof2mc_simple_shares_the_kernel(dld_data):
+    t, V, x, y, _ = _dld_arrays(dld_data)
+    assert np.allclose(mc_tools.tof2mcSimple(t, 38, V, x, y, 110), _reference(t, 38, V, x, y, 110, None, 'laser'),
+                       rtol=1e-12)
+    mc = mc_tools.tof2mcSimple(200, 100, 12, 1, 0.5, 20)
+    assert isinstance(mc, np.float64) and np.isclose(mc, _reference(200, 100, 12, 1, 0.5, 20, None, 'laser'))
+    assert mc_tools.tof2mcSimple('200', 100, 12, 1, 0.5, 20) is None
@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+# Local module and scripts
+from pyccapt.calibration.data_tools import merge_range
+
+
+@pytest.fixture()
+def range_df():
+    return pd.DataFrame({'name': ['Al', 'O', 'Al2', 'H'], 'ion': ['Al+', 'O+', 'Al2+', 'H+'],
+                         'mass': [27.0, 16.0, 13.5, 1.0], 'mc': [27.0, 16.0, 13.5, 1.0],
+                         'mc_low': [26.5, 15.5, 13.0, 0.5], 'mc_up': [27.5, 16.5, 14.0, 15.6],
+                         'color': ['#ff0000', '#00ff00', '#0000ff', '#ffffff'],
+                         'element': [['Al'], ['O'], ['Al'], ['H']], 'complex': [[1], [1], [1], [1]],
+                         'isotope': [[27], [16], [27], [1]], 'charge': [1, 1, 2, 1]})
+
+
+def _brute_force(mc, range_df):
+    mask = (range_df['mc_low'].values[:, None] <= mc) & (range_df['mc_up'].values[:, None] >= mc)
+    return np.where(mask.any(axis=0), mask.argmax(axis=0), -1)
+
+
+def test_label_matches_brute_force(range_df):
+    rng = np.random.default_rng(2)
+    mc = np.concatenate([rng.uniform(0, 30, 5000), range_df['mc_low'], range_df['mc_up'], [np.nan, -1]])
+    data = pd.DataFrame({'mc (Da)': mc})
+    range_id = merge_range.label_by_range(data, range_df, chunk_size=999)
+    assert range_id.dtype == np.int8
+    assert np.array_equal(range_id, _brute_force(mc, range_df))
+
+
+def test_overlap_policies(range_df):
+    labeler = merge_range.RangeLabeler(range_df, overlap='narrowest')
+    assert labeler.overlapping == [(1, 3), (2, 3)]
+    # 13.5 is in Al2 and H, 15.55 is in O and H: the narrower range wins
+    assert list(labeler.label([13.5, 15.55, 5])) == [2, 1, 3]
+    assert list(merge_range.RangeLabeler(range_df).label([15.55])) == [1]
+    with pytest.raises(ValueError):
+        merge_range.RangeLabeler(range_df, overlap='error')
+
+
+def test_merge_by_range_columns(range_df):
+    data = pd.DataFrame({'mc (Da)': [27.0, 20.0, 13.2]})
+    merged = merge_range.merge_by_range(data, range_df, full=True)
+    assert list(merged['name'][[0, 2]]) == ['Al', 'Al2']
+    assert np.isnan(merged['name'][1]) and merged['element'][1] == 'noise' and merged['color'][1] == 'black'
+    assert merged['charge'].tolist()[0] == 1 and np.isnan(merged['charge'][1])
+    assert 'name' not in data
@@ -0,0 +1,82 @@
+import numpy as np
+
+# Local module and scripts
+from pyccapt.calibration.data_tools import raw_data_surface_concept
+
+
+def test_group_signals_matches_loop(raw_signals):
+    start_counter, channel, time_data, high_voltage, pulse = raw_signals
+    groups, signals = raw_data_surface_concept.group_signals(start_counter, channel, time_data, high_voltage,
+                                                              pulse)
+    result = raw_data_surface_concept.find_consecutive_sequences(start_counter, channel, time_data, high_voltage,
+                                                                 pulse)
+    assert len(groups) == len(result)
+    assert np.array_equal(np.sort(signals['index']), np.arange(len(start_counter)))
+    # The loop does not reorder the last group
+    for group, sequence in zip(groups[:-1], result[:-1]):
+        part = signals[group['offset']:group['offset'] + group['length']]
+        assert group['length'] == sequence['length']
+        assert list(part['channel']) == list(sequence['channels'])
+        assert list(part['time_data']) == list(sequence['time_data'])
+        if group['length'] > 4:
+            assert group['valid_events'] == sum(sequence['valid_event'])
+            assert list(part['valid'][::4]) == sequence['valid_event']
+        elif group['length'] == 4:
+            assert group['valid_events'] == (list(part['channel']) == [0, 1, 2, 3])
+
+
+def test_group_statistics(raw_signals):
+    start_counter, channel, time_data, _, _ = raw_signals
+    groups, _ = raw_data_surface_concept.group_signals(start_counter, channel, time_data)
+    stats = raw_data_surface_concept.group_statistics(groups)
+    assert stats['total_signals'] == len(start_counter)
+    assert sum(stats['groups'].values()) == len(groups)
+    assert stats['groups']['4 channel'] == np.count_nonzero(groups['length'] == 4)
+    assert stats['signals']['multi hit'] == groups['length'][groups['length'] > 4].sum()
+    assert np.isnan(groups['high_voltage']).all()
+
+
+def test_assemble_quartets_on_a_chunk(raw_signals):
+    start_counter, channel, time_data, _, _ = raw_signals
+    groups, signals = raw_data_surface_concept.group_signals(start_counter, channel, time_data)
+    chunk = groups[100:200]
+    chunk = chunk[chunk['length'] > 4]
+    first = groups['offset'][100]
+    last = groups['offset'][200]
+    # Offsets relative to the chunk of the raw arrays
+    order, valid, valid_events = raw_data_surface_concept.assemble_quartets(channel[first:last],
+                                                                            chunk['offset'] - first,
+                                                                            chunk['length'])
+    expected = np.concatenate([signals[g['offset']:g['offset'] + g['length']] for g in chunk])
+    assert np.array_equal(order + first, expected['index'])
+    assert np.array_equal(valid, expected['valid'])
+    assert np.array_equal(valid_events, chunk['valid_events'])
+
+
+def test_assemble_quartets_other_channels_last():
+    channel = np.array([5, 1, 0, 3, 2, 0, 1], dtype=np.uint32)
+    order, valid, valid_events = raw_data_surface_concept.assemble_quartets(channel, [0], [7])
+    assert list(channel[order]) == [0, 1, 2, 3, 0, 1, 5]
+    assert list(valid) == [True] * 4 + [False] * 3 and list(valid_events) == [1]
+
+
+def test_top_repeated_runs():
+    rng = np.random.default_rng(7)
+    values = np.repeat(rng.integers(0, 5, 3000), rng.integers(1, 40, 3000))
+    starts, ends, lengths, run_values = raw_data_surface_concept.top_repeated_runs(values, 25)
+
+    # Reference: all runs sorted by length (descending), then by start
+    all_starts, all_lengths, _ = raw_data_surface_concept.run_lengths(values)
+    order = np.lexsort((all_starts, -all_lengths))[:25]
+    assert np.array_equal(starts, all_starts[order]) and np.array_equal(lengths, all_lengths[order])
+    for start, end, length, value in zip(starts, ends, lengths, run_values):
+        assert end - start + 1 == length and np.all(values[start:end + 1] == value)
+
+    # Chunks that split runs give the same runs
+    chunks = np.array_split(values, 37)
+    chunked = raw_data_surface_concept.top_repeated_runs_chunked(chunks, 25)
+    for expected, found in zip((starts, ends, lengths, run_values), chunked):
+        assert np.array_equal(expected, found)
+
+    start, end, count, number = raw_data_surface_concept.find_nth_max_repeated_indices(list(values), 2)
+    assert (start, end, count, number) == (starts[2], ends[2], lengths[2], run_values[2])
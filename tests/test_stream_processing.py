@@ -0,0 +1,47 @@
+import h5py
+import numpy as np
+import pytest
+
+# Local module and scripts
+from pyccapt.calibration.data_tools import data_loadcrop, data_tools, hdf5_dataset, stream_processing
+from pyccapt.calibration.mc import mc_tools
+from pyccapt.calibration.reconstructions import reconstruction
+
+
+@pytest.fixture()
+def raw_file(tmp_path):
+    rng = np.random.default_rng(4)
+    n = 5000
+    t = rng.uniform(0, 1000, n)
+    t[::50] = 2000  # over max_tof
+    file_name = tmp_path / 'raw.h5'
+    with h5py.File(file_name, 'w') as f:
+        f.create_dataset('dld/high_voltage', data=np.linspace(3000, 6000, n))
+        f.create_dataset('dld/pulse', data=np.full(n, 500.0))
+        f.create_dataset('dld/start_counter', data=np.arange(n))
+        f.create_dataset('dld/t', data=t)
+        f.create_dataset('dld/x', data=rng.uniform(-3, 3, n))
+        f.create_dataset('dld/y', data=rng.uniform(-3, 3, n))
+    return str(file_name)
+
+
+def test_raw_to_processed_streaming_matches_in_memory(raw_file, tmp_path):
+    params = {'mode': 'Gault', 'kf': 4, 'det_eff': 0.7, 'icf': 1.4, 'field_evap': 16, 'avg_dens': 60}
+    processed_file = str(tmp_path / 'processed.h5')
+    summary = stream_processing.raw_to_processed_streaming(raw_file, processed_file, max_tof=1500,
+                                                           flight_path_length=110, t0=10,
+                                                           reconstruction_params=params, chunk_size=777,
+                                                           verbose=False)
+    data = hdf5_dataset.read_processed_hdf5(processed_file)
+
+    expected = data_tools.remove_invalid_data(data_loadcrop.fetch_dataset_from_dld_grp(raw_file), 1500)
+    assert summary['ions_written'] == len(expected) == len(data)
+    x_det = expected['x_det (cm)'].to_numpy()
+    y_det = expected['y_det (cm)'].to_numpy()
+    hv = expected['high_voltage (V)'].to_numpy()
+    mc = mc_tools.tof2mc(expected['t (ns)'].to_numpy(), 10, hv, x_det, y_det, 110, expected['pulse'].to_numpy())
+    px, py, pz = reconstruction.atom_probe_recons_from_detector_Gault_et_al(x_det, y_det, hv, 110, 4, 0.7, 1.4, 16,
+                                                                           60)
+    assert np.allclose(data['mc_uc (Da)'].to_numpy(), mc, rtol=1e-5)
+    assert np.allclose(data['x (nm)'].to_numpy(), px, rtol=1e-5)
+    assert np.allclose(data['z (nm)'].to_numpy(), pz, rtol=1e-5)
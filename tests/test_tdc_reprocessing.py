@@ -0,0 +1,36 @@
+import h5py
+import numpy as np
+
+# Local module and scripts
+from pyccapt.calibration.data_tools import raw_data_surface_concept, tdc_reprocessing
+
+
+def test_chunk_boundaries_follow_groups():
+    start_counter = np.repeat(np.arange(100), 7)
+    boundaries = tdc_reprocessing.chunk_boundaries(start_counter, 30, window=4)
+    assert boundaries[0][0] == 0 and boundaries[-1][1] == len(start_counter)
+    for (_, stop), (start, _) in zip(boundaries[:-1], boundaries[1:]):
+        assert stop == start and start_counter[start] != start_counter[start - 1]
+
+
+def test_reprocess_tdc_matches_single_pass(tmp_path, raw_signals):
+    path = str(tmp_path / 'raw.h5')
+    start_counter, channel, time_data, high_voltage, pulse = raw_signals
+    with h5py.File(path, 'w') as f:
+        f.create_dataset('tdc/start_counter', data=start_counter)
+        f.create_dataset('tdc/channel', data=channel)
+        f.create_dataset('tdc/time_data', data=time_data)
+        f.create_dataset('tdc/high_voltage', data=high_voltage)
+        f.create_dataset('tdc/voltage_pulse', data=pulse)
+    summary = tdc_reprocessing.reprocess_tdc(path, chunk_size=200, workers=2, verbose=False)
+
+    groups, signals = raw_data_surface_concept.group_signals(start_counter, channel, time_data, high_voltage,
+                                                              pulse)
+    expected = raw_data_surface_concept.reconstruct_events(groups, signals)
+    with h5py.File(path, 'r') as f:
+        assert 'tdc/channel' in f
+        for name in tdc_reprocessing.EVENT_DTYPES:
+            assert np.allclose(f['dld_reprocessed'][name][()], expected[name])
+    assert summary['events'] == len(expected['t']) > 0
+    assert summary['groups']['4 channel'] == np.count_nonzero(groups['length'] == 4)
+    assert not (tmp_path / 'raw.h5.dld_reprocessed.part').exists()
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+# Local module and scripts
+from pyccapt.calibration.data_tools import data_tools, validity_filter
+
+
+MAX_TOF = 5e5
+
+
+@pytest.fixture()
+def raw_data(dld_data):
+    # The raw test file with some ions of each invalid kind
+    data = dld_data.copy()
+    data.loc[::97, 't (ns)'] = 2 * MAX_TOF
+    data.loc[::89, 'high_voltage (V)'] = -1
+    data.loc[::83, ['x_det (cm)', 'y_det (cm)']] = 0
+    return data
+
+
+def test_filter_valid_matches_masks_and_counts(raw_data):
+    data = raw_data
+    t = data['t (ns)'].to_numpy()
+    expected = ~((t > MAX_TOF) | (t < 50) | (data['high_voltage (V)'].to_numpy() < 0) |
+                 ((data['x_det (cm)'].to_numpy() == 0) & (data['y_det (cm)'].to_numpy() == 0)))
+
+    valid, counts = validity_filter.filter_valid(data, validity_filter.default_rules(MAX_TOF), block_size=333)
+    assert np.array_equal(valid['start_counter'].to_numpy(), data['start_counter'].to_numpy()[expected])
+    assert sum(counts.values()) == len(data) - np.count_nonzero(expected)
+    assert counts['tof > max_tof'] == np.count_nonzero(t > MAX_TOF)
+    assert np.array_equal(data_tools.invalid_data_mask(data, MAX_TOF), ~expected)
+
+
+def test_voltage_glitch_rule_across_blocks():
+    high_voltage = np.full(100, 5000.0)
+    high_voltage[[0, 9, 10, 50, 99]] = 7000
+    data = {'high_voltage (V)': high_voltage}
+    rules = [validity_filter.voltage_glitch_rule(500)]
+    for block_size in (10, 1000):
+        keep, counts = validity_filter.evaluate_rules(data, rules, block_size=block_size)
+        # 9 and 10 are a step of two ions, 0 and 99 have only one neighbour
+        assert np.array_equal(np.flatnonzero(~keep), [50])
+        assert counts == {'voltage glitch': 1}
+
+
+def test_drop_invalid_in_place(raw_data):
+    data = raw_data
+    num_ions = len(data)
+    expected = data[data['t (ns)'] <= MAX_TOF].reset_index(drop=True)
+    counts = validity_filter.drop_invalid(data, [validity_filter.tof_max_rule(MAX_TOF)])
+    assert counts['tof > max_tof'] == num_ions - len(expected)
+    pd.testing.assert_frame_equal(data, expected)